@@ -12,22 +12,30 @@
 --
 -- ########################################################################
 
-create table glioma__cohort_casedef_index as
-WITH
-first_match as (
-    select      min(enc_period_start_day) as index_date,
-                subject_ref
-    from        glioma__cohort_casedef
-    where       dx_category_code is NOT NULL
-    group by    subject_ref
-)
+
+create or replace view glioma__cohort_casedef_index as
 select
-        first_match.index_date,
-        SP.*
-from
-        glioma__cohort_study_population as SP,
-        first_match
-where
-        SP.subject_ref = first_match.subject_ref
-and     SP.enc_period_start_day = first_match.index_date
-;
\ No newline at end of file
+        index_date,
+        status,
+        age_at_visit,
+        gender,
+        race_display,
+        ethnicity_display,
+        enc_period_ordinal,
+        enc_period_start_day,
+        enc_period_start_week,
+        enc_period_start_month,
+        enc_period_start_year,
+        enc_period_end_day,
+        enc_class_code,
+        enc_servicetype_code,
+        enc_servicetype_system,
+        enc_servicetype_display,
+        enc_type_code,
+        enc_type_system,
+        enc_type_display,
+        subject_ref,
+        encounter_ref
+from    glioma__cohort_casedef_period
+where   period = 'index'
+;
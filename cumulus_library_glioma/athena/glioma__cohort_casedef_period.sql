@@ -0,0 +1,30 @@
+-- ###############################]#########################################
+-- "IndexDate" is the technical term for cohort based studies
+--
+--  The index date is frequently the date when individuals enter the study cohort
+--  (e.g., enrollment date or the start of exposure to a treatment or risk factor).
+--
+--
+-- "Pre" = pre-exposure (for drug/treatment studies) or
+-- "Pre" = pre-diagnosis (for disease studies)
+-- "Post" = post-exposure (for drug/treatment studies) or
+-- "Post" = post-diagnosis (for disease studies)
+--
+-- ########################################################################
+
+
+create table glioma__cohort_casedef_period as
+select
+        case
+        when (SP.enc_period_start_day < index_date.index_date) then 'pre'
+        when (SP.enc_period_start_day = index_date.index_date) then 'index'
+        else 'post' end as period,
+        index_date.index_date,
+        SP.*
+from
+        glioma__cohort_study_population as SP,
+        glioma__cohort_index_date       as index_date
+where
+        SP.subject_ref = index_date.subject_ref
+and     SP.enc_period_start_day is NOT NULL
+;
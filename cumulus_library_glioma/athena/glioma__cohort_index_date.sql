@@ -0,0 +1,53 @@
+-- ###############################]#########################################
+-- "IndexDate" is the technical term for cohort based studies
+--
+--  The index date is frequently the date when individuals enter the study cohort
+--  (e.g., enrollment date or the start of exposure to a treatment or risk factor).
+--
+--  One row per subject: the first casedef diagnosis date, the index encounter
+--  and the first dx code. Ties on the index date are broken by encounter_ref,
+--  dx_system, dx_code so the index encounter is deterministic.
+--
+-- ########################################################################
+
+create table glioma__cohort_index_date as
+WITH
+first_match as (
+    select      min(enc_period_start_day) as index_date,
+                subject_ref
+    from        glioma__cohort_casedef
+    where       dx_category_code is NOT NULL
+    group by    subject_ref
+),
+index_encounter as (
+    select      casedef.subject_ref,
+                casedef.encounter_ref,
+                casedef.dx_code,
+                casedef.dx_system,
+                casedef.dx_display,
+                ROW_NUMBER() OVER (
+                    PARTITION   BY  casedef.subject_ref
+                    ORDER       BY  casedef.encounter_ref,
+                                    casedef.dx_system,
+                                    casedef.dx_code
+                )   as tie_break
+    from        glioma__cohort_casedef as casedef,
+                first_match
+    where       casedef.subject_ref = first_match.subject_ref
+    and         casedef.enc_period_start_day = first_match.index_date
+    and         casedef.dx_category_code is NOT NULL
+)
+select
+        first_match.index_date,
+        index_encounter.encounter_ref   as index_encounter_ref,
+        index_encounter.dx_code         as index_dx_code,
+        index_encounter.dx_system       as index_dx_system,
+        index_encounter.dx_display      as index_dx_display,
+        first_match.subject_ref
+from
+        first_match,
+        index_encounter
+where
+        first_match.subject_ref = index_encounter.subject_ref
+and     index_encounter.tie_break = 1
+;
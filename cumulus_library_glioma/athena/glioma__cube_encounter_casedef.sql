@@ -1,4 +1,4 @@
-CREATE or replace VIEW glioma__cube_encounter_casedef AS 
+CREATE TABLE glioma__cube_encounter_casedef AS (
     WITH
     filtered_table AS (
         SELECT
@@ -96,4 +96,4 @@ CREATE or replace VIEW glioma__cube_encounter_casedef AS
     WHERE 
         p.cnt_subject_ref >= 1
         AND s.cnt_encounter_ref >= 1
-;
\ No newline at end of file
+);
\ No newline at end of file
@@ -78,15 +78,100 @@ CREATE or replace VIEW glioma__cube_patient_llm_gene AS
             ) AS id
         FROM null_replacement
         GROUP BY
-            cube(
-            "braf_altered",
-            "braf_fusion",
-            "braf_v600e",
-            "cdkn2a_deleted",
-            "h3k27m_mutant",
-            "has_mention",
-            "idh_mutant",
-            "tp53_altered"
+            GROUPING SETS (
+            (),
+            ("braf_altered"),
+            ("braf_fusion"),
+            ("braf_v600e"),
+            ("cdkn2a_deleted"),
+            ("h3k27m_mutant"),
+            ("has_mention"),
+            ("idh_mutant"),
+            ("tp53_altered"),
+            ("braf_altered", "braf_fusion"),
+            ("braf_altered", "braf_v600e"),
+            ("braf_altered", "cdkn2a_deleted"),
+            ("braf_altered", "h3k27m_mutant"),
+            ("braf_altered", "has_mention"),
+            ("braf_altered", "idh_mutant"),
+            ("braf_altered", "tp53_altered"),
+            ("braf_fusion", "braf_v600e"),
+            ("braf_fusion", "cdkn2a_deleted"),
+            ("braf_fusion", "h3k27m_mutant"),
+            ("braf_fusion", "has_mention"),
+            ("braf_fusion", "idh_mutant"),
+            ("braf_fusion", "tp53_altered"),
+            ("braf_v600e", "cdkn2a_deleted"),
+            ("braf_v600e", "h3k27m_mutant"),
+            ("braf_v600e", "has_mention"),
+            ("braf_v600e", "idh_mutant"),
+            ("braf_v600e", "tp53_altered"),
+            ("cdkn2a_deleted", "h3k27m_mutant"),
+            ("cdkn2a_deleted", "has_mention"),
+            ("cdkn2a_deleted", "idh_mutant"),
+            ("cdkn2a_deleted", "tp53_altered"),
+            ("h3k27m_mutant", "has_mention"),
+            ("h3k27m_mutant", "idh_mutant"),
+            ("h3k27m_mutant", "tp53_altered"),
+            ("has_mention", "idh_mutant"),
+            ("has_mention", "tp53_altered"),
+            ("idh_mutant", "tp53_altered"),
+            ("braf_altered", "braf_fusion", "braf_v600e"),
+            ("braf_altered", "braf_fusion", "cdkn2a_deleted"),
+            ("braf_altered", "braf_fusion", "h3k27m_mutant"),
+            ("braf_altered", "braf_fusion", "has_mention"),
+            ("braf_altered", "braf_fusion", "idh_mutant"),
+            ("braf_altered", "braf_fusion", "tp53_altered"),
+            ("braf_altered", "braf_v600e", "cdkn2a_deleted"),
+            ("braf_altered", "braf_v600e", "h3k27m_mutant"),
+            ("braf_altered", "braf_v600e", "has_mention"),
+            ("braf_altered", "braf_v600e", "idh_mutant"),
+            ("braf_altered", "braf_v600e", "tp53_altered"),
+            ("braf_altered", "cdkn2a_deleted", "h3k27m_mutant"),
+            ("braf_altered", "cdkn2a_deleted", "has_mention"),
+            ("braf_altered", "cdkn2a_deleted", "idh_mutant"),
+            ("braf_altered", "cdkn2a_deleted", "tp53_altered"),
+            ("braf_altered", "h3k27m_mutant", "has_mention"),
+            ("braf_altered", "h3k27m_mutant", "idh_mutant"),
+            ("braf_altered", "h3k27m_mutant", "tp53_altered"),
+            ("braf_altered", "has_mention", "idh_mutant"),
+            ("braf_altered", "has_mention", "tp53_altered"),
+            ("braf_altered", "idh_mutant", "tp53_altered"),
+            ("braf_fusion", "braf_v600e", "cdkn2a_deleted"),
+            ("braf_fusion", "braf_v600e", "h3k27m_mutant"),
+            ("braf_fusion", "braf_v600e", "has_mention"),
+            ("braf_fusion", "braf_v600e", "idh_mutant"),
+            ("braf_fusion", "braf_v600e", "tp53_altered"),
+            ("braf_fusion", "cdkn2a_deleted", "h3k27m_mutant"),
+            ("braf_fusion", "cdkn2a_deleted", "has_mention"),
+            ("braf_fusion", "cdkn2a_deleted", "idh_mutant"),
+            ("braf_fusion", "cdkn2a_deleted", "tp53_altered"),
+            ("braf_fusion", "h3k27m_mutant", "has_mention"),
+            ("braf_fusion", "h3k27m_mutant", "idh_mutant"),
+            ("braf_fusion", "h3k27m_mutant", "tp53_altered"),
+            ("braf_fusion", "has_mention", "idh_mutant"),
+            ("braf_fusion", "has_mention", "tp53_altered"),
+            ("braf_fusion", "idh_mutant", "tp53_altered"),
+            ("braf_v600e", "cdkn2a_deleted", "h3k27m_mutant"),
+            ("braf_v600e", "cdkn2a_deleted", "has_mention"),
+            ("braf_v600e", "cdkn2a_deleted", "idh_mutant"),
+            ("braf_v600e", "cdkn2a_deleted", "tp53_altered"),
+            ("braf_v600e", "h3k27m_mutant", "has_mention"),
+            ("braf_v600e", "h3k27m_mutant", "idh_mutant"),
+            ("braf_v600e", "h3k27m_mutant", "tp53_altered"),
+            ("braf_v600e", "has_mention", "idh_mutant"),
+            ("braf_v600e", "has_mention", "tp53_altered"),
+            ("braf_v600e", "idh_mutant", "tp53_altered"),
+            ("cdkn2a_deleted", "h3k27m_mutant", "has_mention"),
+            ("cdkn2a_deleted", "h3k27m_mutant", "idh_mutant"),
+            ("cdkn2a_deleted", "h3k27m_mutant", "tp53_altered"),
+            ("cdkn2a_deleted", "has_mention", "idh_mutant"),
+            ("cdkn2a_deleted", "has_mention", "tp53_altered"),
+            ("cdkn2a_deleted", "idh_mutant", "tp53_altered"),
+            ("h3k27m_mutant", "has_mention", "idh_mutant"),
+            ("h3k27m_mutant", "has_mention", "tp53_altered"),
+            ("h3k27m_mutant", "idh_mutant", "tp53_altered"),
+            ("has_mention", "idh_mutant", "tp53_altered")
             )
     )
 
@@ -71,14 +71,71 @@ CREATE or replace VIEW glioma__cube_patient_llm_surgery AS
             ) AS id
         FROM null_replacement
         GROUP BY
-            cube(
-            "anatomical_site",
-            "approach",
-            "complications",
-            "extent_of_resection",
-            "has_mention",
-            "surgical_type",
-            "technique_details"
+            GROUPING SETS (
+            (),
+            ("anatomical_site"),
+            ("approach"),
+            ("complications"),
+            ("extent_of_resection"),
+            ("has_mention"),
+            ("surgical_type"),
+            ("technique_details"),
+            ("anatomical_site", "approach"),
+            ("anatomical_site", "complications"),
+            ("anatomical_site", "extent_of_resection"),
+            ("anatomical_site", "has_mention"),
+            ("anatomical_site", "surgical_type"),
+            ("anatomical_site", "technique_details"),
+            ("approach", "complications"),
+            ("approach", "extent_of_resection"),
+            ("approach", "has_mention"),
+            ("approach", "surgical_type"),
+            ("approach", "technique_details"),
+            ("complications", "extent_of_resection"),
+            ("complications", "has_mention"),
+            ("complications", "surgical_type"),
+            ("complications", "technique_details"),
+            ("extent_of_resection", "has_mention"),
+            ("extent_of_resection", "surgical_type"),
+            ("extent_of_resection", "technique_details"),
+            ("has_mention", "surgical_type"),
+            ("has_mention", "technique_details"),
+            ("surgical_type", "technique_details"),
+            ("anatomical_site", "approach", "complications"),
+            ("anatomical_site", "approach", "extent_of_resection"),
+            ("anatomical_site", "approach", "has_mention"),
+            ("anatomical_site", "approach", "surgical_type"),
+            ("anatomical_site", "approach", "technique_details"),
+            ("anatomical_site", "complications", "extent_of_resection"),
+            ("anatomical_site", "complications", "has_mention"),
+            ("anatomical_site", "complications", "surgical_type"),
+            ("anatomical_site", "complications", "technique_details"),
+            ("anatomical_site", "extent_of_resection", "has_mention"),
+            ("anatomical_site", "extent_of_resection", "surgical_type"),
+            ("anatomical_site", "extent_of_resection", "technique_details"),
+            ("anatomical_site", "has_mention", "surgical_type"),
+            ("anatomical_site", "has_mention", "technique_details"),
+            ("anatomical_site", "surgical_type", "technique_details"),
+            ("approach", "complications", "extent_of_resection"),
+            ("approach", "complications", "has_mention"),
+            ("approach", "complications", "surgical_type"),
+            ("approach", "complications", "technique_details"),
+            ("approach", "extent_of_resection", "has_mention"),
+            ("approach", "extent_of_resection", "surgical_type"),
+            ("approach", "extent_of_resection", "technique_details"),
+            ("approach", "has_mention", "surgical_type"),
+            ("approach", "has_mention", "technique_details"),
+            ("approach", "surgical_type", "technique_details"),
+            ("complications", "extent_of_resection", "has_mention"),
+            ("complications", "extent_of_resection", "surgical_type"),
+            ("complications", "extent_of_resection", "technique_details"),
+            ("complications", "has_mention", "surgical_type"),
+            ("complications", "has_mention", "technique_details"),
+            ("complications", "surgical_type", "technique_details"),
+            ("extent_of_resection", "has_mention", "surgical_type"),
+            ("extent_of_resection", "has_mention", "technique_details"),
+            ("extent_of_resection", "surgical_type", "technique_details"),
+            ("has_mention", "surgical_type", "technique_details")
             )
     )
 
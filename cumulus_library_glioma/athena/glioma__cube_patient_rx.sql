@@ -1,4 +1,4 @@
-CREATE or replace VIEW glioma__cube_patient_rx AS 
+CREATE TABLE glioma__cube_patient_rx AS (
     WITH
     filtered_table AS (
         SELECT
@@ -103,4 +103,4 @@ CREATE or replace VIEW glioma__cube_patient_rx AS
     FROM powerset AS p
     WHERE 
         p.cnt_subject_ref >= 10
-;
\ No newline at end of file
+);
\ No newline at end of file
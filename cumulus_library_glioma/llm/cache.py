@@ -0,0 +1,153 @@
+"""
+Content-addressed cache of LLM extraction results.
+
+Results are keyed by (normalized note text hash, JSON-schema hash of
+`GliomaCaseAnnotation`, model id, prompt version), so re-running extraction after
+a cohort refresh only pays for new or edited notes, and any change to the schema,
+model or prompt misses the cache instead of returning stale annotations.
+
+Stored in SQLite, evicted by age and by total size (least recently used first).
+The cache holds note text spans (PHI), so it defaults to the user cache folder
+(see `filetool.path_cache`) and never to the package folder that is built into
+the sdist; set `LLM_CACHE` or `--file` to place it elsewhere.
+
+    python -m cumulus_library_glioma.llm.cache [--file F] [--max-mb 512] [--max-days 180]
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from pathlib import Path
+from cumulus_library_glioma.tools import filetool
+from cumulus_library_glioma.llm.pydantic_schema.annotation import GliomaCaseAnnotation
+
+CACHE_FILE = os.environ.get('LLM_CACHE') or filetool.path_cache('llmcache.sqlite')
+
+SQL_CREATE = """
+create table if not exists results (
+    note_hash       text not null,
+    schema_hash     text not null,
+    model           text not null,
+    prompt_version  text not null,
+    result          text not null,
+    prompt_tokens   integer,
+    completion_tokens integer,
+    size            integer not null,
+    created         real not null,
+    last_used       real not null,
+    primary key (note_hash, schema_hash, model, prompt_version)
+)"""
+
+def normalize_text(text: str) -> str:
+    """
+    :return: text with whitespace collapsed, re-exported notes with different line endings hash the same
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+def note_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+def schema_hash(model_class=GliomaCaseAnnotation) -> str:
+    schema = json.dumps(model_class.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """
+    SQLite cache of validated `GliomaCaseAnnotation` results, with hit rate.
+    """
+    def __init__(self, cache_file: Path | str = None):
+        """
+        :param cache_file: SQLite file, default `CACHE_FILE`
+        """
+        self.file = Path(cache_file if cache_file else CACHE_FILE)
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.file, check_same_thread=False)
+        self.con.execute('pragma journal_mode=wal')
+        self.con.execute(SQL_CREATE)
+        self.schema_hash = schema_hash()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str, model: str, prompt_version: str) -> tuple:
+        return note_hash(text), self.schema_hash, model, prompt_version
+
+    def get(self, text: str, model: str, prompt_version: str) -> dict | None:
+        """
+        :param text: note text, normalized before hashing
+        :return: cached result dict, or None on a miss
+        """
+        key = self.key(text, model, prompt_version)
+        row = self.con.execute('select result from results where note_hash = ? and schema_hash = ? '
+                               'and model = ? and prompt_version = ?', key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.con.execute('update results set last_used = ? where note_hash = ? and schema_hash = ? '
+                         'and model = ? and prompt_version = ?', (time.time(),) + key)
+        return json.loads(row[0])
+
+    def put(self, text: str, model: str, prompt_version: str, result: dict, usage: dict = None) -> None:
+        """
+        :param result: validated annotation, as dict
+        :param usage: chat completions usage, kept to report tokens saved
+        """
+        usage = usage or dict()
+        data = json.dumps(result)
+        now = time.time()
+        self.con.execute('insert or replace into results values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         self.key(text, model, prompt_version) +
+                         (data, usage.get('prompt_tokens'), usage.get('completion_tokens'), len(data), now, now))
+        self.con.commit()
+
+    def evict(self, max_bytes: int = None, max_age_days: float = None) -> int:
+        """
+        :param max_bytes: keep the most recently used results up to this total size
+        :param max_age_days: remove results not used for this many days
+        :return: number of results removed
+        """
+        removed = 0
+        if max_age_days is not None:
+            removed += self.con.execute('delete from results where last_used < ?',
+                                        (time.time() - max_age_days * 86400,)).rowcount
+        if max_bytes is not None:
+            removed += self.con.execute('delete from results where rowid in ('
+                                        '  select rowid from ('
+                                        '    select rowid, sum(size) over (order by last_used desc, rowid) as total'
+                                        '    from results)'
+                                        '  where total > ?)', (max_bytes,)).rowcount
+        self.con.commit()
+        return removed
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> dict:
+        count, size = self.con.execute('select count(*), coalesce(sum(size), 0) from results').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hit_rate(), 3),
+                'results': count, 'bytes': size}
+
+    def close(self) -> None:
+        self.con.commit()
+        self.con.close()
+
+def print_report(report: dict) -> None:
+    print(f"cache hits {report['hits']} misses {report['misses']} (hit rate {report['hit_rate']:.1%}), "
+          f"{report['results']} results {report['bytes'] / 2 ** 20:.1f} MB")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evict and report the LLM result cache')
+    parser.add_argument('--file', default=CACHE_FILE, help='SQLite cache file')
+    parser.add_argument('--max-mb', type=float, help='keep the most recently used results up to this size')
+    parser.add_argument('--max-days', type=float, help='remove results not used for this many days')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.file)
+    removed = cache.evict(int(args.max_mb * 2 ** 20) if args.max_mb else None, args.max_days)
+    print(f'evicted {removed}')
+    print_report(cache.report())
+    cache.close()
@@ -0,0 +1,212 @@
+"""
+Section-aware chunking of long notes, and deterministic merge of the chunk annotations.
+
+Long notes are split on clinical section headers (PATHOLOGY:, Molecular:,
+IMPRESSION AND PLAN:, ...), consecutive sections are grouped into chunks of at
+most `CHUNK_TOKENS` estimated tokens, and every chunk is extracted as its own
+request, so one note runs on several connections at once. The partial
+`GliomaCaseAnnotation` results are merged (map-reduce):
+
+* single-valued mentions (topography, morphology, behavior, grade): the coded
+  mention most chunks agree on wins, ties go to the more authoritative section
+  (pathology and molecular before impression, before plan), then to the mention
+  with more spans, then to the earlier chunk. Spans of agreeing chunks are kept.
+* list mentions (target genetic test, variant, cancer medication, surgery): union
+  in chunk order, mentions equal except for their spans are merged into one.
+
+    python -m cumulus_library_glioma.llm.chunking NDJSON [NDJSON ...] [--max-tokens 2000]
+"""
+import re
+import json
+import argparse
+from typing import List
+from cumulus_library_glioma.llm.packing import estimate_tokens
+
+CHUNK_TOKENS = 2000
+
+SINGLE_MENTIONS = ['topography_mention', 'morphology_mention', 'behavior_mention', 'grade_mention']
+LIST_MENTIONS = ['target_genetic_test_mention', 'variant_mention', 'cancer_medication_mention', 'surgery_mention']
+
+SECTION_PRIORITY = {
+    'pathology': 3,
+    'molecular': 3,
+    'genetic': 3,
+    'genomic': 3,
+    'diagnosis': 3,
+    'final diagnosis': 3,
+    'impression': 2,
+    'assessment': 2,
+    'plan': 1,
+}
+
+SECTION_HEADER = re.compile(r"^[ \t]*(?P<header>[A-Z][A-Za-z0-9 /&,()'-]{1,60}?)[ \t]*(?P<colon>:|$)", re.MULTILINE)
+
+###############################################################################
+#
+# Split
+#
+###############################################################################
+def is_section_header(header: str, colon: bool) -> bool:
+    """
+    :param header: candidate header text at the start of a line
+    :param colon: header is followed by a colon, otherwise it is alone on its line
+    :return: True for upper case headers, or known clinical sections followed by a colon
+    """
+    if header.isupper():
+        return colon or len(header) > 3
+    return colon and header.lower().startswith(tuple(SECTION_PRIORITY.keys()))
+
+def sections(text: str) -> List[tuple]:
+    """
+    :param text: note text
+    :return: list of (header, section text), text before the first header has header ''
+    """
+    starts = [(match.start(), match.group('header').strip()) for match in SECTION_HEADER.finditer(text)
+              if is_section_header(match.group('header').strip(), bool(match.group('colon')))]
+    if not starts or starts[0][0] > 0:
+        starts.insert(0, (0, ''))
+    ends = [start for start, _ in starts[1:]] + [len(text)]
+    return [(header, text[start:end]) for (start, header), end in zip(starts, ends) if text[start:end].strip()]
+
+def split_long(text: str, max_tokens: int) -> List[str]:
+    """
+    :param text: one section over `max_tokens`
+    :return: pieces split on blank lines, then lines, then characters
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    for separator in [r'(\n[ \t]*\n)', r'(\n)']:
+        parts = re.split(separator, text)
+        pieces = [piece for piece in (''.join(parts[pos:pos + 2]) for pos in range(0, len(parts), 2)) if piece]
+        if len(pieces) > 1:
+            return group(pieces, max_tokens)
+    size = max(1, int(max_tokens * len(text) / estimate_tokens(text)))
+    return [text[pos:pos + size] for pos in range(0, len(text), size)]
+
+def group(pieces: List[str], max_tokens: int) -> List[str]:
+    """
+    :param pieces: consecutive pieces of text
+    :return: consecutive pieces joined up to `max_tokens`, pieces over `max_tokens` are split further
+    """
+    chunks, current = list(), ''
+    for piece in pieces:
+        if current and estimate_tokens(current + piece) > max_tokens:
+            chunks.append(current)
+            current = ''
+        if estimate_tokens(piece) > max_tokens:
+            chunks.extend(split_long(piece, max_tokens))
+        else:
+            current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def section_priority(headers: List[str]) -> int:
+    """
+    :param headers: section headers of one chunk
+    :return: highest `SECTION_PRIORITY` of the headers, 0 when none is known
+    """
+    priority = 0
+    for header in headers:
+        for section, value in SECTION_PRIORITY.items():
+            if header.lower().startswith(section):
+                priority = max(priority, value)
+    return priority
+
+def chunk_note(note: dict, max_tokens=CHUNK_TOKENS) -> List[dict]:
+    """
+    :param note: see `extract.read_notes`
+    :param max_tokens: max estimated tokens per chunk
+    :return: chunks, copies of the note with the `text` of the chunk, `chunk` position and its `sections` headers
+    """
+    if estimate_tokens(note['text']) <= max_tokens:
+        return [dict(note, chunk=0, sections=[header for header, _ in sections(note['text'])])]
+    chunks, texts, headers = list(), list(), list()
+    for header, text in sections(note['text']):
+        if texts and estimate_tokens(''.join(texts) + text) > max_tokens:
+            chunks.append((''.join(texts), headers))
+            texts, headers = list(), list()
+        if estimate_tokens(text) > max_tokens:
+            chunks.extend((piece, [header]) for piece in split_long(text, max_tokens))
+        else:
+            texts.append(text)
+            headers.append(header)
+    if texts:
+        chunks.append((''.join(texts), headers))
+    return [dict(note, text=text, chunk=pos, sections=headers) for pos, (text, headers) in enumerate(chunks)]
+
+###############################################################################
+#
+# Merge
+#
+###############################################################################
+def union_spans(mentions: List[dict]) -> List[str]:
+    spans = list()
+    for mention in mentions:
+        spans.extend(span for span in mention.get('spans', []) if span not in spans)
+    return spans
+
+def merge_single(mentions: List[dict], priorities: List[int]) -> dict:
+    """
+    :param mentions: the same single-valued mention of every chunk
+    :param priorities: section priority of every chunk
+    :return: winning mention, with the spans of every chunk agreeing with its code
+    """
+    candidates = [(pos, mention) for pos, mention in enumerate(mentions) if mention.get('has_mention')]
+    if not candidates:
+        return mentions[0]
+    votes = dict()
+    for _, mention in candidates:
+        votes[mention.get('code')] = votes.get(mention.get('code'), 0) + 1
+
+    def score(candidate):
+        pos, mention = candidate
+        return (mention.get('code') is not None, votes[mention.get('code')], priorities[pos],
+                len(mention.get('spans', [])), -pos)
+
+    _, winner = max(candidates, key=score)
+    agreeing = [mention for _, mention in candidates
+                if winner.get('code') is None or mention.get('code') == winner.get('code')]
+    return dict(winner, spans=union_spans(agreeing))
+
+def merge_list(mention_lists: List[List[dict]]) -> List[dict]:
+    """
+    :param mention_lists: the same list mention of every chunk
+    :return: union in chunk order, mentions equal except for their spans merged into one
+    """
+    merged = dict()
+    for mentions in mention_lists:
+        for mention in mentions:
+            key = json.dumps({name: value for name, value in mention.items() if name != 'spans'}, sort_keys=True)
+            if key in merged:
+                merged[key] = dict(merged[key], spans=union_spans([merged[key], mention]))
+            else:
+                merged[key] = mention
+    return list(merged.values())
+
+def merge(results: List, priorities: List[int] = None) -> dict:
+    """
+    Deterministic merge of chunk annotations, the same chunk results always give the same annotation.
+    :param results: GliomaCaseAnnotation (or its `model_dump(mode='json')` dict) of every chunk, in chunk order
+    :param priorities: section priority of every chunk, see `section_priority`, default all 0
+    :return: merged GliomaCaseAnnotation as dict, same shape as the `result` of output rows
+    """
+    results = [result if isinstance(result, dict) else result.model_dump(mode='json') for result in results]
+    priorities = priorities if priorities else [0] * len(results)
+    merged = {name: merge_single([result[name] for result in results], priorities) for name in SINGLE_MENTIONS}
+    merged.update({name: merge_list([result.get(name, []) for result in results]) for name in LIST_MENTIONS})
+    return merged
+
+if __name__ == '__main__':
+    from cumulus_library_glioma.llm.extract import read_notes
+
+    parser = argparse.ArgumentParser(description='Report section chunks of long notes')
+    parser.add_argument('ndjson', nargs='+', help='DocumentReference ndjson files')
+    parser.add_argument('--max-tokens', type=int, default=CHUNK_TOKENS, help='max estimated tokens per chunk')
+    args = parser.parse_args()
+
+    for note in read_notes(args.ndjson):
+        chunks = chunk_note(note, args.max_tokens)
+        if len(chunks) > 1:
+            print(f"{note['note_ref']}: {estimate_tokens(note['text'])} tokens, {len(chunks)} chunks "
+                  f"{[estimate_tokens(chunk['text']) for chunk in chunks]}")
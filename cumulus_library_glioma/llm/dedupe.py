@@ -0,0 +1,155 @@
+"""
+Near-duplicate note detection with MinHash and LSH, before LLM extraction.
+
+Oncology notes are heavily copy-forwarded: a consult repeats most of the prior
+visit's pathology and genetics text. Each note is shingled into word k-grams,
+summarized by a MinHash signature, and LSH banding finds candidate pairs among
+the notes of the same subject. Candidates whose estimated Jaccard similarity is
+at least `threshold` are clustered, only the longest note of a cluster (the one
+with the most copied-forward content) is sent to the model, and its annotation
+is fanned back out to the duplicates. Bulk exports interleave subjects, so notes
+are buffered per subject rather than per run of adjacent notes.
+
+    python -m cumulus_library_glioma.llm.dedupe NDJSON [NDJSON ...] [--threshold 0.85] [--max-buffered 20000]
+"""
+import re
+import hashlib
+import argparse
+from collections import OrderedDict
+from typing import List, Iterable, Iterator
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 32
+MAX_BUFFERED = 20000
+MERSENNE = (1 << 31) - 1
+
+def shingles(text: str, k=SHINGLE_WORDS) -> List[int]:
+    """
+    :param text: note text
+    :param k: words per shingle
+    :return: 32 bit hashes of lower case word k-grams
+    """
+    words = re.findall(r'\w+', text.lower())
+    grams = {' '.join(words[pos:pos + k]) for pos in range(max(1, len(words) - k + 1))}
+    return [int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=4).digest(), 'little') for gram in grams]
+
+class MinHasher:
+    """
+    MinHash signatures with `num_perm` seeded universal hash functions (a * x + b) mod 2^31 - 1.
+    """
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        import numpy
+        rng = numpy.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE, num_perm, dtype=numpy.uint64)
+        self.b = rng.integers(0, MERSENNE, num_perm, dtype=numpy.uint64)
+
+    def signature(self, text: str):
+        """
+        :return: numpy array of `num_perm` minimum hash values
+        """
+        import numpy
+        hashes = numpy.array(shingles(text), dtype=numpy.uint64) % MERSENNE
+        return ((numpy.outer(hashes, self.a) + self.b) % MERSENNE).min(axis=0)
+
+def similarity(left, right) -> float:
+    """
+    :return: estimated Jaccard similarity, fraction of equal MinHash values
+    """
+    return float((left == right).mean())
+
+def lsh_candidates(signatures: List, bands=BANDS) -> set:
+    """
+    :param signatures: MinHash signatures of the same length
+    :param bands: number of LSH bands, notes sharing any band are candidates
+    :return: set of candidate (i, j) pairs with i < j
+    """
+    candidates = set()
+    if not signatures:
+        return candidates
+    rows = len(signatures[0]) // bands
+    for band in range(bands):
+        buckets = dict()
+        for pos, signature in enumerate(signatures):
+            buckets.setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(pos)
+        for bucket in buckets.values():
+            candidates.update((left, right) for pos, left in enumerate(bucket) for right in bucket[pos + 1:])
+    return candidates
+
+def cluster(texts: List[str], threshold=0.85, hasher: MinHasher = None) -> List[List[int]]:
+    """
+    :param texts: note texts, usually of one subject
+    :param threshold: min estimated Jaccard similarity of near-duplicates
+    :param hasher: shared MinHasher, signatures are only comparable with the same hasher
+    :return: clusters of positions in `texts`, the longest text first
+    """
+    hasher = hasher if hasher else MinHasher()
+    signatures = [hasher.signature(text) for text in texts]
+    parent = list(range(len(texts)))
+
+    def root(pos):
+        while parent[pos] != pos:
+            parent[pos] = parent[parent[pos]]
+            pos = parent[pos]
+        return pos
+
+    for left, right in sorted(lsh_candidates(signatures)):
+        if similarity(signatures[left], signatures[right]) >= threshold:
+            parent[root(right)] = root(left)
+
+    clusters = dict()
+    for pos in range(len(texts)):
+        clusters.setdefault(root(pos), []).append(pos)
+    return [sorted(members, key=lambda pos: (-len(texts[pos]), pos)) for members in clusters.values()]
+
+def dedupe_notes(notes: Iterable[dict], threshold=0.85, max_buffered=MAX_BUFFERED) -> Iterator[dict]:
+    """
+    Notes are buffered per subject, in any order, and every subject is clustered at the
+    end of the input. When more than `max_buffered` notes are buffered, the subject seen
+    least recently is clustered and flushed to bound memory; a later note of a flushed
+    subject can no longer be matched against the flushed notes, with a warning.
+    :param notes: see `extract.read_notes`
+    :param threshold: min estimated Jaccard similarity of near-duplicates
+    :param max_buffered: max notes buffered across all subjects
+    :return: generator of representative notes, each with `duplicates`: list of notes sharing its annotation
+    """
+    hasher = MinHasher()
+    buffers, flushed, warned = OrderedDict(), set(), set()
+    buffered = 0
+    for note in notes:
+        subject = note['subject_ref']
+        if subject in flushed and subject not in warned:
+            print(f'warning, {subject} reappears after its notes were flushed, '
+                  f'raise max_buffered ({max_buffered}) or sort the notes by subject')
+            warned.add(subject)
+        buffers.setdefault(subject, list()).append(note)
+        buffers.move_to_end(subject)
+        buffered += 1
+        if buffered > max_buffered:
+            oldest, oldest_notes = buffers.popitem(last=False)
+            buffered -= len(oldest_notes)
+            flushed.add(oldest)
+            yield from representatives(oldest_notes, threshold, hasher)
+    for subject_notes in buffers.values():
+        yield from representatives(subject_notes, threshold, hasher)
+
+def representatives(notes: List[dict], threshold: float, hasher: MinHasher) -> Iterator[dict]:
+    for members in cluster([note['text'] for note in notes], threshold, hasher):
+        yield dict(notes[members[0]], duplicates=[notes[pos] for pos in members[1:]])
+
+if __name__ == '__main__':
+    from cumulus_library_glioma.llm.extract import read_notes
+
+    parser = argparse.ArgumentParser(description='Report near-duplicate notes per subject')
+    parser.add_argument('ndjson', nargs='+', help='DocumentReference ndjson files')
+    parser.add_argument('--threshold', type=float, default=0.85, help='min estimated Jaccard similarity')
+    parser.add_argument('--max-buffered', type=int, default=MAX_BUFFERED, help='max notes buffered across subjects')
+    args = parser.parse_args()
+
+    total = sent = 0
+    for representative in dedupe_notes(read_notes(args.ndjson), args.threshold, args.max_buffered):
+        total += 1 + len(representative['duplicates'])
+        sent += 1
+        if representative['duplicates']:
+            print(f"{representative['note_ref']}: {[note['note_ref'] for note in representative['duplicates']]}")
+    print(f'notes {total}, sent {sent}, saved {total - sent} ({(total - sent) / total if total else 0:.1%})')
@@ -0,0 +1,487 @@
+"""
+Async LLM extraction of `GliomaCaseAnnotation` from DocumentReference ndjson.
+
+Notes are streamed from ndjson, sent to an OpenAI-compatible chat completions
+endpoint with a JSON-schema structured output, and validated against
+`GliomaCaseAnnotation`. Requests run with bounded concurrency, a requests per
+second limit and retries (429, 5xx, timeouts, invalid JSON). Results are written
+as ndjson (and optionally Parquet) rows of note_ref, encounter_ref, subject_ref
+and result, the shape `glioma__nlp_gpt_oss_120b` is read by the `glioma__llm*` views.
+
+    python -m cumulus_library_glioma.llm.extract NDJSON [NDJSON ...] --out results.ndjson
+        [--base-url URL] [--model M] [--concurrency 8] [--rps 0] [--retries 4] [--parquet FILE]
+        [--pack CONTEXT_TOKENS] [--chunk TOKENS]
+
+Results are cached by note text, schema, model and prompt version, see `cache`.
+With `--pack`, several notes are sent per request, see `packing`.
+With `--chunk`, long notes are split on section headers and sent as several requests, see `chunking`.
+`mock_server` serves the same API locally for testing. Requires the `llm` extra: pip install -e '.[llm]'
+"""
+import os
+import re
+import json
+import html
+import time
+import base64
+import random
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+from typing import Iterable, Iterator
+from cumulus_library_glioma.llm import cache, dedupe, packing, chunking
+from cumulus_library_glioma.llm.pydantic_schema.annotation import GliomaCaseAnnotation
+
+BASE_URL = os.environ.get('OPENAI_BASE_URL') or 'http://localhost:8000/v1'
+MODEL = os.environ.get('LLM_MODEL') or 'gpt-oss-120b'
+PROMPT_VERSION = '1'
+
+SYSTEM_PROMPT = (
+    'You are a clinical abstractor for a pediatric low-grade glioma study. '
+    'Read the clinical note and extract the glioma case annotation. '
+    'Only report what the note states, cite the supporting text spans, '
+    'and leave a mention with has_mention false when the note does not mention it.'
+)
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+###############################################################################
+#
+# Notes
+#
+###############################################################################
+def html_to_text(text: str) -> str:
+    text = re.sub(r'(?is)<(script|style).*?</\1>', ' ', text)
+    text = re.sub(r'(?i)<br\s*/?>|</p>|</div>|</li>|</tr>|</h\d>', '\n', text)
+    return html.unescape(re.sub(r'<[^>]+>', '', text))
+
+def note_text(docref: dict) -> str | None:
+    """
+    :param docref: DocumentReference
+    :return: text of the first text/plain or text/html attachment, None if there is none
+    """
+    for content in docref.get('content', []):
+        attachment = content.get('attachment', {})
+        content_type = attachment.get('contentType', 'text/plain')
+        if not content_type.startswith(('text/plain', 'text/html')) or 'data' not in attachment:
+            continue
+        text = base64.b64decode(attachment['data']).decode('utf-8', errors='replace')
+        return html_to_text(text) if content_type.startswith('text/html') else text
+    return None
+
+def read_notes(ndjson_files: Iterable[Path | str]) -> Iterator[dict]:
+    """
+    :param ndjson_files: DocumentReference ndjson files
+    :return: generator of notes (note_ref, encounter_ref, subject_ref, text), one line at a time
+    """
+    for ndjson_file in ndjson_files:
+        with open(ndjson_file, encoding='UTF-8') as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                docref = json.loads(line)
+                text = note_text(docref)
+                if text is None:
+                    print(f"warning, DocumentReference/{docref.get('id')} has no text attachment")
+                    continue
+                yield {'note_ref': f"DocumentReference/{docref['id']}",
+                       'encounter_ref': docref.get('encounter', {}).get('reference'),
+                       'subject_ref': docref.get('subject', {}).get('reference'),
+                       'text': text}
+
+###############################################################################
+#
+# Request
+#
+###############################################################################
+def response_format() -> dict:
+    return {'type': 'json_schema',
+            'json_schema': {'name': 'GliomaCaseAnnotation',
+                            'schema': GliomaCaseAnnotation.model_json_schema()}}
+
+def make_request(text: str, model: str = MODEL) -> dict:
+    """
+    :param text: note text
+    :param model: model id
+    :return: chat completions request body with structured output
+    """
+    return {'model': model,
+            'temperature': 0,
+            'messages': [{'role': 'system', 'content': SYSTEM_PROMPT},
+                         {'role': 'user', 'content': text}],
+            'response_format': response_format()}
+
+def parse_response(body: dict) -> GliomaCaseAnnotation:
+    """
+    :param body: chat completions response
+    :return: validated annotation, raises ValueError (pydantic.ValidationError) when invalid
+    """
+    content = body['choices'][0]['message']['content']
+    return GliomaCaseAnnotation.model_validate_json(content)
+
+class RateLimiter:
+    """
+    Spaces request starts at most `rps` per second, 0 is unlimited.
+    """
+    def __init__(self, rps: float = 0):
+        self.interval = 1 / rps if rps else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Push back every following request, for example on 429 Retry-After.
+        """
+        self.next_start = max(self.next_start, time.monotonic() + seconds)
+
+###############################################################################
+#
+# Stats
+#
+###############################################################################
+class Stats:
+    """
+    Latency and token usage of one extraction run.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.latency = list()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.chunked = 0
+        self.chunks = 0
+        self.batches = list()
+
+    def add(self, seconds: float, usage: dict) -> None:
+        self.latency.append(seconds)
+        self.prompt_tokens += usage.get('prompt_tokens', 0)
+        self.completion_tokens += usage.get('completion_tokens', 0)
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        latency = sorted(self.latency)
+        quantiles = statistics.quantiles(latency, n=100, method='inclusive') if len(latency) > 1 else latency * 99
+        tokens = self.prompt_tokens + self.completion_tokens
+        return {'requests': len(latency),
+                'failed': self.failed,
+                'duplicates': self.duplicates,
+                'chunked_notes': self.chunked,
+                'chunks': self.chunks,
+                'retries': self.retries,
+                'seconds': round(elapsed, 3),
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'tokens_per_second': round(tokens / elapsed, 1) if elapsed else 0.0,
+                'p50_seconds': round(quantiles[49], 3) if quantiles else 0.0,
+                'p95_seconds': round(quantiles[94], 3) if quantiles else 0.0,
+                'batches': self.batches}
+
+def print_report(report: dict) -> None:
+    print(f"requests {report['requests']} (failed {report['failed']}, retries {report['retries']}) "
+          f"in {report['seconds']:.3f}s, {report['duplicates']} near-duplicate notes reused an annotation")
+    print(f"tokens prompt {report['prompt_tokens']} completion {report['completion_tokens']}, "
+          f"{report['tokens_per_second']:.1f} tokens/s")
+    print(f"latency p50 {report['p50_seconds']:.3f}s p95 {report['p95_seconds']:.3f}s")
+    if report['chunked_notes']:
+        print(f"{report['chunked_notes']} long notes sent as {report['chunks']} section chunks")
+
+###############################################################################
+#
+# Run
+#
+###############################################################################
+async def complete(client, request: dict, limiter: RateLimiter, stats: Stats, retries=4, parse=parse_response) -> tuple:
+    """
+    POST one chat completion and validate it, retrying with exponential backoff and jitter.
+    Latency is measured from the first attempt, so retries and backoff count toward it.
+    :param client: httpx.AsyncClient with base_url set
+    :param request: see `make_request`
+    :param parse: validates the response body, default `parse_response`
+    :return: (GliomaCaseAnnotation, usage dict), or what `parse` returns
+    """
+    import httpx
+    start = None
+    for attempt in range(retries + 1):
+        await limiter.wait()
+        start = start if start is not None else time.perf_counter()
+        try:
+            response = await client.post('/chat/completions', json=request)
+            if response.status_code in RETRY_STATUS and attempt < retries:
+                if response.headers.get('retry-after', '').isdigit():
+                    limiter.pause(float(response.headers['retry-after']))
+                raise httpx.HTTPStatusError(f'status {response.status_code}', request=response.request, response=response)
+            response.raise_for_status()
+            body = response.json()
+            annotation = parse(body)
+            stats.add(time.perf_counter() - start, body.get('usage', {}))
+            return annotation, body.get('usage', {})
+        except (httpx.TransportError, httpx.HTTPStatusError, ValueError, KeyError) as e:
+            if attempt == retries or (isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in RETRY_STATUS):
+                raise
+            stats.retries += 1
+            await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+def make_row(note: dict, result: dict) -> dict:
+    """
+    :return: output row (note_ref, encounter_ref, subject_ref, result)
+    """
+    return {'note_ref': note['note_ref'],
+            'encounter_ref': note['encounter_ref'],
+            'subject_ref': note['subject_ref'],
+            'result': result}
+
+async def extract_note(client, note: dict, limiter: RateLimiter, stats: Stats, model=MODEL, retries=4,
+                       cache=None, inflight: dict = None) -> dict:
+    """
+    :param note: see `read_notes`
+    :param cache: optional `cache.ResultCache`, consulted first and written after each call
+    :param inflight: optional dict shared by workers, identical notes in flight wait for one request
+    :return: output row, see `make_row`
+    """
+    if cache is not None:
+        result = cache.get(note['text'], model, PROMPT_VERSION)
+        if result is not None:
+            return make_row(note, result)
+    key = cache.key(note['text'], model, PROMPT_VERSION) if cache is not None else None
+    if inflight is not None and key in inflight:
+        return make_row(note, await asyncio.shield(inflight[key]))
+    if inflight is not None and key is not None:
+        inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        annotation, usage = await complete(client, make_request(note['text'], model), limiter, stats, retries)
+        result = annotation.model_dump(mode='json')
+        if cache is not None:
+            cache.put(note['text'], model, PROMPT_VERSION, result, usage)
+        if inflight is not None and key is not None:
+            inflight.pop(key).set_result(result)
+        return make_row(note, result)
+    except Exception as e:
+        if inflight is not None and key in inflight:
+            future = inflight.pop(key)
+            future.set_exception(e)
+            future.exception()
+        raise
+
+async def extract_chunked(client, note: dict, limiter: RateLimiter, stats: Stats, model=MODEL, retries=4,
+                          cache=None, inflight: dict = None, max_tokens=chunking.CHUNK_TOKENS) -> dict:
+    """
+    Notes over `max_tokens` are split on section headers, the chunks extracted concurrently
+    (each cached like a note) and the chunk results merged, see `chunking`.
+    :param note: see `read_notes`
+    :param max_tokens: max estimated tokens per chunk
+    :return: output row, see `make_row`
+    """
+    chunks = chunking.chunk_note(note, max_tokens)
+    if len(chunks) == 1:
+        return await extract_note(client, note, limiter, stats, model, retries, cache, inflight)
+    rows = await asyncio.gather(*[extract_note(client, chunk, limiter, stats, model, retries, cache, inflight)
+                                  for chunk in chunks])
+    stats.chunked += 1
+    stats.chunks += len(chunks)
+    result = chunking.merge([row['result'] for row in rows],
+                            [chunking.section_priority(chunk['sections']) for chunk in chunks])
+    return make_row(note, result)
+
+async def extract_batch(client, batch: dict, limiter: RateLimiter, stats: Stats, model=MODEL, retries=4,
+                        cache=None) -> list:
+    """
+    One request for all cache misses of a batch. Batched and single note results share cache
+    entries, the per note instructions are the same. Cached usage of batched notes is their
+    share of the batch tokens, see `packing.prorate`.
+    :param batch: see `packing.pack`
+    :param cache: optional `cache.ResultCache`, consulted first and written after the call
+    :return: output rows in the order of the batch notes, notes missing from the response are sent alone
+    """
+    notes = batch['notes']
+    results = [cache.get(note['text'], model, PROMPT_VERSION) if cache is not None else None for note in notes]
+    pending = [pos for pos, result in enumerate(results) if result is None]
+    if pending:
+        if len(pending) == 1:
+            overhead = packing.request_overhead(SYSTEM_PROMPT, batched=False)
+            annotation, usage = await complete(client, make_request(notes[pending[0]]['text'], model),
+                                               limiter, stats, retries)
+            annotations = {'0': annotation}
+        else:
+            overhead = packing.request_overhead(SYSTEM_PROMPT)
+            request = packing.make_batch_request([notes[pos] for pos in pending], model, SYSTEM_PROMPT)
+            response, usage = await complete(client, request, limiter, stats, retries, packing.parse_batch)
+            annotations = {item.note_id: item.annotation for item in response.notes}
+        stats.batches.append({'notes': len(pending),
+                              'estimated_tokens': overhead + sum(packing.note_cost(notes[pos]) for pos in pending),
+                              'prompt_tokens': usage.get('prompt_tokens', 0),
+                              'completion_tokens': usage.get('completion_tokens', 0)})
+        note_usage = packing.prorate(usage, [notes[pos] for pos in pending])
+        for batch_pos, pos in enumerate(pending):
+            annotation = annotations.get(str(batch_pos))
+            if annotation is None:
+                print(f"warning, {notes[pos]['note_ref']} missing from batch response, sending it alone")
+                annotation, note_usage[batch_pos] = await complete(client, make_request(notes[pos]['text'], model),
+                                                                   limiter, stats, retries)
+            results[pos] = annotation.model_dump(mode='json')
+            if cache is not None:
+                cache.put(notes[pos]['text'], model, PROMPT_VERSION, results[pos], note_usage[batch_pos])
+    return [make_row(note, result) for note, result in zip(notes, results)]
+
+async def extract(notes: Iterable[dict], out_ndjson: Path | str, base_url=BASE_URL, model=MODEL,
+                  concurrency=8, rps: float = 0, retries=4, api_key: str = None, timeout=120.0, cache=None,
+                  context_budget: int = None, max_notes=8, chunk_tokens: int = None) -> dict:
+    """
+    :param notes: iterable of notes, consumed lazily. Notes with `duplicates` (see `dedupe.dedupe_notes`)
+                  are extracted once and the result is written for every duplicate too
+    :param out_ndjson: output rows, written as they complete
+    :param base_url: OpenAI-compatible API, like http://localhost:8000/v1
+    :param model: model id
+    :param concurrency: max requests in flight
+    :param rps: max requests started per second, 0 is unlimited
+    :param retries: retries per note
+    :param api_key: bearer token, default env OPENAI_API_KEY
+    :param timeout: seconds per request
+    :param cache: optional `cache.ResultCache`, only cache misses are sent to the model
+    :param context_budget: pack notes into requests of at most this many estimated tokens (prompt and
+                           output), longest first, see `packing.pack`. None sends one note per request
+    :param max_notes: max notes per packed request
+    :param chunk_tokens: split notes sent alone over this many estimated tokens, see `extract_chunked`.
+                         None sends every note whole
+    :return: dict report, see `Stats.report`
+    """
+    import httpx
+    api_key = api_key or os.environ.get('OPENAI_API_KEY')
+    headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+    limiter, stats = RateLimiter(rps), Stats()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    inflight = dict()
+
+    async def worker(client, out):
+        while (item := await queue.get()) is not None:
+            batch = item['notes'] if context_budget else [item]
+            try:
+                if context_budget and not (chunk_tokens and len(batch) == 1):
+                    rows = await extract_batch(client, item, limiter, stats, model, retries, cache)
+                elif chunk_tokens:
+                    rows = [await extract_chunked(client, batch[0], limiter, stats, model, retries, cache, inflight,
+                                                  chunk_tokens)]
+                else:
+                    rows = [await extract_note(client, item, limiter, stats, model, retries, cache, inflight)]
+                for note, row in zip(batch, rows):
+                    out.write(json.dumps(row) + '\n')
+                    for duplicate in note.get('duplicates', []):
+                        out.write(json.dumps(make_row(duplicate, row['result'])) + '\n')
+                        stats.duplicates += 1
+            except Exception as e:
+                stats.failed += len(batch)
+                message = str(e).splitlines()[0] if str(e) else type(e).__name__
+                print(f"warning, {', '.join(note['note_ref'] for note in batch)} failed: {message}")
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=timeout, limits=limits) as client:
+        with open(out_ndjson, 'w', encoding='UTF-8') as out:
+            workers = [asyncio.create_task(worker(client, out)) for _ in range(concurrency)]
+            if context_budget:
+                notes = packing.pack_notes(notes, packing.request_overhead(SYSTEM_PROMPT), context_budget, max_notes)
+            for item in notes:
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+    return stats.report()
+
+###############################################################################
+#
+# Parquet
+#
+###############################################################################
+def arrow_type(schema: dict, defs: dict):
+    """
+    :param schema: JSON schema of one field
+    :param defs: `$defs` of the root schema
+    :return: pyarrow type, objects become structs and arrays lists
+    """
+    import pyarrow
+    if '$ref' in schema:
+        return arrow_type(defs[schema['$ref'].split('/')[-1]], defs)
+    if 'anyOf' in schema:
+        return arrow_type([option for option in schema['anyOf'] if option.get('type') != 'null'][0], defs)
+    if schema.get('type') == 'object':
+        return pyarrow.struct([(name, arrow_type(field, defs)) for name, field in schema['properties'].items()])
+    if schema.get('type') == 'array':
+        return pyarrow.list_(arrow_type(schema['items'], defs))
+    return {'boolean': pyarrow.bool_(), 'integer': pyarrow.int64(), 'number': pyarrow.float64()}.get(
+        schema.get('type'), pyarrow.string())
+
+def arrow_schema():
+    """
+    :return: pyarrow schema of output rows, explicit so empty mention lists keep their struct type
+    """
+    import pyarrow
+    schema = GliomaCaseAnnotation.model_json_schema()
+    return pyarrow.schema([('note_ref', pyarrow.string()),
+                           ('encounter_ref', pyarrow.string()),
+                           ('subject_ref', pyarrow.string()),
+                           ('result', arrow_type(schema, schema.get('$defs', {})))])
+
+def ndjson_to_parquet(file_ndjson: Path | str, file_parquet: Path | str) -> Path:
+    """
+    :param file_ndjson: output rows of `extract`
+    :param file_parquet: same rows, `result` as a nested struct
+    :return: Path to Parquet
+    """
+    import pyarrow
+    import pyarrow.parquet
+    with open(file_ndjson, encoding='UTF-8') as lines:
+        rows = [json.loads(line) for line in lines if line.strip()]
+    table = pyarrow.Table.from_pylist(rows, schema=arrow_schema())
+    pyarrow.parquet.write_table(table, file_parquet, compression='zstd')
+    return Path(file_parquet)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract GliomaCaseAnnotation from DocumentReference ndjson')
+    parser.add_argument('ndjson', nargs='+', help='DocumentReference ndjson files')
+    parser.add_argument('--out', required=True, help='output ndjson')
+    parser.add_argument('--parquet', help='also write output as Parquet')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--model', default=MODEL)
+    parser.add_argument('--concurrency', type=int, default=8, help='max requests in flight')
+    parser.add_argument('--rps', type=float, default=0, help='max requests per second, 0 is unlimited')
+    parser.add_argument('--retries', type=int, default=4)
+    parser.add_argument('--dedupe', type=float, metavar='THRESHOLD',
+                        help='send one note per cluster of near-duplicates (min Jaccard similarity, like 0.85)')
+    parser.add_argument('--pack', type=int, metavar='CONTEXT_TOKENS',
+                        help='pack notes into requests of at most this many estimated tokens, longest first')
+    parser.add_argument('--max-notes', type=int, default=8, help='max notes per packed request')
+    parser.add_argument('--chunk', type=int, metavar='TOKENS',
+                        help='split notes over this many estimated tokens on section headers')
+    parser.add_argument('--cache', help='SQLite result cache, default env LLM_CACHE or $XDG_CACHE_HOME/cumulus-library-glioma/llmcache.sqlite')
+    parser.add_argument('--no-cache', action='store_true', help='send every note to the model')
+    parser.add_argument('--cache-max-mb', type=float, help='evict least recently used results above this size')
+    parser.add_argument('--cache-max-days', type=float, help='evict results not used for this many days')
+    args = parser.parse_args()
+
+    result_cache = None if args.no_cache else cache.ResultCache(args.cache)
+    notes = read_notes(args.ndjson)
+    if args.dedupe:
+        notes = dedupe.dedupe_notes(notes, args.dedupe)
+    report = asyncio.run(extract(notes, args.out, args.base_url, args.model,
+                                 args.concurrency, args.rps, args.retries, cache=result_cache,
+                                 context_budget=args.pack, max_notes=args.max_notes, chunk_tokens=args.chunk))
+    print_report(report)
+    if report['batches']:
+        packing.print_batches(report['batches'])
+    if result_cache:
+        result_cache.evict(int(args.cache_max_mb * 2 ** 20) if args.cache_max_mb else None, args.cache_max_days)
+        cache.print_report(result_cache.report())
+        result_cache.close()
+    if args.parquet:
+        ndjson_to_parquet(args.out, args.parquet)
@@ -0,0 +1,101 @@
+"""
+Local mock of an OpenAI-compatible chat completions endpoint, for testing `extract`.
+
+Every request gets a valid `GliomaCaseAnnotation` (mentions found by simple keyword
+search of the note), or a `GliomaCaseBatch` for packed requests, `usage` with token counts estimated from text length, an
+optional artificial latency and an optional rate of 429/500 failures.
+
+    python -m cumulus_library_glioma.llm.mock_server [--port 8000] [--latency 0.2] [--fail-rate 0.1]
+"""
+import re
+import json
+import time
+import random
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from cumulus_library_glioma.llm.pydantic_schema.annotation import GliomaCaseAnnotation
+
+KEYWORDS = {
+    'topography_mention': r'brain|cerebell|pons|brainstem|thalam|optic',
+    'morphology_mention': r'glioma|astrocytoma|glioblastoma|ganglioglioma',
+    'behavior_mention': r'malignan|benign',
+    'grade_mention': r'grade',
+}
+
+def annotate(text: str) -> dict:
+    """
+    :param text: note text
+    :return: GliomaCaseAnnotation as dict, has_mention and spans by keyword search
+    """
+    annotation = dict()
+    for mention, pattern in KEYWORDS.items():
+        spans = [match.group(0) for match in re.finditer(rf'\b\w*(?:{pattern})\w*\b', text, flags=re.IGNORECASE)]
+        annotation[mention] = {'has_mention': bool(spans), 'spans': sorted(set(spans))[:5]}
+    return GliomaCaseAnnotation.model_validate(annotation).model_dump(mode='json', exclude_none=True)
+
+def annotate_batch(content: str) -> dict:
+    """
+    :param content: notes wrapped in <note id="..."> tags, see `packing.make_batch_request`
+    :return: GliomaCaseBatch as dict
+    """
+    notes = re.findall(r'<note id="([^"]*)">\n(.*?)\n</note>', content, flags=re.DOTALL)
+    return {'notes': [{'note_id': note_id, 'annotation': annotate(text)} for note_id, text in notes]}
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class Handler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.fail_rate:
+            if random.random() < 0.5:
+                return self.send_json(429, {'error': {'message': 'rate limited'}}, {'Retry-After': '0'})
+            return self.send_json(500, {'error': {'message': 'server error'}})
+        prompt = '\n'.join(message['content'] for message in request['messages'])
+        if request.get('response_format', {}).get('json_schema', {}).get('name') == 'GliomaCaseBatch':
+            content = json.dumps(annotate_batch(request['messages'][-1]['content']))
+        else:
+            content = json.dumps(annotate(request['messages'][-1]['content']))
+        self.send_json(200, {
+            'id': f'mock-{random.getrandbits(32):x}',
+            'object': 'chat.completion',
+            'model': request.get('model'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': estimate_tokens(prompt),
+                      'completion_tokens': estimate_tokens(content),
+                      'total_tokens': estimate_tokens(prompt) + estimate_tokens(content)}})
+
+def serve(port=8000, latency=0.0, fail_rate=0.0) -> ThreadingHTTPServer:
+    """
+    :return: server, call `serve_forever()` (or run it in a thread) and `shutdown()`
+    """
+    Handler.latency, Handler.fail_rate = latency, fail_rate
+    return ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OpenAI-compatible chat completions endpoint')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean seconds per response')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of 429/500 responses')
+    args = parser.parse_args()
+
+    print(f'mock chat completions on http://127.0.0.1:{args.port}/v1')
+    serve(args.port, args.latency, args.fail_rate).serve_forever()
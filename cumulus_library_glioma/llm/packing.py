@@ -0,0 +1,158 @@
+"""
+Token-aware packing of notes into batched extraction requests.
+
+Note lengths vary from short progress notes to long pathology and consult
+notes. Tokens are estimated per note up front, notes are binned first-fit
+decreasing into requests whose estimated prompt plus expected output fits the
+context budget, and batches are sent longest first so the slowest requests
+start early instead of becoming the tail. Each batched request asks for one
+`GliomaCaseAnnotation` per note, see `GliomaCaseBatch`.
+
+Notes over the budget are sent alone, with a warning.
+"""
+import os
+import math
+import json
+from typing import List, Iterable, Iterator
+from pydantic import BaseModel, Field
+from cumulus_library_glioma.llm.pydantic_schema.annotation import GliomaCaseAnnotation
+
+CHARS_PER_TOKEN = float(os.environ.get('LLM_CHARS_PER_TOKEN') or 4)
+CONTEXT_BUDGET = int(os.environ.get('LLM_CONTEXT_BUDGET') or 32000)
+OUTPUT_TOKENS_PER_NOTE = 600
+NOTE_OVERHEAD_TOKENS = 16
+PACK_WINDOW = 256
+
+BATCH_PROMPT = (
+    'Each clinical note is wrapped in <note id="..."> tags. '
+    'Extract one glioma case annotation per note, independently of the other notes, '
+    'and return it with the note id.'
+)
+
+class NoteAnnotation(BaseModel):
+    note_id: str = Field(description='The id attribute of the <note> tag.')
+    annotation: GliomaCaseAnnotation
+
+class GliomaCaseBatch(BaseModel):
+    """
+    SCHEMA root of a batched request, one annotation per note
+    """
+    notes: list[NoteAnnotation] = Field(default_factory=list)
+
+###############################################################################
+#
+# Estimate
+#
+###############################################################################
+def estimate_tokens(text: str) -> int:
+    """
+    :return: estimated tokens, `CHARS_PER_TOKEN` characters per token
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def request_overhead(system_prompt: str, batched=True) -> int:
+    """
+    :param batched: False for a single note request (`extract.make_request`), without the batch prompt and schema
+    :return: estimated tokens of the system prompt and the response schema
+    """
+    if not batched:
+        schema = json.dumps(GliomaCaseAnnotation.model_json_schema())
+        return estimate_tokens(system_prompt) + estimate_tokens(schema)
+    schema = json.dumps(GliomaCaseBatch.model_json_schema())
+    return estimate_tokens(system_prompt) + estimate_tokens(BATCH_PROMPT) + estimate_tokens(schema)
+
+def note_cost(note: dict) -> int:
+    """
+    :return: estimated prompt tokens of the note plus its expected output tokens
+    """
+    if 'estimated_tokens' not in note:
+        note['estimated_tokens'] = estimate_tokens(note['text']) + NOTE_OVERHEAD_TOKENS
+    return note['estimated_tokens'] + OUTPUT_TOKENS_PER_NOTE
+
+def prorate(usage: dict, notes: List[dict]) -> List[dict]:
+    """
+    :param usage: chat completions usage of one batched request
+    :param notes: notes of the request
+    :return: usage per note, the batch tokens shared by `note_cost`
+    """
+    total = sum(note_cost(note) for note in notes)
+    return [{key: round(usage.get(key, 0) * note_cost(note) / total) for key in ['prompt_tokens', 'completion_tokens']}
+            for note in notes]
+
+###############################################################################
+#
+# Pack
+#
+###############################################################################
+def pack(notes: List[dict], overhead: int, budget=CONTEXT_BUDGET, max_notes=8) -> List[dict]:
+    """
+    First-fit decreasing bin packing.
+    :param notes: notes to pack
+    :param overhead: estimated tokens per request, see `request_overhead`
+    :param budget: context window tokens per request, prompt and output
+    :param max_notes: max notes per request, more notes per request means longer outputs
+    :return: batches {notes, estimated_tokens}, longest first
+    """
+    batches = list()
+    for note in sorted(notes, key=note_cost, reverse=True):
+        for batch in batches:
+            if len(batch['notes']) < max_notes and batch['estimated_tokens'] + note_cost(note) <= budget:
+                batch['notes'].append(note)
+                batch['estimated_tokens'] += note_cost(note)
+                break
+        else:
+            if overhead + note_cost(note) > budget:
+                print(f"warning, {note['note_ref']} is estimated over the context budget "
+                      f"({overhead + note_cost(note)} > {budget} tokens)")
+            batches.append({'notes': [note], 'estimated_tokens': overhead + note_cost(note)})
+    return sorted(batches, key=lambda batch: batch['estimated_tokens'], reverse=True)
+
+def pack_notes(notes: Iterable[dict], overhead: int, budget=CONTEXT_BUDGET, max_notes=8, window=PACK_WINDOW) -> Iterator[dict]:
+    """
+    :param notes: stream of notes, packed `window` notes at a time to bound memory
+    :return: generator of batches, see `pack`
+    """
+    buffered = list()
+    for note in notes:
+        buffered.append(note)
+        if len(buffered) == window:
+            yield from pack(buffered, overhead, budget, max_notes)
+            buffered = list()
+    if buffered:
+        yield from pack(buffered, overhead, budget, max_notes)
+
+###############################################################################
+#
+# Request
+#
+###############################################################################
+def make_batch_request(notes: List[dict], model: str, system_prompt: str) -> dict:
+    """
+    :param notes: notes of one batch, note ids are their position in the batch
+    :return: chat completions request body with a `GliomaCaseBatch` structured output
+    """
+    content = '\n\n'.join(f'<note id="{pos}">\n{note["text"]}\n</note>' for pos, note in enumerate(notes))
+    return {'model': model,
+            'temperature': 0,
+            'messages': [{'role': 'system', 'content': f'{system_prompt} {BATCH_PROMPT}'},
+                         {'role': 'user', 'content': content}],
+            'response_format': {'type': 'json_schema',
+                                'json_schema': {'name': 'GliomaCaseBatch',
+                                                'schema': GliomaCaseBatch.model_json_schema()}}}
+
+def parse_batch(body: dict) -> GliomaCaseBatch:
+    return GliomaCaseBatch.model_validate_json(body['choices'][0]['message']['content'])
+
+def print_batches(batches: List[dict]) -> None:
+    """
+    :param batches: per batch notes, estimated_tokens, prompt_tokens, completion_tokens
+    """
+    print(f"{'batch':>6} {'notes':>6} {'estimated':>10} {'actual':>10} {'ratio':>7}")
+    for pos, batch in enumerate(batches):
+        actual = batch['prompt_tokens'] + batch['completion_tokens']
+        ratio = actual / batch['estimated_tokens'] if batch['estimated_tokens'] else 0.0
+        print(f"{pos:>6} {batch['notes']:>6} {batch['estimated_tokens']:>10} {actual:>10} {ratio:>7.2f}")
+    estimated = sum(batch['estimated_tokens'] for batch in batches)
+    actual = sum(batch['prompt_tokens'] + batch['completion_tokens'] for batch in batches)
+    print(f"{'total':>6} {sum(batch['notes'] for batch in batches):>6} {estimated:>10} {actual:>10} "
+          f"{actual / estimated if estimated else 0.0:>7.2f}")
@@ -0,0 +1,87 @@
+"""
+Parallel build of the Python SQL and valueset generators.
+
+Every generator module exposes `tasks()`, a list of build tasks declaring the
+files they create and read. Tasks are arranged in a DAG by `scheduler` and run
+on a thread (or process) pool, so regenerating the study SQL is bounded by the
+slowest chain of tasks instead of the sum of all tasks. Unchanged tasks are
+skipped by `buildcache`.
+
+    python -m cumulus_library_glioma.tools.build [--parallel N] [--processes]
+"""
+import os
+import time
+import argparse
+import importlib
+from pathlib import Path
+from typing import List, Callable, Iterable
+from cumulus_library_glioma.tools import buildcache, scheduler
+
+MODULES = ['cumulus_library_glioma.tools.valueset',
+           'cumulus_library_glioma.tools.cube']
+
+def make_task(section: str, name: str, run: Callable, creates: Iterable[str] = (), reads: Iterable[str] = ()) -> dict:
+    """
+    :param section: generator module, for the summary
+    :param name: task name, unique across modules
+    :param run: picklable function without arguments (module function or functools.partial)
+    :param creates: names of files this task writes, default is the task name
+    :param reads: names of files written by other tasks that this task reads
+    :return: dict task, compatible with `scheduler.schedule`
+    """
+    return {'section': section, 'name': name, 'run': run, 'file': None,
+            'creates': set(creates) or {name}, 'reads': set(reads)}
+
+def discover(modules: List[str] = None) -> List[dict]:
+    """
+    :param modules: generator modules with a `tasks()` function, default `MODULES`
+    :return: list of tasks of all modules
+    """
+    tasks = list()
+    for module in (modules if modules else MODULES):
+        tasks += importlib.import_module(module).tasks()
+    return tasks
+
+def run_task(task: dict) -> dict:
+    """
+    Run one task and measure it, module level so process pools can pickle it.
+    :param task: see `make_task`
+    :return: dict task measurements, `changed` lists files written by this task's stages not skipped by `buildcache`
+    """
+    measured = {'section': task['section'], 'stage': task['name'], 'tables': [], 'rows': 0,
+                'seconds': 0.0, 'peak_bytes': 0, 'error': None, 'changed': []}
+    start = time.perf_counter()
+    with buildcache.track() as changed:
+        try:
+            outputs = task['run']()
+            outputs = outputs if isinstance(outputs, list) else [outputs]
+            measured['tables'] = [Path(output).name for output in outputs if output]
+        except Exception as e:
+            measured['error'] = str(e).splitlines()[0]
+    measured['seconds'] = round(time.perf_counter() - start, 4)
+    measured['changed'] = list(dict.fromkeys(Path(output).name for outputs in changed.values() for output in outputs))
+    return measured
+
+def run(parallel: int = None, processes=False, modules: List[str] = None) -> List[dict]:
+    """
+    :param parallel: max concurrent tasks, default is the number of CPUs
+    :param processes: True runs tasks in a process pool, for CPU bound generators
+    :param modules: generator modules, default `MODULES`
+    :return: list of task measurements
+    """
+    tasks = discover(modules)
+    start = time.perf_counter()
+    measured = scheduler.schedule(tasks, run_task, parallel or os.cpu_count(), processes)
+    scheduler.print_summary(tasks, measured, time.perf_counter() - start)
+    changed = [stage for task in measured for stage in task.get('changed', [])]
+    print(f'changed: {changed}')
+    return measured
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate study SQL and valuesets in parallel')
+    parser.add_argument('--parallel', type=int, help='max concurrent tasks, default is the number of CPUs')
+    parser.add_argument('--processes', action='store_true', help='use a process pool instead of threads')
+    parser.add_argument('--module', action='append', help='generator module, default is all of them')
+    args = parser.parse_args()
+
+    run(args.parallel, args.processes, args.module)
@@ -0,0 +1,133 @@
+"""
+Content-hash build cache for the `make()` generators.
+
+Each generator stage hashes everything its output depends on: source file
+contents (CSV/BSV/JSON), function arguments, `MIN_SUBJECTS` and the installed
+cumulus-library version. When the digest matches the one recorded by the
+previous build and the outputs still exist, the stage is skipped and nothing
+is written. Files written by stages that did run are listed by `changed()`, so
+downstream re-execution can be limited to them, see `scheduler.downstream`.
+
+Digests are kept in the user cache folder (see `filetool.path_cache`), one folder
+`buildcache/<checkout>` per package checkout, as `<stage>.json`. Delete the folder
+to force a full rebuild.
+"""
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import List, Iterable, Callable
+from cumulus_library_glioma.tools import filetool
+
+CACHE_DIR = filetool.path_cache('buildcache') / hashlib.sha256(str(filetool.path_parent()).encode()).hexdigest()[:16]
+
+_changed = dict()
+_local = threading.local()
+
+def library_version() -> str:
+    from importlib import metadata
+    try:
+        return metadata.version('cumulus-library')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+def digest(inputs: Iterable[Path | str] = (), **args) -> str:
+    """
+    :param inputs: source files, hashed by content
+    :param args: function arguments, hashed by value
+    :return: hex digest of inputs, args, MIN_SUBJECTS and cumulus-library version
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps({'MIN_SUBJECTS': os.environ.get('MIN_SUBJECTS'),
+                           'cumulus-library': library_version(),
+                           'args': args}, sort_keys=True, default=str).encode())
+    for file in inputs:
+        sha.update(Path(file).name.encode())
+        with open(file, 'rb') as source:
+            while chunk := source.read(1 << 20):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+def path_stage(stage: str) -> Path:
+    return CACHE_DIR / f'{stage}.json'
+
+def lookup(stage: str, stage_digest: str) -> List[Path] | None:
+    """
+    :param stage: stage name, like the SQL table name
+    :param stage_digest: see `digest`
+    :return: outputs of the previous build if `stage_digest` matches and all outputs exist, else None
+    """
+    if not path_stage(stage).exists():
+        return None
+    cached = filetool.read_json(path_stage(stage))
+    outputs = [Path(output) for output in cached.get('outputs', [])]
+    if cached.get('digest') == stage_digest and all(output.exists() for output in outputs):
+        return outputs
+    return None
+
+def record(stage: str, stage_digest: str, outputs: Iterable[Path | str]) -> None:
+    """
+    Remember `stage_digest` for the next build and mark `stage` as changed in this build.
+    """
+    outputs = [str(Path(output).resolve()) for output in outputs]
+    filetool.write_json({'digest': stage_digest, 'outputs': outputs}, path_stage(stage))
+    _changed[stage] = outputs
+    if getattr(_local, 'changed', None) is not None:
+        _local.changed[stage] = outputs
+
+def build(stage: str, make: Callable[[], Path | List[Path]], inputs: Iterable[Path | str] = (), **args) -> Path | List[Path]:
+    """
+    Run `make()` unless `stage` is unchanged since the previous build.
+    :param stage: stage name, like the SQL table name
+    :param make: function writing the stage outputs, returns Path, list of Path, or None when nothing was written
+    :param inputs: source files the stage reads
+    :param args: arguments the outputs depend on
+    :return: outputs of `make()`, or of the previous build when skipped
+    """
+    inputs = list(inputs)
+    stage_digest = digest(inputs, **args)
+    outputs = lookup(stage, stage_digest)
+    if outputs is not None:
+        if not outputs:
+            return None
+        return outputs[0] if len(outputs) == 1 else outputs
+    made = make()
+    record(stage, stage_digest, [] if made is None else made if isinstance(made, list) else [made])
+    return made
+
+def save_athena_view(view_name: str, contents: str) -> Path:
+    """
+    Like `filetool.save_athena_view`, but the file (and its mtime) is left alone when the SQL is unchanged.
+    """
+    return build(view_name, lambda: filetool.save_athena_view(view_name, contents), sql=contents)
+
+def changed() -> List[str]:
+    """
+    :return: file names written by changed stages in this process, the stage names of `scheduler`
+             (like glioma__cube_patient_dx.sql or valueset_morphology.parquet)
+    """
+    return [output.name for output in changed_outputs()]
+
+@contextmanager
+def track():
+    """
+    Collect the stages changed by this thread inside the `with` block, unlike `changed()`
+    not mixed up with stages built concurrently by other threads.
+    :return: dict of stage -> outputs, filled when the block exits
+    """
+    previous = getattr(_local, 'changed', None)
+    _local.changed = dict()
+    try:
+        yield _local.changed
+    finally:
+        if previous is not None:
+            previous.update(_local.changed)
+        _local.changed = previous
+
+def changed_outputs() -> List[Path]:
+    """
+    :return: files written by changed stages in this process
+    """
+    return [Path(output) for outputs in _changed.values() for output in outputs]
@@ -0,0 +1,151 @@
+"""
+In-memory index of codes keyed on (system, code).
+
+Built once from a ValueSet, CSV or list of Coding and reused for constant-time
+membership, display lookup, batch intersection/difference between code lists,
+and hierarchical prefix queries such as every `C71.*` topography code.
+
+A code without a system (plain string) matches that code in any system, which
+keeps `guard.filter_list_coding(standard_list, ['C71.1', ...])` working.
+"""
+from __future__ import annotations
+import bisect
+from typing import List, Iterable, Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fhirclient.models.coding import Coding
+
+class CodeIndex:
+    """
+    Index of concepts keyed on (system, code), with display lookup.
+    """
+    def __init__(self, concepts: Iterable = ()):
+        """
+        :param concepts: Coding, dict, (system, code, display) tuple or code string
+        """
+        self._display = dict()
+        self._systems = dict()
+        self._sorted = None
+        self.update(concepts)
+
+    @staticmethod
+    def as_key(concept) -> tuple:
+        """
+        :param concept: Coding, dict, (system, code[, display]) tuple or code string
+        :return: (system, code, display)
+        """
+        if isinstance(concept, str):
+            return None, concept, None
+        if isinstance(concept, dict):
+            return concept.get('system'), concept.get('code'), concept.get('display')
+        if isinstance(concept, tuple):
+            return (tuple(concept) + (None,))[:3]
+        return concept.system, concept.code, concept.display
+
+    def add(self, concept) -> None:
+        system, code, display = self.as_key(concept)
+        if (system, code) not in self._display:
+            self._display[(system, code)] = display
+            self._systems.setdefault(code, set()).add(system)
+            self._sorted = None
+
+    def update(self, concepts: Iterable) -> None:
+        for concept in concepts:
+            self.add(concept)
+
+    def __len__(self) -> int:
+        return len(self._display)
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self._display)
+
+    def __contains__(self, concept) -> bool:
+        """
+        :param concept: Coding, dict, tuple or code string. Without a system, any system matches.
+        """
+        system, code, _ = self.as_key(concept)
+        if system is None:
+            return code in self._systems
+        return (system, code) in self._display or (None, code) in self._display
+
+    def display(self, system: str | None, code: str) -> str | None:
+        """
+        :return: display of (system, code), None if not indexed
+        """
+        if (system, code) in self._display:
+            return self._display[(system, code)]
+        for other in self._systems.get(code, ()):
+            if system is None or other is None:
+                return self._display[(other, code)]
+
+    ###########################################################################
+    # Batch operations
+    ###########################################################################
+    def intersection(self, other: Iterable) -> 'CodeIndex':
+        """
+        :param other: CodeIndex or concepts
+        :return: CodeIndex of concepts in this index that are also in `other`
+        """
+        other = other if isinstance(other, CodeIndex) else CodeIndex(other)
+        return CodeIndex((system, code, display) for (system, code), display in self._display.items()
+                         if (system, code) in other)
+
+    def difference(self, other: Iterable) -> 'CodeIndex':
+        """
+        :param other: CodeIndex or concepts
+        :return: CodeIndex of concepts in this index that are not in `other`
+        """
+        other = other if isinstance(other, CodeIndex) else CodeIndex(other)
+        return CodeIndex((system, code, display) for (system, code), display in self._display.items()
+                         if (system, code) not in other)
+
+    def union(self, other: Iterable) -> 'CodeIndex':
+        merged = CodeIndex(self.concepts())
+        merged.update(other.concepts() if isinstance(other, CodeIndex) else other)
+        return merged
+
+    ###########################################################################
+    # Hierarchy
+    ###########################################################################
+    def prefix(self, code_prefix: str, system: str = None) -> 'CodeIndex':
+        """
+        Hierarchical codes share a prefix, for example ICD-10 `C71` or `C71.*` matches C71.0 ... C71.9
+        :param code_prefix: code prefix, an optional trailing `*` or `.*` is ignored
+        :param system: optional system, default any system
+        :return: CodeIndex of matching concepts
+        """
+        code_prefix = code_prefix.removesuffix('*').removesuffix('.')
+        if self._sorted is None:
+            self._sorted = sorted((code, system or '') for system, code in self._display if code is not None)
+        matches = CodeIndex()
+        for pos in range(bisect.bisect_left(self._sorted, (code_prefix, '')), len(self._sorted)):
+            code, found = self._sorted[pos]
+            if not code.startswith(code_prefix):
+                break
+            found = found or None
+            if system is None or found == system:
+                matches.add((found, code, self._display[(found, code)]))
+        return matches
+
+    ###########################################################################
+    # Output
+    ###########################################################################
+    def concepts(self) -> List[tuple]:
+        """
+        :return: list of (system, code, display) in insertion order
+        """
+        return [(system, code, display) for (system, code), display in self._display.items()]
+
+    def codings(self) -> List[Coding]:
+        """
+        :return: list of Coding in insertion order
+        """
+        from fhirclient.models.coding import Coding
+        codings = list()
+        for system, code, display in self.concepts():
+            coding = Coding()
+            coding.system = system
+            coding.code = code
+            coding.display = display
+            codings.append(coding)
+        return codings
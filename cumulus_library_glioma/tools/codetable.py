@@ -0,0 +1,75 @@
+"""
+Column oriented table of (system, code, display) for bulk valueset paths.
+
+A fhirclient `Coding` carries the full FHIR element machinery per row, which
+is slow and memory hungry for tens of thousands of codes. `CodeTable` keeps
+three interned string columns instead, iterates as lightweight `Code` rows
+(attribute access like `Coding`, so SQL renderers take either), and converts
+to `Coding` only at API edges.
+"""
+from __future__ import annotations
+import sys
+from typing import List, Iterable, Iterator, NamedTuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fhirclient.models.coding import Coding
+
+class Code(NamedTuple):
+    system: str | None
+    code: str | None
+    display: str | None
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class CodeTable:
+    """
+    Interned column arrays of system, code and display.
+    """
+    __slots__ = ('system', 'code', 'display')
+
+    def __init__(self, rows: Iterable = ()):
+        """
+        :param rows: (system, code, display) tuples, `Code`, `Coding` or concept dicts
+        """
+        self.system = list()
+        self.code = list()
+        self.display = list()
+        self.extend(rows)
+
+    def append(self, system, code, display=None) -> None:
+        self.system.append(intern(system))
+        self.code.append(intern(code))
+        self.display.append(intern(display))
+
+    def extend(self, rows: Iterable) -> None:
+        for row in rows:
+            if isinstance(row, tuple):
+                self.append(*row)
+            elif isinstance(row, dict):
+                self.append(row.get('system'), row.get('code'), row.get('display'))
+            else:
+                self.append(row.system, row.code, row.display)
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def __iter__(self) -> Iterator[Code]:
+        return map(Code._make, zip(self.system, self.code, self.display))
+
+    def __getitem__(self, pos: int) -> Code:
+        return Code(self.system[pos], self.code[pos], self.display[pos])
+
+    def codings(self) -> List[Coding]:
+        """
+        :return: list of fhirclient Coding, for API edges only
+        """
+        from fhirclient.models.coding import Coding
+        codings = list()
+        for system, code, display in self:
+            coding = Coding()
+            coding.system = system
+            coding.code = code
+            coding.display = display
+            codings.append(coding)
+        return codings
@@ -1,13 +1,18 @@
 import os
+import re
+import argparse
+import itertools
+from functools import partial
 from typing import List
 from pathlib import Path
-from cumulus_library.builders.counts import CountsBuilder
-from cumulus_library_glioma.tools import filetool, fhir2sql
+from cumulus_library_glioma.tools import filetool, fhir2sql, buildcache
 from cumulus_library_glioma.tools.filetool import PREFIX
 
 MIN_SUBJECTS = int(os.environ.get("MIN_SUBJECTS") or 1)
 
-def cube_fhir_resource(fhir_resource:str, source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS) -> Path:
+def cube_fhir_resource(fhir_resource:str, source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS,
+                       materialize=False, partitioned_by:str=None, bucketed_by:str=None, bucket_count:int=None,
+                       max_depth:int=None, grouping_sets:List[List[str]]=None, sketch=False) -> Path:
     """Generates a counts table using a template
 
     :param fhir_resource: The type of FHIR resource to count
@@ -15,12 +20,32 @@ def cube_fhir_resource(fhir_resource:str, source_table='study_population', table
     :param table_cols: The columns from the source table to add to the count table
     :param table_name: The name of the table to create. Must start with study prefix
     :param min_subject: Minimum number of patients to include in result groupings
+    :param materialize: True keeps precomputed counts as a table, False (default) rewrites as a view
+    :param partitioned_by: optional column of `table_cols` to partition the materialized table by
+    :param bucketed_by: optional column of `table_cols` to bucket the materialized table by
+    :param bucket_count: number of buckets for `bucketed_by`
+    :param max_depth: optional max number of columns grouped together, instead of the full CUBE powerset
+    :param grouping_sets: optional list of required column combinations, kept regardless of `max_depth`
+    :param sketch: True adds a mergeable HLL sketch `cnt_sketch` next to the exact count, see `merge_sketch`.
+                   Requires `materialize`, a view would recompute the sketch instead of keeping it to merge.
     """
+    if sketch and not materialize:
+        raise Exception(f'sketch=True requires materialize=True, cnt_sketch of a view cannot be merged later')
+    params = dict(locals())
     if not table_name:
         suffix = fhir_resource if (fhir_resource != 'documentreference') else 'document'
         table_name = fhir2sql.name_cube(source_table, suffix)
 
-    table_cols = sorted(list(set(table_cols)))
+    params.update(table_name=table_name, table_cols=sorted(list(set(table_cols))))
+    return buildcache.build(table_name, lambda: write_cube_fhir_resource(**params), [__file__], **params)
+
+def write_cube_fhir_resource(fhir_resource:str, source_table:str, table_cols:List[str], table_name:str, min_subject:int,
+                             materialize:bool, partitioned_by:str, bucketed_by:str, bucket_count:int,
+                             max_depth:int, grouping_sets:List[List[str]], sketch:bool) -> Path:
+    """
+    Uncached body of `cube_fhir_resource`, table_name and table_cols already resolved.
+    """
+    from cumulus_library.builders.counts import CountsBuilder
     sql = CountsBuilder(PREFIX).get_count_query(
             table_name=table_name,
             source_table=source_table,
@@ -30,7 +55,14 @@ def cube_fhir_resource(fhir_resource:str, source_table='study_population', table
             filter_resource=True,
             skip_status_filter=True
     )
-    sql = table_as_view(sql, table_name)
+    if max_depth is not None or grouping_sets:
+        sql = cube_as_grouping_sets(sql, table_cols, max_depth, grouping_sets)
+    if sketch:
+        sql = cube_with_sketch(sql)
+    if materialize:
+        sql = table_with_properties(sql, table_name, table_cols, partitioned_by, bucketed_by, bucket_count)
+    else:
+        sql = table_as_view(sql, table_name)
     return filetool.save_athena_view(table_name, sql)
 
 def table_as_view(sql:str, table_name:str) -> str:
@@ -43,118 +75,282 @@ def table_as_view(sql:str, table_name:str) -> str:
     replace_view = f'CREATE or replace VIEW {table_name} AS '
     return sql.replace(create_table, replace_view).replace(');', ';')
 
-def cube_patient(source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS) -> Path:
+def list_grouping_sets(table_cols:List[str], max_depth:int=None, grouping_sets:List[List[str]]=None) -> List[tuple]:
+    """
+    :param table_cols: columns of the counts table
+    :param max_depth: every combination of at most `max_depth` columns, including the grand total ()
+    :param grouping_sets: required column combinations
+    :return: sorted list of unique grouping sets
+    """
+    pruned = list()
+    if max_depth is not None:
+        for depth in range(0, min(max_depth, len(table_cols)) + 1):
+            pruned += list(itertools.combinations(table_cols, depth))
+    for required in grouping_sets or []:
+        missing = set(required) - set(table_cols)
+        if missing:
+            raise Exception(f'grouping set {required} has columns not in table_cols: {missing}')
+        pruned.append(tuple(sorted(set(required))))
+    return sorted(set(pruned), key=lambda group: (len(group), group))
+
+def cube_as_grouping_sets(sql:str, table_cols:List[str], max_depth:int=None, grouping_sets:List[List[str]]=None) -> str:
+    """
+    Replace GROUP BY CUBE (all 2^n grouping sets) with only the grouping sets that are read.
+    Output columns and `min_subject` suppression are unchanged, pruned groupings are simply absent.
+
+    :param sql: counts query with `GROUP BY cube(...)`
+    :param table_cols: columns of the counts table
+    :param max_depth: max number of columns grouped together
+    :param grouping_sets: required column combinations
+    :return: sql with `GROUP BY GROUPING SETS (...)`
+    """
+    sets = list_grouping_sets(table_cols, max_depth, grouping_sets)
+    rendered = ',\n'.join(['            (' + ', '.join([f'"{col}"' for col in group]) + ')' for group in sets])
+    grouping = f'GROUPING SETS (\n{rendered}\n            )'
+    return re.sub(r'cube\(\s*(?:"\w+",?\s*)+\)', grouping, sql)
+
+def cube_with_sketch(sql:str) -> str:
+    """
+    Distinct counts do not add up across refreshes or sites, HyperLogLog sketches do.
+    Athena `approx_set` is stored as varbinary next to the exact count of the same cell.
+    NOTE: Athena only, DuckDB has no HyperLogLog type.
+
+    :param sql: counts query
+    :return: sql with column `cnt_sketch` after `cnt`
+    """
+    sql = re.sub(r'count\(DISTINCT (\w+)\) AS cnt_(\w+),',
+                 r'count(DISTINCT \1) AS cnt_\2,\n            cast(approx_set(\1) AS varbinary) AS sketch_\2,', sql)
+    return re.sub(r'(\w+)\.cnt_(\w+) AS cnt,', r'\1.cnt_\2 AS cnt,\n        \1.sketch_\2 AS cnt_sketch,', sql)
+
+def merge_sketch(table_name:str, source_tables:List[str], table_cols:List[str], min_subject=MIN_SUBJECTS) -> Path:
+    """
+    Merge sketch cubes from several refreshes or several sites into one result in a single pass.
+    The result keeps `cnt_sketch`, so merged cubes can be merged again.
+    NOTE: cells suppressed by `min_subject` in a source cube are missing from its sketch, build
+    source cubes with the lowest `min_subject` the sharing policy allows and suppress here instead.
+
+    Source cubes are built with `sketch=True, materialize=True` at each site or refresh, and
+    copied side by side into one Athena database, then merged with:
+
+        python -m cumulus_library_glioma.tools.cube --merge TABLE --sources CUBE [CUBE ...] --cols COL [COL ...]
+
+    :param table_name: merged table name. Must start with study prefix
+    :param source_tables: cubes built with `sketch=True` over the same `table_cols`
+    :param table_cols: The columns of the count tables
+    :param min_subject: Minimum (estimated) number of patients to include in result groupings
+    :return: Path to SQL CTAS
+    """
+    params = dict(locals())
+    params.update(table_cols=sorted(list(set(table_cols))))
+    return buildcache.build(table_name, lambda: write_merge_sketch(**params), [__file__], **params)
+
+def write_merge_sketch(table_name:str, source_tables:List[str], table_cols:List[str], min_subject:int) -> Path:
+    """
+    Uncached body of `merge_sketch`, table_cols already resolved.
+    """
+    cols = ', '.join([f'"{col}"' for col in table_cols])
+    union = '\n    UNION ALL\n'.join([f'    SELECT cnt_sketch, {cols} FROM {source}' for source in source_tables])
+    sql = [f"CREATE TABLE {table_name} AS",
+           f"WITH",
+           f"merged AS (",
+           f"    SELECT  merge(cast(cnt_sketch AS HyperLogLog)) AS hll,",
+           f"            {cols}",
+           f"    FROM (",
+           union,
+           f"    ) AS cubes",
+           f"    GROUP BY {cols}",
+           f")",
+           f"SELECT  cardinality(hll) AS cnt,",
+           f"        cast(hll AS varbinary) AS cnt_sketch,",
+           f"        {cols}",
+           f"FROM    merged",
+           f"WHERE   cardinality(hll) >= {min_subject}",
+           f";"]
+    return filetool.save_athena_view(table_name, '\n'.join(sql))
+
+def table_with_properties(sql:str, table_name:str, table_cols:List[str], partitioned_by:str=None, bucketed_by:str=None, bucket_count:int=None) -> str:
+    """
+    Athena requires partition columns last in the select list, so a partitioned CTAS selects from the counts query.
+    NOTE: Athena CTAS writes at most 100 partitions, choose a low cardinality `partitioned_by` column.
+
+    :param sql: CTAS (create table as)
+    :param table_name: Table name to materialize
+    :param table_cols: columns of the counts table
+    :param partitioned_by: optional partition column
+    :param bucketed_by: optional bucket column
+    :param bucket_count: number of buckets for `bucketed_by`
+    :return: sql CTAS with table properties
+    """
+    if not (partitioned_by or bucketed_by):
+        return sql
+    for col in [partitioned_by, bucketed_by]:
+        if col and col not in table_cols:
+            raise Exception(f'{col} is not a column of {table_name}')
+
+    properties = ["format = 'PARQUET'"]
+    if partitioned_by:
+        properties.append(f"partitioned_by = ARRAY['{partitioned_by}']")
+    if bucketed_by:
+        properties.append(f"bucketed_by = ARRAY['{bucketed_by}']")
+        properties.append(f"bucket_count = {bucket_count or 16}")
+
+    select_cols = ['cnt', 'cnt_sketch'] if 'cnt_sketch' in sql else ['cnt']
+    select_cols += [f'"{col}"' for col in table_cols if col != partitioned_by]
+    if partitioned_by:
+        select_cols.append(f'"{partitioned_by}"')
+
+    create_table = f'CREATE TABLE {table_name} AS ('
+    with_properties = f'CREATE TABLE {table_name} WITH ({", ".join(properties)}) AS \n' \
+                      f'SELECT {", ".join(select_cols)} FROM ('
+    return sql.replace(create_table, with_properties).replace(');', ') AS counts;')
+
+def cube_patient(source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS, **options) -> Path:
     return cube_fhir_resource(
         fhir_resource='patient',
         source_table=source_table,
         table_cols=table_cols,
         table_name=table_name,
-        min_subject=min_subject)
+        min_subject=min_subject,
+        **options)
 
-def cube_encounter(source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS) -> Path:
+def cube_encounter(source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS, **options) -> Path:
     return cube_fhir_resource(
         fhir_resource='encounter',
         source_table=source_table,
         table_cols=table_cols,
         table_name=table_name,
-        min_subject=min_subject)
+        min_subject=min_subject,
+        **options)
 
-def cube_document(source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS) -> Path:
+def cube_document(source_table='study_population', table_cols=None, table_name=None, min_subject=MIN_SUBJECTS, **options) -> Path:
     return cube_fhir_resource(
         fhir_resource='documentreference',
         source_table=source_table,
         table_cols=table_cols,
         table_name=table_name,
-        min_subject=min_subject)
+        min_subject=min_subject,
+        **options)
 
-def make() -> List[Path]:
+def list_cubes() -> List[partial]:
+    """
+    :return: cube generators of this study, call each one to write its SQL
+    """
     return [
-        cube_patient(source_table='glioma__cohort_casedef',
-                     table_cols=['dx_category_code',
-                                 'dx_code',
-                                 'dx_system',
-                                 'dx_display',
-                                 'age_at_dx_min',
-                                 'gender',
-                                 'race_display'],
-                     min_subject=10),
-
-        cube_patient(source_table='glioma__cohort_dx',
-                     table_cols=['dx_category_code',
-                                 'dx_code',
-                                 'dx_system',
-                                 'dx_display',
-                                 'age_at_visit',
-                                 'gender',
-                                 'race_display'],
-                     min_subject=10),
-
-        cube_patient(source_table='glioma__cohort_rx',
-                     table_cols=['rx_status',
-                                 'rx_category_code',
-                                 'rx_code',
-                                 'rx_system',
-                                 'rx_display',
-                                 'age_at_visit',
-                                 'gender',
-                                 'race_display'],
-                     min_subject=10),
-
-        cube_encounter(source_table='glioma__cohort_casedef',
-                       table_cols=['enc_class_code',
-                                   'enc_type_display',
-                                   'enc_servicetype_display',
-                                   'enc_period_ordinal']),
-
-        cube_document(source_table='glioma__sample_casedef_index_post',
-                       table_cols=['doc_type_code',
-                                   'doc_type_display',
-                                   'doc_type_system'],
-                      min_subject=10),
-
-        cube_patient(source_table='glioma__llm',
-                     table_cols=['topography_has_mention',
-                                 'topography_display',
-                                 'morphology_has_mention',
-                                 'morphology_display',
-                                 'behavior_has_mention',
-                                 'behavior_code',
-                                 'grade_has_mention',
-                                 'grade_code']),
-
-        cube_patient(source_table='glioma__llm_surgery',
-                     table_cols=['has_mention',
-                                 'surgical_type',
-                                 'approach',
-                                 'extent_of_resection',
-                                 'anatomical_site',
-                                 'technique_details',
-                                 'complications']),
-
-        cube_patient(source_table='glioma__llm_drug',
-                     table_cols=['has_mention',
-                                 'status',
-                                 'category',
-                                 'route',
-                                 'phase',
-                                 'rx_class']),
-
-        cube_patient(source_table='glioma__llm_variant',
-                     table_cols=['has_mention',
-                                 'hgnc_name',
-                                 'hgvs_variant',
-                                 'interpretation']),
-
-        cube_patient(source_table='glioma__llm_gene',
-                     table_cols=['has_mention',
-                                 'braf_altered',
-                                 'braf_v600e',
-                                 'braf_fusion',
-                                 'idh_mutant',
-                                 'h3k27m_mutant',
-                                 'tp53_altered',
-                                 'cdkn2a_deleted']),
+        partial(cube_patient, source_table='glioma__cohort_casedef',
+                              table_cols=['dx_category_code',
+                                          'dx_code',
+                                          'dx_system',
+                                          'dx_display',
+                                          'age_at_dx_min',
+                                          'gender',
+                                          'race_display'],
+                              min_subject=10,
+                              materialize=True),
+
+        partial(cube_patient, source_table='glioma__cohort_dx',
+                              table_cols=['dx_category_code',
+                                          'dx_code',
+                                          'dx_system',
+                                          'dx_display',
+                                          'age_at_visit',
+                                          'gender',
+                                          'race_display'],
+                              min_subject=10,
+                              materialize=True),
+
+        partial(cube_patient, source_table='glioma__cohort_rx',
+                              table_cols=['rx_status',
+                                          'rx_category_code',
+                                          'rx_code',
+                                          'rx_system',
+                                          'rx_display',
+                                          'age_at_visit',
+                                          'gender',
+                                          'race_display'],
+                              min_subject=10,
+                              materialize=True),
+
+        partial(cube_encounter, source_table='glioma__cohort_casedef',
+                                table_cols=['enc_class_code',
+                                            'enc_type_display',
+                                            'enc_servicetype_display',
+                                            'enc_period_ordinal'],
+                                materialize=True),
+
+        partial(cube_document, source_table='glioma__sample_casedef_index_post',
+                                table_cols=['doc_type_code',
+                                            'doc_type_display',
+                                            'doc_type_system'],
+                               min_subject=10),
+
+        partial(cube_patient, source_table='glioma__llm',
+                              table_cols=['topography_has_mention',
+                                          'topography_display',
+                                          'morphology_has_mention',
+                                          'morphology_display',
+                                          'behavior_has_mention',
+                                          'behavior_code',
+                                          'grade_has_mention',
+                                          'grade_code']),
+
+        partial(cube_patient, source_table='glioma__llm_surgery',
+                              table_cols=['has_mention',
+                                          'surgical_type',
+                                          'approach',
+                                          'extent_of_resection',
+                                          'anatomical_site',
+                                          'technique_details',
+                                          'complications'],
+                              max_depth=3),
+
+        partial(cube_patient, source_table='glioma__llm_drug',
+                              table_cols=['has_mention',
+                                          'status',
+                                          'category',
+                                          'route',
+                                          'phase',
+                                          'rx_class']),
+
+        partial(cube_patient, source_table='glioma__llm_variant',
+                              table_cols=['has_mention',
+                                          'hgnc_name',
+                                          'hgvs_variant',
+                                          'interpretation']),
+
+        partial(cube_patient, source_table='glioma__llm_gene',
+                              table_cols=['has_mention',
+                                          'braf_altered',
+                                          'braf_v600e',
+                                          'braf_fusion',
+                                          'idh_mutant',
+                                          'h3k27m_mutant',
+                                          'tp53_altered',
+                                          'cdkn2a_deleted'],
+                              max_depth=3),
     ]
 
+def make() -> List[Path]:
+    return [cube() for cube in list_cubes()]
+
+def tasks() -> List[dict]:
+    """
+    :return: build tasks, one per cube, see `build`
+    """
+    from cumulus_library_glioma.tools import build
+    return [build.make_task('cube', f"{cube.func.__name__}:{cube.keywords['source_table']}", cube) for cube in list_cubes()]
+
 if __name__ == "__main__":
-    target_files = make()
+    parser = argparse.ArgumentParser(description='Generate the cube SQL, or merge sketch cubes')
+    parser.add_argument('--merge', metavar='TABLE', help='merged table name, see `merge_sketch`')
+    parser.add_argument('--sources', nargs='+', help='sketch cubes to merge')
+    parser.add_argument('--cols', nargs='+', help='columns of the sketch cubes')
+    parser.add_argument('--min-subject', type=int, default=MIN_SUBJECTS)
+    args = parser.parse_args()
+
+    if args.merge:
+        if not (args.sources and args.cols):
+            parser.error('--merge requires --sources and --cols')
+        print(merge_sketch(args.merge, args.sources, args.cols, args.min_subject))
+    else:
+        target_files = make()
+    print(f'changed: {buildcache.changed()}')
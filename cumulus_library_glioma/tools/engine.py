@@ -0,0 +1,246 @@
+"""
+Local DuckDB stand-in for Athena.
+
+Runs every section of `manifest.toml` in order against `core__*` shaped tables
+loaded from Parquet or ndjson, and reports wall time, rows produced and peak
+memory per stage. This gives a reproducible performance baseline for the
+cohort, sample and cube SQL without cloud cost.
+
+    python -m cumulus_library_glioma.tools.engine DATA_DIR [--db FILE] [--report FILE]
+"""
+import re
+import time
+import tomllib
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Iterable
+from cumulus_library_glioma.tools import filetool
+from cumulus_library_glioma.tools.filetool import PREFIX
+
+DATA_FORMATS = ['.parquet', '.ndjson', '.json']
+
+###############################################################################
+#
+# Connect / Load
+#
+###############################################################################
+def connect(db_file: Path | str = ':memory:'):
+    """
+    DuckDB connection with the Athena compatibility functions cumulus-library registers.
+    :param db_file: duckdb database file, default in memory
+    :return: duckdb connection
+    """
+    from cumulus_library.databases.duckdb import DuckDatabaseBackend
+    backend = DuckDatabaseBackend(str(db_file))
+    backend.connect()
+    return backend.connection
+
+def name_table(path: Path) -> str:
+    """
+    :param path: data file or folder, like `core__encounter.parquet` or `loinc.consumer_name/`
+    :return: table name, optionally schema qualified
+    """
+    name = path.name
+    for suffix in DATA_FORMATS:
+        name = name.removesuffix(suffix)
+    return name
+
+def sql_read(path: Path) -> str:
+    """
+    :param path: data file or folder of partitions (Parquet or ndjson)
+    :return: SQL table function reading `path`
+    """
+    if path.is_dir():
+        parquet = list(path.rglob('*.parquet'))
+        if parquet:
+            return f"read_parquet('{path}/**/*.parquet', hive_partitioning=true, union_by_name=true)"
+        return f"read_json_auto('{path}/**/*.ndjson', format='newline_delimited', union_by_name=true)"
+    if path.suffix == '.parquet':
+        return f"read_parquet('{path}')"
+    return f"read_json_auto('{path}', format='newline_delimited')"
+
+def load_tables(con, data_dir: Path | str) -> dict:
+    """
+    Load every Parquet/ndjson file (or folder of partitions) in `data_dir` as a table named after the file.
+    Schema qualified names are supported, for example `loinc.consumer_name.parquet`.
+    :param con: duckdb connection
+    :param data_dir: folder of `core__*` shaped tables
+    :return: dict of table name -> rows loaded
+    """
+    loaded = dict()
+    for path in sorted(Path(data_dir).iterdir()):
+        if not (path.is_dir() or path.suffix in DATA_FORMATS):
+            continue
+        table = name_table(path)
+        if '.' in table:
+            con.execute(f'CREATE SCHEMA IF NOT EXISTS {table.split(".")[0]}')
+        con.execute(f'CREATE OR REPLACE TABLE {table} AS SELECT * FROM {sql_read(path)}')
+        loaded[table] = con.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+    return loaded
+
+###############################################################################
+#
+# Manifest
+#
+###############################################################################
+def read_manifest(manifest: Path | str = None) -> List[tuple]:
+    """
+    :param manifest: path to manifest.toml, default is this study
+    :return: list of (section, [files]) in manifest order
+    """
+    manifest = Path(manifest) if manifest else filetool.path_parent('manifest.toml')
+    with open(manifest, 'rb') as toml_file:
+        config = tomllib.load(toml_file)
+    sections = config['file_config']['file_names']
+    return [(section, [manifest.parent / file for file in files]) for section, files in sections.items()]
+
+def read_uploads(toml_path: Path) -> List[tuple]:
+    """
+    :param toml_path: file upload workflow, like `valuesets.toml`
+    :return: list of (table name, file path, delimiter) in workflow order
+    """
+    with open(toml_path, 'rb') as toml_file:
+        config = tomllib.load(toml_file)
+    uploads = list()
+    for task, table in config.get('tables', {}).items():
+        for file in table.get('files', [table.get('file')]):
+            uploads.append((f'{PREFIX}__{task}', toml_path.parent / file, table.get('delimiter', ',')))
+    return uploads
+
+def sql_upload(table: str, file: Path, delimiter=',') -> str:
+    """
+    Mirrors the cumulus-library file upload: header row names the columns, every column is a STRING.
+    """
+    if file.suffix == '.parquet':
+        return f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_parquet('{file}')"
+    return (f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM "
+            f"read_csv('{file}', delim='{delimiter}', header=true, all_varchar=true)")
+
+def athena_compat(sql: str) -> str:
+    """
+    :param sql: Athena SQL
+    :return: SQL without Athena-only CTAS table properties like `WITH (partitioned_by = ARRAY['col'])`
+    """
+    return re.sub(r'(create\s+table\s+[\w.]+)\s+with\s*\([^)]*\)\s+as', r'\1 AS', sql, flags=re.IGNORECASE)
+
+def name_created(sql: str) -> List[str]:
+    """
+    :param sql: one or more CTAS/CVAS or INSERT statements
+    :return: names of tables and views written by `sql`
+    """
+    found = re.findall(r'(?:create\s+(?:or\s+replace\s+)?(?:table|view)|insert\s+into)\s+([\w.]+)', sql, flags=re.IGNORECASE)
+    return list(dict.fromkeys(found))
+
+###############################################################################
+#
+# Execute
+#
+###############################################################################
+class PeakMemory:
+    """
+    Samples DuckDB buffer memory on a second cursor while a stage runs.
+    """
+    def __init__(self, con, interval=0.005):
+        self.cursor = con.cursor()
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._done.is_set():
+            used = self.cursor.execute('SELECT sum(memory_usage_bytes) FROM duckdb_memory()').fetchone()[0]
+            self.peak = max(self.peak, used or 0)
+            self._done.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.cursor.close()
+
+def run_sql(con, section: str, name: str, statements: Iterable[str]) -> dict:
+    """
+    Execute one stage and measure it. Views are counted inside the timed window so their cost is not hidden.
+    :param con: duckdb connection
+    :param section: manifest section
+    :param name: stage name, usually the SQL filename
+    :param statements: SQL statements of this stage
+    :return: dict stage measurements
+    """
+    stage = {'section': section, 'stage': name, 'tables': [], 'rows': 0, 'seconds': 0.0, 'peak_bytes': 0, 'error': None}
+    with PeakMemory(con) as memory:
+        start = time.perf_counter()
+        try:
+            for sql in statements:
+                con.execute(sql)
+                stage['tables'] += name_created(sql)
+            for table in stage['tables']:
+                stage['rows'] += con.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+        except Exception as e:
+            stage['error'] = str(e).splitlines()[0]
+        stage['seconds'] = round(time.perf_counter() - start, 4)
+    stage['peak_bytes'] = memory.peak
+    return stage
+
+def run_file(con, section: str, file: Path) -> List[dict]:
+    """
+    :param con: duckdb connection
+    :param section: manifest section
+    :param file: SQL stage or file upload TOML
+    :return: list of stage measurements
+    """
+    if file.suffix == '.toml':
+        return [run_sql(con, section, upload.name, [sql_upload(table, upload, delimiter)])
+                for table, upload, delimiter in read_uploads(file)]
+    return [run_sql(con, section, file.name, [athena_compat(filetool.read_text(file))])]
+
+def run(data_dir: Path | str, db_file: Path | str = ':memory:', manifest: Path | str = None) -> List[dict]:
+    """
+    Load `core__*` tables then execute every manifest section in order.
+    :param data_dir: folder of `core__*` shaped tables (Parquet or ndjson)
+    :param db_file: duckdb database file, default in memory
+    :param manifest: path to manifest.toml, default is this study
+    :return: list of stage measurements
+    """
+    con = connect(db_file)
+    loaded = load_tables(con, data_dir)
+    print(f'loaded {len(loaded)} tables from {data_dir}')
+    stages = list()
+    for section, files in read_manifest(manifest):
+        for file in files:
+            stages += run_file(con, section, file)
+    return stages
+
+###############################################################################
+#
+# Report
+#
+###############################################################################
+def print_report(stages: List[dict]) -> None:
+    print(f"{'stage':<60} {'seconds':>9} {'rows':>12} {'peak MB':>9}")
+    for stage in stages:
+        peak = stage['peak_bytes'] / 2 ** 20
+        print(f"{stage['stage']:<60} {stage['seconds']:>9.3f} {stage['rows']:>12} {peak:>9.1f}")
+        if stage['error']:
+            print(f"    error: {stage['error']}")
+        if stage.get('skipped'):
+            print(f"    skipped: {stage['skipped']}")
+    total = sum(stage['seconds'] for stage in stages)
+    print(f"{'total':<60} {total:>9.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the study manifest on a local DuckDB')
+    parser.add_argument('data_dir', help='folder of core__* tables (Parquet or ndjson)')
+    parser.add_argument('--db', default=':memory:', help='duckdb database file')
+    parser.add_argument('--report', help='write stage measurements as JSON')
+    args = parser.parse_args()
+
+    measured = run(args.data_dir, args.db)
+    print_report(measured)
+    if args.report:
+        filetool.write_json({'stages': measured}, Path(args.report).absolute())
@@ -1,10 +1,24 @@
+from __future__ import annotations
+import os
+import re
 import copy
-from typing import List
+import itertools
+import threading
+from typing import List, Iterable, Iterator, TYPE_CHECKING
 from pathlib import Path
-from fhirclient.models.coding import Coding
-from cumulus_library_glioma.tools import filetool, guard
+from cumulus_library_glioma.tools import filetool, guard, buildcache
+from cumulus_library_glioma.tools.codeindex import CodeIndex
+from cumulus_library_glioma.tools.codetable import Code, CodeTable
+from cumulus_library_glioma.tools.matcher import TermMatcher
 from cumulus_library_glioma.tools.filetool import PREFIX
 
+if TYPE_CHECKING:
+    from fhirclient.models.coding import Coding
+
+# Codelists longer than this are uploaded as Parquet instead of an inline VALUES view
+MAX_INLINE_VALUES = int(os.environ.get("MAX_INLINE_VALUES") or 1000)
+UPLOAD_BATCH = 10000
+
 ###############################################################################
 #
 # naming conventions
@@ -84,9 +98,10 @@ def sql_paren(statement: str) -> str:
 #
 ###############################################################################
 
-def valueset2codelist(valueset_json: Path | str | dict) -> List[Coding]:
+def valueset2table(valueset_json: Path | str | dict) -> CodeTable:
     """
-    Obtain a list of Coding "concepts" from a ValueSet.
+    Obtain the "concepts" of a ValueSet, the one parser of "compose.include" that the
+    Coding and CodeIndex representations adapt from.
     This method currently supports only "include" of "concept" defined fields.
     Not supported: recursive fetching of contained ValueSets, which requires UMLS API Key and Wget, etc.
 
@@ -94,30 +109,92 @@ def valueset2codelist(valueset_json: Path | str | dict) -> List[Coding]:
     https://vsac.nlm.nih.gov/valueset/2.16.840.1.113762.1.4.1146.1629/expansion/Latest
     https://cts.nlm.nih.gov/fhir/res/ValueSet/2.16.840.1.113762.1.4.1146.1629?_format=json
 
-    :param valueset_json: ValueSet file, expecially those provided by NLM/ONC/VSAC
-    :return: list of codeable concepts (system, code, display) to include
+    :param valueset_json: ValueSet file or dict, expecially those provided by NLM/ONC/VSAC
+    :return: CodeTable of "compose.include" concepts (system, code, display)
     """
     if not isinstance(valueset_json, dict):
         valueset_json = filetool.load_valueset(valueset_json)
 
-    parsed = list()
+    table = CodeTable()
     if not valueset_json.get('compose'):
         print('warning, no valueset content. Extension?')
-        return list()
+        return table
 
-    for include in valueset_json['compose']['include']:
-        if 'concept' in include.keys():
-            for concept in include['concept']:
-                concept['system'] = include['system']
-                parsed.append(Coding(concept))
-    return parsed
+    for include in valueset_json['compose'].get('include', []):
+        for concept in include.get('concept', []):
+            table.append(include.get('system'), concept.get('code'), concept.get('display'))
+    return table
 
-def expansion2codelist(valueset_json: dict | str) -> List[Coding]:
+def expansion2table(valueset_json: dict | str) -> CodeTable:
+    """
+    :param valueset_json: ValueSet file or dict
+    :return: CodeTable of "expansion.contains" concepts
+    """
     if isinstance(valueset_json, str):
         valueset_json = filetool.load_valueset(valueset_json)
+    return CodeTable(valueset_json.get('expansion').get('contains'))
+
+def stream_codelist(valueset_json: Path | str) -> Iterator[Code]:
+    """
+    Streaming `valueset2table` and `expansion2table`: concepts are read one at a time,
+    so `define` and `codelist2csv` run in constant memory regardless of expansion size.
+    :param valueset_json: ValueSet file
+    :return: generator of Code rows from "compose.include" then "expansion.contains"
+    """
+    for concept in filetool.stream_valueset(valueset_json):
+        yield Code(concept.get('system'), concept.get('code'), concept.get('display'))
+
+def valueset2codelist(valueset_json: Path | str | dict) -> List[Coding]:
+    """
+    :param valueset_json: ValueSet file or dict
+    :return: list of fhirclient Coding of `valueset2table`, for API edges only
+    """
+    return valueset2table(valueset_json).codings()
 
-    contains = valueset_json.get('expansion').get('contains')
-    return [Coding(c) for c in contains]
+def expansion2codelist(valueset_json: dict | str) -> List[Coding]:
+    """
+    :param valueset_json: ValueSet file or dict
+    :return: list of fhirclient Coding of `expansion2table`, for API edges only
+    """
+    return expansion2table(valueset_json).codings()
+
+def valueset2index(valueset_json: Path | str | dict) -> CodeIndex:
+    """
+    :param valueset_json: ValueSet file or dict
+    :return: CodeIndex of `valueset2table`, unique (system, code) for lookups
+    """
+    return CodeIndex(valueset2table(valueset_json))
+
+def expansion2index(valueset_json: dict | str) -> CodeIndex:
+    """
+    :param valueset_json: ValueSet file or dict
+    :return: CodeIndex of `expansion2table`, unique (system, code) for lookups
+    """
+    return CodeIndex(expansion2table(valueset_json))
+
+def codelist2csv(codelist: Iterable[Coding] | CodeTable, file_csv: Path | str) -> Path:
+    """
+    :param codelist: concepts, list or iterator
+    :param file_csv: destination CSV with header system, code, display
+    :return: Path to CSV file
+    """
+    rows = ([concept.system, concept.code, concept.display] for concept in codelist)
+    filetool.write_csv(itertools.chain([['system', 'code', 'display']], rows), file_csv)
+    return Path(file_csv)
+
+def match_expansion(valueset_list: List[dict], search_terms: list) -> Iterator[tuple]:
+    """
+    One pass of a precompiled Aho-Corasick matcher per concept, over plain dicts.
+    :param valueset_list: ValueSets with "expansion.contains"
+    :param search_terms: terms to match on either Coding CODE or DISPLAY
+    :return: generator of (concept dict, [matched terms]) for concepts matching at least one term
+    """
+    matcher = TermMatcher(search_terms)
+    for valueset in valueset_list:
+        for concept in valueset.get('expansion').get('contains', []):
+            terms = matcher.search(f"{concept.get('code', '')} {concept.get('display', '')}")
+            if terms:
+                yield concept, terms
 
 def filter_expansion(valueset_json: Path | str, search_terms: list) -> List[dict]:
     """
@@ -127,23 +204,16 @@ def filter_expansion(valueset_json: Path | str, search_terms: list) -> List[dict
     List[dict must be presevered as that is expected everywhere per VSAC API
     """
     valueset_list = filetool.load_valueset(valueset_json)
+    matches = [concept for concept, _ in match_expansion(valueset_list, search_terms)]
 
-    matches = list()
-    for valueset in valueset_list:
-        for code in expansion2codelist(valueset):
-            search_string = f'{code.code.lower()} {code.display.lower()}'
-            for term in search_terms:
-                if term.lower() in search_string:
-                    matches.append(code.as_json())
-
-    filtered = copy.deepcopy(valueset_list[0])
+    filtered = {key: copy.deepcopy(value) for key, value in valueset_list[0].items() if key != 'expansion'}
+    filtered['expansion'] = {key: copy.deepcopy(value) for key, value in valueset_list[0]['expansion'].items() if key != 'contains'}
     filtered['expansion']['contains'] = matches
     return [filtered]
 
-
-def codelist2view(codelist: List[Coding], view_name) -> str:
+def codelist2view(codelist: List[Coding] | CodeTable, view_name) -> str:
     """
-    :param codelist: list of concepts
+    :param codelist: list of concepts or CodeTable
     :param view_name: like define_type
     :return: SQL command
     """
@@ -180,12 +250,113 @@ def union_view_list(view_list: List[str], view_name: str) -> Path:
     sql = cvas + '\n UNION '.join(select)
     return filetool.save_athena_view(dest, sql)
 
-def define(codelist: List[Coding], view_name: str) -> Path:
-    dest = name_prefix(view_name)
-    sql = codelist2view(codelist, dest)
-    return Path(filetool.save_athena_view(dest, sql))
+def codelist2upload(codelist: Iterable[Coding] | CodeTable, file_parquet: Path | str, batch_size=UPLOAD_BATCH) -> Path:
+    """
+    Stream concepts to a zstd compressed Parquet file, `batch_size` rows at a time.
+    A CodeTable is written straight from its columns.
+    :param codelist: iterable of concepts, consumed once, or CodeTable
+    :param file_parquet: destination file
+    :param batch_size: rows per Parquet row group
+    :return: Path to Parquet file
+    """
+    import pyarrow
+    import pyarrow.parquet
+    schema = pyarrow.schema([('system', pyarrow.string()), ('code', pyarrow.string()), ('display', pyarrow.string())])
+    if isinstance(codelist, CodeTable):
+        table = pyarrow.table({'system': codelist.system, 'code': codelist.code, 'display': codelist.display}, schema=schema)
+        pyarrow.parquet.write_table(table, file_parquet, compression='zstd', row_group_size=batch_size)
+        return Path(file_parquet)
+    codelist = iter(codelist)
+    with pyarrow.parquet.ParquetWriter(file_parquet, schema, compression='zstd') as writer:
+        while batch := list(itertools.islice(codelist, batch_size)):
+            writer.write_table(pyarrow.table({
+                'system': [concept.system for concept in batch],
+                'code': [concept.code for concept in batch],
+                'display': [concept.display for concept in batch]}, schema=schema))
+    return Path(file_parquet)
+
+# parallel `build` tasks rewrite the same valuesets.toml
+TOML_LOCK = threading.Lock()
+
+def toml_entry(task: str) -> re.Pattern:
+    """
+    :return: regex matching the `[tables.task]` entry of a file upload TOML
+    """
+    return re.compile(rf'^\[tables\.{re.escape(task)}\]\n(?:(?!\[).*(?:\n|$))*', flags=re.MULTILINE)
+
+def read_upload(task: str, toml_file: Path | str = None) -> Path | None:
+    """
+    :param task: file upload task, table name without the study prefix
+    :param toml_file: file upload workflow, default `valuesets.toml`
+    :return: Path to the file uploaded by the `[tables.task]` entry, None if there is none
+    """
+    toml_file = toml_file if toml_file else filetool.path_resources('valuesets.toml')
+    entry = toml_entry(task).search(filetool.read_text(toml_file))
+    upload = re.search(r'^file\s*=\s*"([^"]+)"', entry.group(0), flags=re.MULTILINE) if entry else None
+    return filetool.path_resources(Path(upload.group(1)).name) if upload else None
 
-def include(codelist: List[Coding], view_name: str) -> Path:
+def upload2toml(task: str, file_upload: Path, toml_file: Path | str = None) -> Path:
+    """
+    Add or replace the `[tables.task]` file upload entry, creating table `glioma__task`.
+    :param task: file upload task, table name without the study prefix
+    :param file_upload: file in the resources folder
+    :param toml_file: file upload workflow, default `valuesets.toml`
+    :return: Path to TOML file
+    """
+    toml_file = toml_file if toml_file else filetool.path_resources('valuesets.toml')
+    entry = '\n'.join([f'[tables.{task}]',
+                       f'file = "../resources/{Path(file_upload).name}"',
+                       f'col_types = ["STRING","STRING","STRING"]', '', ''])
+    existing = toml_entry(task)
+    with TOML_LOCK:
+        text = filetool.read_text(toml_file)
+        if existing.search(text):
+            text = existing.sub(lambda _: entry, text)
+        else:
+            text = text.rstrip('\n') + '\n\n' + entry.rstrip('\n') + '\n'
+        return Path(filetool.write_text(text, toml_file))
+
+def define(codelist: Iterable[Coding] | CodeTable, view_name: str) -> Path | None:
+    """
+    Small codelists become an inline VALUES view. Above `MAX_INLINE_VALUES` concepts the codelist is
+    streamed to Parquet and uploaded by `valuesets.toml`, huge SQL text is slow to parse and re-parsed by every query.
+    :param codelist: concepts, list, iterator or CodeTable
+    :param view_name: view name without the study prefix
+    :return: Path to SQL view or Parquet upload, None when an existing upload is kept, see `define_upload`
+    """
+    dest = name_prefix(view_name)
+    if isinstance(codelist, CodeTable):
+        if len(codelist) <= MAX_INLINE_VALUES:
+            return buildcache.save_athena_view(dest, codelist2view(codelist, dest))
+        return define_upload(codelist, view_name)
+
+    codelist = iter(codelist)
+    head = list(itertools.islice(codelist, MAX_INLINE_VALUES + 1))
+    if len(head) <= MAX_INLINE_VALUES:
+        return buildcache.save_athena_view(dest, codelist2view(head, dest))
+    return define_upload(itertools.chain(head, codelist), view_name)
+
+def define_upload(codelist: Iterable[Coding] | CodeTable, view_name: str) -> Path | None:
+    """
+    Upload branch of `define`. An existing `valuesets.toml` upload of another file, like a curated CSV,
+    already creates the table and is left unchanged.
+    :param codelist: concepts above `MAX_INLINE_VALUES`
+    :param view_name: view name without the study prefix
+    :return: Path to Parquet upload, or None when the file already uploaded is kept (nothing written)
+    """
+    dest = name_prefix(view_name)
+    if filetool.path_athena(f'{dest}.sql').exists():
+        print(f'warning, {dest} is now a file upload, remove athena/{dest}.sql from manifest.toml')
+    target = filetool.path_resources(f'{view_name}.parquet')
+    existing = read_upload(view_name)
+    if existing and existing.name != target.name:
+        print(f'warning, {dest} is already uploaded from {existing.name} by valuesets.toml, left unchanged')
+        return None
+    target = codelist2upload(codelist, target)
+    upload2toml(view_name, target)
+    return target
+
+def include(codelist: Iterable[Coding] | CodeTable, view_name: str) -> Path:
     """
     NOTE: Inclusion criteria is currently supported, not exclusion.
     :param codelist: List of codes to include in selection of `study_population`
@@ -194,7 +365,7 @@ def include(codelist: List[Coding], view_name: str) -> Path:
     """
     return define(codelist, f'include_{view_name}')
 
-def exclude(codelist: List[Coding], view_name: str) -> Path:
+def exclude(codelist: Iterable[Coding] | CodeTable, view_name: str) -> Path:
     """
     NOTE: Exclusion criteria is not yet implemented in `study_population`, and may never be.
     :param codelist: List of codes to exclude from `study_population`
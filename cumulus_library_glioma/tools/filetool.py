@@ -3,7 +3,7 @@ import csv
 import json
 from pathlib import Path
 from typing import List, Dict, Any, Iterable, Generator
-from cumulus_library_glioma.tools import guard
+from cumulus_library_glioma.tools import guard, jsonstream
 
 PREFIX = 'glioma'
 
@@ -33,6 +33,16 @@ def path_parent(filename=None) -> Path:
     else:
         return parent
 
+def path_cache(filename=None) -> Path:
+    """
+    Get path to the user cache folder, `$XDG_CACHE_HOME/cumulus-library-glioma` (default ~/.cache).
+    Caches are kept outside the package folder, which is built into the sdist and wheel.
+    :param filename: optional name of file to get path for in the cache folder
+    :return: Path to the cache folder, optionally with `filename`
+    """
+    cache = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'cumulus-library-glioma'
+    return cache / filename if filename else cache
+
 
 ###############################################################################
 #
@@ -60,6 +70,13 @@ def load_valueset(filename: Path | str) -> dict:
     """
     return read_json(path_valueset(filename))
 
+def stream_valueset(filename: Path | str) -> Generator[dict, None, None]:
+    """
+    :param filename: name of JSON file
+    :return: generator of concept dicts, without loading the whole file
+    """
+    return jsonstream.iter_concepts(path_valueset(filename))
+
 def save_valueset(filename: Path | str, contents: dict) -> Path:
     """
     Save JSON to valueset folder.
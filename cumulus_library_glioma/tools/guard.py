@@ -1,9 +1,13 @@
+from __future__ import annotations
 import datetime
 from enum import Enum
 from collections import OrderedDict
-from typing import List, Iterable
-from fhirclient.models.fhirdate import FHIRDate
-from fhirclient.models.coding import Coding
+from typing import List, Iterable, TYPE_CHECKING
+from cumulus_library_glioma.tools.codeindex import CodeIndex
+
+if TYPE_CHECKING:
+    from fhirclient.models.fhirdate import FHIRDate
+    from fhirclient.models.coding import Coding
 
 ###############################################################################
 #
@@ -39,6 +43,7 @@ def as_range(obj) -> range:
     Exception(f'as_range failed for {obj}')
 
 def as_coding(obj) -> Coding:
+    from fhirclient.models.coding import Coding
     c = Coding()
     src = obj.__dict__
     c.code = src.get('code')
@@ -52,6 +57,7 @@ def as_list(obj) -> list:
     return [obj]
 
 def as_list_coding(obj) -> List[Coding]:
+    from fhirclient.models.coding import Coding
     obj = as_list(obj)
     if is_list_type(obj, Coding):
         return obj
@@ -78,21 +84,17 @@ def as_enum_values(enum_list: List[Enum] | Enum | object) -> List[str]:
 # Sort / Filter
 #
 ###############################################################################
-def filter_list_coding(standard_list: List[Coding] | List, code_list: List[Coding] | List[str]) -> List[Coding]:
+def filter_list_coding(standard_list: List[Coding] | List, code_list: List[Coding] | List[str] | CodeIndex) -> List[Coding]:
     """
     :param standard_list: Standard list of codes from a ValueSet
-    :param code_list: List of codes to filter
+    :param code_list: List of codes to filter, matched on (system, code). Plain string codes match any system.
     :return: List Coding in `standard_list` filtered by `code_list`
     """
     # guard inputs
     standard_list = as_list_coding(standard_list)
-    if is_list_type(code_list, Coding):
-        code_list = [code.code for code in code_list]
-    results = list()
-    for standard in standard_list:
-        if standard.code in code_list:
-            results.append(standard)
-    return results
+    if not isinstance(code_list, CodeIndex):
+        code_list = CodeIndex(code_list)
+    return [standard for standard in standard_list if standard in code_list]
 
 def exclude_list(input_list: list, exclude_list: list) -> list:
     """
@@ -127,6 +129,7 @@ def parse_fhir_date(yyyy_mm_dd) -> FHIRDate:
     :param yyyy_mm_dd: YEAR Month Date
     :return: FHIR Date with only the date part.
     """
+    from fhirclient.models.fhirdate import FHIRDate
     if yyyy_mm_dd and isinstance(yyyy_mm_dd, FHIRDate):
         return yyyy_mm_dd
     if yyyy_mm_dd and isinstance(yyyy_mm_dd, str):
@@ -0,0 +1,93 @@
+"""
+Import-time budget for `cumulus_library_glioma.tools` modules.
+
+Heavy dependencies (pandas, pyarrow, duckdb, fhirclient, cumulus-library builders)
+are imported inside the functions that use them, so CLI startup only pays for
+what it runs. Each module is imported in a fresh interpreter with `-X importtime`,
+the fastest of `repeat` runs is compared to the budget, and the exit code is
+nonzero when any module is over budget, with its heaviest imports listed.
+
+    python -m cumulus_library_glioma.tools.importtime [--budget MS] [--repeat N] [--module NAME]
+"""
+import os
+import sys
+import pkgutil
+import argparse
+import subprocess
+from typing import List
+from cumulus_library_glioma import tools
+
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS') or 100)
+
+def list_modules() -> List[str]:
+    """
+    :return: every module of `cumulus_library_glioma.tools`
+    """
+    return sorted(f'{tools.__name__}.{module.name}' for module in pkgutil.iter_modules(tools.__path__))
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    :param stderr: output of `python -X importtime`
+    :return: dict of imported module -> (self ms, cumulative ms)
+    """
+    parsed = dict()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        parsed[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    return parsed
+
+def measure(module: str, repeat=3) -> dict:
+    """
+    :param module: module to import in a fresh interpreter
+    :param repeat: number of runs, the fastest run is kept
+    :return: dict of imported module -> (self ms, cumulative ms) of the fastest run
+    """
+    fastest = None
+    for _ in range(repeat):
+        run = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True)
+        if run.returncode:
+            raise ImportError(f'{module}: {run.stderr.strip().splitlines()[-1]}')
+        parsed = parse_importtime(run.stderr)
+        if fastest is None or parsed[module][1] < fastest[module][1]:
+            fastest = parsed
+    return fastest
+
+def heaviest(parsed: dict, top=5) -> List[tuple]:
+    """
+    :return: (name, self ms) of the imports with the largest self time
+    """
+    return sorted(((name, times[0]) for name, times in parsed.items()), key=lambda item: item[1], reverse=True)[:top]
+
+def check(modules: List[str] = None, budget_ms=IMPORT_BUDGET_MS, repeat=3) -> List[str]:
+    """
+    :param modules: modules to measure, default `list_modules()`
+    :param budget_ms: max cumulative import time per module
+    :param repeat: runs per module, the fastest run is kept
+    :return: list of modules over budget
+    """
+    over = list()
+    print(f"{'module':<50} {'ms':>9} {'budget':>9}")
+    for module in (modules if modules else list_modules()):
+        parsed = measure(module, repeat)
+        ms = parsed[module][1]
+        print(f"{module:<50} {ms:>9.1f} {budget_ms:>9.1f}")
+        if ms > budget_ms:
+            over.append(module)
+            for name, self_ms in heaviest(parsed):
+                print(f"    {name:<46} {self_ms:>9.1f}")
+    return over
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fail when a tools module is slower to import than the budget')
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_MS, help='max import time per module in ms')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module, the fastest run is kept')
+    parser.add_argument('--module', action='append', help='module to check, default is every tools module')
+    args = parser.parse_args()
+
+    over_budget = check(args.module, args.budget, args.repeat)
+    if over_budget:
+        print(f'over budget: {over_budget}')
+        sys.exit(1)
@@ -0,0 +1,154 @@
+"""
+Incremental rebuild of the study period and study population tables.
+
+`etl__completion_encounters` records when each encounter was (re)exported.
+Subjects with any encounter exported after `since` are "delta subjects".
+Every cohort table below is computed per subject, so only delta subjects rows
+are deleted and recomputed, and a weekly refresh costs in proportion to the
+delta instead of the whole EHR.
+
+The delta SQL is derived from the `athena/*.sql` stages themselves: the
+`create table` header becomes `insert into`, and every subject scoped source
+table is replaced by a subquery restricted to delta subjects.
+
+NOTE: DELETE requires Iceberg tables in Athena, DuckDB supports it natively.
+
+    python -m cumulus_library_glioma.tools.incremental --db study.duckdb --since '2026-01-01 00:00:00' [--data DIR]
+"""
+import re
+import argparse
+from pathlib import Path
+from typing import List
+from cumulus_library_glioma.tools import filetool, engine
+from cumulus_library_glioma.tools.filetool import PREFIX
+
+DELTA_SUBJECT = f'{PREFIX}__delta_subject'
+
+INCREMENTAL_STAGES = [
+    f'{PREFIX}__cohort_study_period',
+    f'{PREFIX}__cohort_study_population',
+    f'{PREFIX}__cohort_study_population_dx',
+    f'{PREFIX}__cohort_study_population_rx',
+    f'{PREFIX}__cohort_study_population_lab',
+    f'{PREFIX}__cohort_study_population_doc',
+    f'{PREFIX}__cohort_study_population_diag',
+    f'{PREFIX}__cohort_study_population_proc',
+]
+
+SUBJECT_SCOPED = [
+    'core__encounter',
+    'core__condition',
+    'core__documentreference',
+    'core__medicationrequest',
+    'core__observation',
+    'core__diagnosticreport',
+    'core__procedure',
+    f'{PREFIX}__cohort_study_period',
+    f'{PREFIX}__cohort_study_population',
+]
+
+###############################################################################
+#
+# SQL
+#
+###############################################################################
+def sql_delta_subject(since: str) -> str:
+    """
+    :param since: timestamp of the previous refresh, like '2026-01-01 00:00:00'
+    :return: SQL CTAS of subjects with new or changed encounters
+    """
+    return '\n'.join([
+        f"create table {DELTA_SUBJECT} as",
+        f"select  distinct E.subject_ref",
+        f"from    etl__completion_encounters as etl,",
+        f"        core__encounter as E",
+        f"where   E.encounter_ref = concat('Encounter/', etl.encounter_id)",
+        f"and     etl.export_time > timestamp '{since}'",
+        f";"])
+
+def sql_subject_scope(table: str) -> str:
+    """
+    :param table: subject scoped source table
+    :return: SQL subquery of `table` restricted to delta subjects
+    """
+    return f'(select * from {table} where subject_ref in (select subject_ref from {DELTA_SUBJECT}))'
+
+def sql_merge(sql: str) -> List[str]:
+    """
+    :param sql: CTAS stage, like `glioma__cohort_study_population_dx.sql`
+    :return: SQL statements deleting then re-inserting delta subjects rows
+    """
+    header = re.search(r'create\s+table\s+(\w+)\s+as\s', sql, flags=re.IGNORECASE)
+    if not header:
+        raise Exception(f'not a CTAS stage: {sql[:80]}')
+    table = header.group(1)
+    body = sql[header.end():]
+    for source in SUBJECT_SCOPED:
+        body = re.sub(rf'\b{source}\b(?!\.)', sql_subject_scope(source), body)
+    return [f'delete from {table} where subject_ref in (select subject_ref from {DELTA_SUBJECT});',
+            f'insert into {table}\n{body}']
+
+def queries(since: str) -> List[tuple]:
+    """
+    :param since: timestamp of the previous refresh
+    :return: list of (stage name, [statements]) in dependency order
+    """
+    stages = [(DELTA_SUBJECT, [f'drop table if exists {DELTA_SUBJECT};', sql_delta_subject(since)])]
+    for table in INCREMENTAL_STAGES:
+        stages.append((table, sql_merge(filetool.read_text(filetool.path_athena(f'{table}.sql')))))
+    return stages
+
+def make(since: str) -> List[Path]:
+    """
+    Write the incremental SQL to `athena/incremental/`
+    :param since: timestamp of the previous refresh
+    :return: list of SQL files
+    """
+    target_dir = filetool.path_athena('incremental')
+    target_dir.mkdir(exist_ok=True)
+    return [Path(filetool.write_text('\n\n'.join(statements), target_dir / f'{name}.sql'))
+            for name, statements in queries(since)]
+
+###############################################################################
+#
+# Execute
+#
+###############################################################################
+def run(con, since: str) -> List[dict]:
+    """
+    Merge delta subjects into existing cohort tables. Each table is deleted and re-inserted in one
+    transaction, rolled back on error, and stages reading a failed table are skipped.
+    :param con: duckdb connection holding a previous full build and refreshed `core__*` tables
+    :param since: timestamp of the previous refresh
+    :return: list of stage measurements
+    """
+    measured, failed = list(), set()
+    for name, statements in queries(since):
+        if any(re.search(rf'\b{table}\b', '\n'.join(statements)) for table in failed):
+            failed.add(name)
+            measured.append({'section': 'incremental', 'stage': name, 'tables': [], 'rows': 0, 'seconds': 0.0,
+                             'peak_bytes': 0, 'error': 'skipped, upstream stage failed'})
+            continue
+        if name != DELTA_SUBJECT:
+            statements = ['begin transaction;'] + statements + ['commit;']
+        stage = engine.run_sql(con, 'incremental', name, statements)
+        if stage['error']:
+            failed.add(name)
+            try:
+                con.execute('rollback;')
+            except Exception:
+                pass
+        measured.append(stage)
+    return measured
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental cohort rebuild')
+    parser.add_argument('--db', required=True, help='duckdb database file of a previous full build')
+    parser.add_argument('--since', required=True, help="previous refresh timestamp, like '2026-01-01 00:00:00'")
+    parser.add_argument('--data', help='reload refreshed core__* tables from this folder first')
+    args = parser.parse_args()
+
+    connection = engine.connect(args.db)
+    if args.data:
+        engine.load_tables(connection, args.data)
+    engine.print_report(run(connection, args.since))
@@ -0,0 +1,216 @@
+"""
+Streaming reader of ValueSet concepts.
+
+`json.load` of a SNOMED scale VSAC expansion holds the whole document, then
+every concept again as a `Coding`. This pull parser reads the file in chunks,
+walks the JSON structure without materializing it, and only decodes one
+`compose.include[].concept[]` or `expansion.contains[]` entry at a time, so
+memory stays constant regardless of expansion size.
+
+Works for a single ValueSet or a list of ValueSets (VSAC API responses).
+"""
+import json
+from json.decoder import scanstring
+from pathlib import Path
+from typing import Iterator, TextIO
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+SCALAR_END = ',]} \t\n\r'
+
+class JsonReader:
+    """
+    Chunked cursor over a JSON text file.
+    """
+    def __init__(self, text_file: TextIO, chunk_size=CHUNK_SIZE):
+        self.file = text_file
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        """
+        Drop consumed text and read the next chunk.
+        :return: False at end of file
+        """
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """
+        :return: next non whitespace char, empty at end of file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at {self.buf[self.pos:self.pos + 40]!r}')
+        self.pos += 1
+
+    def string(self) -> str:
+        self.expect('"')
+        while True:
+            try:
+                value, end = scanstring(self.buf, self.pos)
+                self.pos = end
+                return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def scalar(self) -> None:
+        """
+        Skip a number, true, false or null.
+        """
+        self.peek()
+        while True:
+            end = self.pos
+            while end < len(self.buf) and self.buf[end] not in SCALAR_END:
+                end += 1
+            if end < len(self.buf) or not self.fill():
+                self.pos = end
+                return
+
+    def value(self):
+        """
+        :return: next JSON value, decoded in full
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self.fill():
+                self.eof = True
+
+    def items(self) -> Iterator[str]:
+        """
+        Iterate keys of the next object, the caller consumes each value.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.string()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def elements(self) -> Iterator[None]:
+        """
+        Iterate elements of the next array, the caller consumes each element.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield None
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def skip(self) -> None:
+        char = self.peek()
+        if char == '{':
+            for _ in self.items():
+                self.skip()
+        elif char == '[':
+            for _ in self.elements():
+                self.skip()
+        elif char == '"':
+            self.string()
+        else:
+            self.scalar()
+
+###############################################################################
+#
+# ValueSet concepts
+#
+###############################################################################
+def flatten_contains(concept: dict) -> Iterator[dict]:
+    """
+    Hierarchical expansions nest `contains` inside a concept.
+    """
+    nested = concept.pop('contains', [])
+    yield concept
+    for child in nested:
+        yield from flatten_contains(child)
+
+def walk_include(reader: JsonReader) -> Iterator[dict]:
+    """
+    One `compose.include[]` entry, each concept gets the include `system`.
+    Concepts listed before the `system` key are held until it is read.
+    """
+    system, pending = None, list()
+    for key in reader.items():
+        if key == 'system' and reader.peek() == '"':
+            system = reader.string()
+            for concept in pending:
+                concept['system'] = system
+                yield concept
+            pending = list()
+        elif key == 'concept' and reader.peek() == '[':
+            for _ in reader.elements():
+                concept = reader.value()
+                if system is None:
+                    pending.append(concept)
+                else:
+                    concept['system'] = system
+                    yield concept
+        else:
+            reader.skip()
+    for concept in pending:
+        concept['system'] = system
+        yield concept
+
+def walk(reader: JsonReader, path: tuple = ()) -> Iterator[dict]:
+    char = reader.peek()
+    if char == '{':
+        for key in reader.items():
+            if path[-1:] == ('compose',) and key == 'include' and reader.peek() == '[':
+                for _ in reader.elements():
+                    yield from walk_include(reader)
+            elif path[-1:] == ('expansion',) and key == 'contains' and reader.peek() == '[':
+                for _ in reader.elements():
+                    yield from flatten_contains(reader.value())
+            else:
+                yield from walk(reader, path + (key,))
+    elif char == '[':
+        for _ in reader.elements():
+            yield from walk(reader, path)
+    else:
+        reader.skip()
+
+def iter_concepts(json_file: Path | str, chunk_size=CHUNK_SIZE) -> Iterator[dict]:
+    """
+    :param json_file: ValueSet JSON file, or a list of ValueSets
+    :param chunk_size: chars read at a time
+    :return: generator of concept dicts (system, code, display, ...) from
+             `compose.include[].concept[]` then `expansion.contains[]`, in file order
+    """
+    with open(json_file, encoding='UTF-8') as text_file:
+        yield from walk(JsonReader(text_file, chunk_size))
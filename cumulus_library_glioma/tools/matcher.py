@@ -0,0 +1,73 @@
+"""
+Aho-Corasick multi-pattern matcher for search terms over code and display text.
+
+The automaton is compiled once from all search terms, then each text is
+scanned in a single pass regardless of how many terms there are, reporting
+every term found as a (case-insensitive) substring.
+"""
+from collections import deque
+from typing import List, Iterable
+
+class TermMatcher:
+    """
+    Case-insensitive substring matcher for many terms at once.
+    """
+    def __init__(self, terms: Iterable[str]):
+        """
+        :param terms: search terms, duplicates (ignoring case) and empty terms are dropped
+        """
+        lowered = dict()
+        for term in terms:
+            if term and term.lower() not in lowered:
+                lowered[term.lower()] = term
+        self.terms = list(lowered.values())
+        self._goto = [dict()]
+        self._fail = [0]
+        self._out = [list()]
+        for pos, term in enumerate(lowered):
+            self._insert(term, pos)
+        self._link()
+
+    def _insert(self, term: str, pos: int) -> None:
+        node = 0
+        for char in term:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append(dict())
+                self._fail.append(0)
+                self._out.append(list())
+                self._goto[node][char] = child
+            node = child
+        self._out[node].append(pos)
+
+    def _link(self) -> None:
+        """
+        Breadth first failure links, each node also reports the terms of its failure node.
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def search(self, text: str) -> List[str]:
+        """
+        :param text: text to scan, for example `code display`
+        :return: matched terms in the order they were given
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return [self.terms[pos] for pos in sorted(found)]
@@ -0,0 +1,270 @@
+"""
+Per-stage query profiling of the study manifest.
+
+Every stage is measured for runtime, output rows, data scanned and engine plan
+statistics, then appended to the `glioma__profile` table and written as a JSON
+report. Each run is stamped with `run_time`, so a regression in a stage like
+`glioma__cohort_study_period` shows up run over run and site by site.
+
+* Athena: pyathena query statistics (`data_scanned_in_bytes`, engine time, query id)
+* DuckDB: `EXPLAIN (ANALYZE, FORMAT JSON)` of every statement (rows scanned, cpu time, slowest operators)
+
+    python -m cumulus_library_glioma.tools.profiler --data DATA_DIR [--report FILE] [--compare PREVIOUS_FILE]
+    python -m cumulus_library_glioma.tools.profiler --athena --region R --workgroup W --schema S [--profile P]
+"""
+import re
+import json
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+from typing import List, Callable
+from cumulus_library_glioma.tools import filetool, engine, scheduler
+from cumulus_library_glioma.tools.filetool import PREFIX
+
+PROFILE_TABLE = f'{PREFIX}__profile'
+
+PROFILE_COLS = {
+    'run_time': 'timestamp',
+    'engine': 'varchar',
+    'section': 'varchar',
+    'stage': 'varchar',
+    'tables': 'varchar',
+    'seconds': 'double',
+    'rows': 'bigint',
+    'rows_scanned': 'bigint',
+    'bytes_scanned': 'bigint',
+    'peak_bytes': 'bigint',
+    'cpu_seconds': 'double',
+    'plan': 'varchar',
+    'query_id': 'varchar',
+    'error': 'varchar',
+}
+
+TOP_OPERATORS = 3
+
+def measure(stage: dict, engine_name: str) -> dict:
+    """
+    :param stage: scheduler stage
+    :param engine_name: 'duckdb' or 'athena'
+    :return: dict stage measurements, a superset of `engine.run_sql` measurements
+    """
+    return {'engine': engine_name, 'section': stage['section'], 'stage': stage['name'], 'tables': [],
+            'seconds': 0.0, 'rows': 0, 'rows_scanned': 0, 'bytes_scanned': 0, 'peak_bytes': 0,
+            'cpu_seconds': 0.0, 'operators': [], 'query_id': [], 'error': None, 'skipped': None}
+
+def is_view(sql: str) -> bool:
+    return bool(re.match(r'\s*create\s+(or\s+replace\s+)?view', scheduler.strip_comments(sql), flags=re.IGNORECASE))
+
+###############################################################################
+#
+# DuckDB
+#
+###############################################################################
+def list_operators(plan: dict) -> List[dict]:
+    """
+    :param plan: DuckDB JSON profile
+    :return: flat list of plan operators with name, seconds and output rows
+    """
+    operators = list()
+    for child in plan.get('children', []):
+        if child.get('operator_name') != 'EXPLAIN_ANALYZE':
+            operators.append({'operator': child.get('operator_name'),
+                              'seconds': round(child.get('operator_timing', 0.0), 4),
+                              'rows': child.get('operator_cardinality', 0)})
+        operators += list_operators(child)
+    return operators
+
+def explain_analyze(cursor, sql: str) -> dict:
+    """
+    :param cursor: duckdb cursor
+    :param sql: statement to execute, it is executed (not only planned)
+    :return: DuckDB JSON profile of `sql`
+    """
+    return json.loads(cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}').fetchall()[0][1])
+
+def add_plan(measured: dict, plan: dict) -> None:
+    measured['rows_scanned'] += plan.get('cumulative_rows_scanned', 0)
+    measured['bytes_scanned'] += plan.get('total_bytes_read', 0)
+    measured['peak_bytes'] = max(measured['peak_bytes'], plan.get('system_peak_buffer_memory', 0))
+    measured['cpu_seconds'] += plan.get('cpu_time', 0.0)
+    measured['operators'] += list_operators(plan)
+
+def duckdb_executor(con) -> Callable[[dict], dict]:
+    """
+    Views are profiled by counting their rows, so their cost is not hidden.
+    :param con: duckdb connection, each stage runs on its own cursor
+    :return: function executing and profiling one stage
+    """
+    def execute(stage: dict) -> dict:
+        measured = measure(stage, 'duckdb')
+        cursor = con.cursor()
+        start = time.perf_counter()
+        try:
+            views = list()
+            for sql in stage['statements']:
+                if is_view(sql):
+                    cursor.execute(sql)
+                    views += engine.name_created(sql)
+                else:
+                    for drop in scheduler.sql_drop(sql):
+                        cursor.execute(drop)
+                    add_plan(measured, explain_analyze(cursor, sql))
+                measured['tables'] += engine.name_created(sql)
+            for view in views:
+                add_plan(measured, explain_analyze(cursor, f'SELECT count(*) FROM {view}'))
+            for table in measured['tables']:
+                measured['rows'] += cursor.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+        except Exception as e:
+            measured['error'] = str(e).splitlines()[0]
+        finally:
+            cursor.close()
+        measured['seconds'] = round(time.perf_counter() - start, 4)
+        return measured
+    return execute
+
+###############################################################################
+#
+# Athena
+#
+###############################################################################
+def add_query_stats(measured: dict, cursor) -> None:
+    """
+    :param cursor: pyathena cursor after a statement
+    """
+    measured['bytes_scanned'] += cursor.data_scanned_in_bytes or 0
+    measured['cpu_seconds'] += (cursor.engine_execution_time_in_millis or 0) / 1000
+    measured['query_id'].append(cursor.query_id)
+
+def athena_executor(backend) -> Callable[[dict], dict]:
+    """
+    :param backend: connected cumulus-library AthenaDatabaseBackend
+    :return: function executing and profiling one stage, see `scheduler.athena_executor`
+    """
+    return scheduler.athena_executor(backend, lambda stage: measure(stage, 'athena'), add_query_stats, count_rows=True)
+
+###############################################################################
+#
+# Profile table / report
+#
+###############################################################################
+def sql_literal(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def format_plan(operators: List[dict]) -> str:
+    """
+    :param operators: plan operators of one stage
+    :return: the slowest operators, like `HASH_JOIN 0.412s 131314 rows; SEQ_SCAN ...`
+    """
+    slowest = sorted(operators, key=lambda op: op['seconds'], reverse=True)[:TOP_OPERATORS]
+    return '; '.join(f"{op['operator']} {op['seconds']:.3f}s {op['rows']} rows" for op in slowest)
+
+def profile_row(measured: dict, run_time: str) -> dict:
+    """
+    :param measured: stage measurements, stages skipped by `scheduler.schedule` have no profile keys
+    :param run_time: run timestamp, like '2026-01-01 00:00:00'
+    :return: dict row of the profile table
+    """
+    row = {col: measured.get(col) for col in PROFILE_COLS}
+    row['run_time'] = run_time
+    row['tables'] = ','.join(measured['tables'])
+    row['cpu_seconds'] = round(measured.get('cpu_seconds', 0.0), 4)
+    row['plan'] = format_plan(measured.get('operators', []))
+    row['query_id'] = ','.join(measured.get('query_id', []))
+    return row
+
+def sql_profile(measured: List[dict], run_time: str) -> List[str]:
+    """
+    :param measured: list of stage measurements
+    :param run_time: run timestamp, like '2026-01-01 00:00:00'
+    :return: SQL creating `glioma__profile` once and appending this run
+    """
+    empty = ',\n'.join(f'        cast(NULL as {datatype}) as "{col}"' for col, datatype in PROFILE_COLS.items())
+    create = f'create table if not exists {PROFILE_TABLE} as\nselect\n{empty}\nwhere 1 = 0'
+    values = list()
+    for stage in measured:
+        row = profile_row(stage, run_time)
+        literals = [f"timestamp '{run_time}'"] + [sql_literal(row[col]) for col in list(PROFILE_COLS)[1:]]
+        values.append(f"({', '.join(literals)})")
+    return [create, f'insert into {PROFILE_TABLE} values\n' + ',\n'.join(values)]
+
+def compare(previous: List[dict], current: List[dict], threshold=1.25, min_seconds=0.1) -> List[dict]:
+    """
+    :param previous: stage measurements of a previous run (JSON report 'stages')
+    :param current: stage measurements of this run
+    :param threshold: ratio of current/previous seconds reported as a regression
+    :param min_seconds: ignore stages faster than this, they are noise
+    :return: list of {stage, previous, current, ratio} regressions
+    """
+    before = {stage['stage']: stage['seconds'] for stage in previous}
+    regressions = list()
+    for stage in current:
+        was = before.get(stage['stage'])
+        if was and max(was, stage['seconds']) >= min_seconds and stage['seconds'] / was >= threshold:
+            regressions.append({'stage': stage['stage'], 'previous': was, 'current': stage['seconds'],
+                                'ratio': round(stage['seconds'] / was, 2)})
+    return regressions
+
+def print_profile(measured: List[dict]) -> None:
+    print(f"{'stage':<60} {'seconds':>9} {'rows':>12} {'scanned MB':>10}  plan")
+    for stage in measured:
+        scanned = stage.get('bytes_scanned', 0) / 2 ** 20
+        print(f"{stage['stage']:<60} {stage['seconds']:>9.3f} {stage['rows']:>12} {scanned:>10.1f}  "
+              f"{format_plan(stage.get('operators', []))}")
+        if stage['error']:
+            print(f"    error: {stage['error']}")
+        if stage.get('skipped'):
+            print(f"    skipped: {stage['skipped']}")
+
+def run(execute: Callable[[dict], dict], execute_sql: Callable[[str], None], parallel=1,
+        manifest: Path | str = None, report: Path | str = None) -> List[dict]:
+    """
+    :param execute: function executing one stage, see `duckdb_executor` and `athena_executor`
+    :param execute_sql: function executing one SQL statement, used to write `glioma__profile`
+    :param parallel: max concurrent stages, default 1 so stage timings do not contend
+    :param manifest: path to manifest.toml, default is this study
+    :param report: write stage measurements as JSON
+    :return: list of stage measurements
+    """
+    run_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    measured = scheduler.schedule(scheduler.read_stages(manifest), execute, parallel)
+    for sql in sql_profile(measured, run_time):
+        execute_sql(sql)
+    print_profile(measured)
+    if report:
+        filetool.write_json({'run_time': run_time, 'stages': measured}, Path(report).absolute())
+    return measured
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile every stage of the study manifest')
+    parser.add_argument('--parallel', type=int, default=1, help='max concurrent stages')
+    parser.add_argument('--report', help='write stage measurements as JSON')
+    parser.add_argument('--compare', help='previous JSON report, print stages that got slower')
+    parser.add_argument('--data', help='DuckDB: folder of core__* tables (Parquet or ndjson)')
+    parser.add_argument('--db', default=':memory:', help='DuckDB: database file')
+    parser.add_argument('--athena', action='store_true', help='profile Athena instead of DuckDB')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--workgroup', default='cumulus')
+    parser.add_argument('--profile')
+    parser.add_argument('--schema')
+    args = parser.parse_args()
+
+    if args.athena:
+        from cumulus_library.databases.athena import AthenaDatabaseBackend
+        athena = AthenaDatabaseBackend(args.region, args.workgroup, args.profile, args.schema)
+        athena.connect()
+        stages = run(athena_executor(athena), athena.cursor().execute, args.parallel, report=args.report)
+    else:
+        connection = engine.connect(args.db)
+        if args.data:
+            engine.load_tables(connection, args.data)
+        stages = run(duckdb_executor(connection), connection.execute, args.parallel, report=args.report)
+
+    if args.compare:
+        for slower in compare(filetool.read_json(args.compare)['stages'], stages):
+            print(f"regression {slower['stage']}: {slower['previous']:.3f}s -> {slower['current']:.3f}s "
+                  f"(x{slower['ratio']})")
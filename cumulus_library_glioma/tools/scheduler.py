@@ -0,0 +1,295 @@
+"""
+Dependency-graph scheduler for the study manifest.
+
+`manifest.toml` is a linear list of stages, but most stages only depend on one
+or two upstream tables. Each SQL file is parsed for the `glioma__*`, `core__*`
+and `etl__*` tables it creates and reads, stages are arranged in a DAG, and
+ready stages run concurrently up to a parallelism limit. End-to-end build time
+approaches the critical path instead of the sum of all stages.
+
+    python -m cumulus_library_glioma.tools.scheduler --data DATA_DIR [--parallel 4]
+    python -m cumulus_library_glioma.tools.scheduler --athena --region R --workgroup W --schema S [--profile P]
+"""
+import re
+import time
+import argparse
+from pathlib import Path
+from typing import List, Callable
+from concurrent import futures
+from cumulus_library_glioma.tools import filetool, engine
+from cumulus_library_glioma.tools.filetool import PREFIX
+
+REFERENCE = re.compile(rf'\b((?:{PREFIX}|core|etl)__\w+|loinc\.\w+)\b', flags=re.IGNORECASE)
+
+###############################################################################
+#
+# Parse
+#
+###############################################################################
+def strip_comments(sql: str) -> str:
+    return re.sub(r'--[^\n]*', '', sql)
+
+def split_statements(sql: str) -> List[str]:
+    """
+    :param sql: one or more SQL statements
+    :return: list of statements, split on semicolons outside of quotes and comments
+    """
+    statements, start, quote, pos = list(), 0, None, 0
+    while pos < len(sql):
+        char = sql[pos]
+        if quote:
+            quote = None if char == quote else quote
+        elif char in ("'", '"'):
+            quote = char
+        elif sql.startswith('--', pos):
+            pos = sql.find('\n', pos)
+            pos = len(sql) if pos < 0 else pos
+        elif char == ';':
+            statements.append(sql[start:pos])
+            start = pos + 1
+        pos += 1
+    statements.append(sql[start:])
+    return [statement.strip() for statement in statements if strip_comments(statement).strip()]
+
+def make_stage(section: str, name: str, statements: List[str], file: Path = None) -> dict:
+    """
+    :param section: manifest section
+    :param name: stage name, usually the SQL filename
+    :param statements: SQL statements of this stage
+    :param file: source file of this stage
+    :return: dict stage with the tables it `creates` and `reads`
+    """
+    sql = strip_comments('\n'.join(statements))
+    creates = set(engine.name_created(sql))
+    reads = set(name for name in REFERENCE.findall(sql)) - creates
+    return {'section': section, 'name': name, 'file': file, 'statements': statements,
+            'creates': creates, 'reads': reads}
+
+def read_stages(manifest: Path | str = None) -> List[dict]:
+    """
+    :param manifest: path to manifest.toml, default is this study
+    :return: list of stages in manifest order
+    """
+    stages = list()
+    for section, files in engine.read_manifest(manifest):
+        for file in files:
+            if file.suffix == '.toml':
+                for table, upload, delimiter in engine.read_uploads(file):
+                    stages.append(make_stage(section, upload.name, [engine.sql_upload(table, upload, delimiter)], file))
+            else:
+                sql = engine.athena_compat(filetool.read_text(file))
+                stages.append(make_stage(section, file.name, split_statements(sql), file))
+    return stages
+
+def make_dag(stages: List[dict]) -> dict:
+    """
+    :param stages: list of stages in manifest order
+    :return: dict of stage name -> set of upstream stage names
+    """
+    creators = dict()
+    for stage in stages:
+        for table in stage['creates']:
+            creators.setdefault(table, set()).add(stage['name'])
+    dag = dict()
+    for stage in stages:
+        upstream = set()
+        for table in stage['reads']:
+            upstream |= creators.get(table, set())
+        dag[stage['name']] = upstream - {stage['name']}
+    return dag
+
+def downstream(stages: List[dict], names: List[str]) -> List[dict]:
+    """
+    :param stages: list of stages in manifest order
+    :param names: changed stage names (SQL or upload file names), for example `buildcache.changed()`
+    :return: stages in `names` and every stage depending on them, in manifest order
+    """
+    dag = make_dag(stages)
+    selected = set(names)
+    for stage in stages:
+        if dag[stage['name']] & selected:
+            selected.add(stage['name'])
+    return [stage for stage in stages if stage['name'] in selected]
+
+def critical_path(dag: dict, seconds: dict) -> tuple:
+    """
+    :param dag: dict of stage name -> upstream stage names
+    :param seconds: dict of stage name -> measured seconds
+    :return: (seconds, [stage names]) of the longest dependency chain
+    """
+    longest = dict()
+
+    def visit(name):
+        if name not in longest:
+            best = max([visit(up) for up in dag[name]], key=lambda path: path[0], default=(0.0, []))
+            longest[name] = (best[0] + seconds.get(name, 0.0), best[1] + [name])
+        return longest[name]
+
+    return max([visit(name) for name in dag], key=lambda path: path[0], default=(0.0, []))
+
+###############################################################################
+#
+# Schedule
+#
+###############################################################################
+def schedule(stages: List[dict], execute: Callable[[dict], dict], parallel=4, processes=False) -> List[dict]:
+    """
+    Submit every stage whose upstream stages are complete, at most `parallel` at a time.
+    Stages downstream of a failed stage are skipped.
+    :param stages: list of stages
+    :param execute: function executing one stage and returning its measurements
+    :param parallel: max concurrent stages
+    :param processes: True uses a process pool, `execute` and stages must be picklable
+    :return: list of stage measurements in completion order
+    """
+    dag = make_dag(stages)
+    by_name = {stage['name']: stage for stage in stages}
+    waiting = {name: set(upstream) for name, upstream in dag.items()}
+    failed, measured = set(), list()
+
+    pool_type = futures.ProcessPoolExecutor if processes else futures.ThreadPoolExecutor
+    with pool_type(max_workers=parallel) as pool:
+        running = dict()
+        while waiting or running:
+            for name in [name for name, upstream in waiting.items() if not upstream]:
+                del waiting[name]
+                running[pool.submit(execute, by_name[name])] = name
+            for name in [name for name, upstream in waiting.items() if upstream & failed]:
+                del waiting[name]
+                failed.add(name)
+                measured.append({'section': by_name[name]['section'], 'stage': name, 'tables': [], 'rows': 0,
+                                 'seconds': 0.0, 'peak_bytes': 0, 'error': 'skipped, upstream stage failed'})
+            if not running:
+                if waiting:
+                    raise Exception(f'dependency cycle, stages can never run: {sorted(waiting)}')
+                continue
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = future.result()
+                measured.append(stage)
+                if stage['error']:
+                    failed.add(name)
+                    continue
+                for upstream in waiting.values():
+                    upstream.discard(name)
+    return measured
+
+###############################################################################
+#
+# Executors
+#
+###############################################################################
+def measure_stage(stage: dict) -> dict:
+    """
+    :return: dict stage measurements before running, `skipped` stages count as done for their dependents
+    """
+    return {'section': stage['section'], 'stage': stage['name'], 'tables': [],
+            'rows': 0, 'seconds': 0.0, 'peak_bytes': 0, 'error': None, 'skipped': None}
+
+def sql_drop(sql: str) -> List[str]:
+    """
+    :param sql: one statement
+    :return: DROP TABLE statements so a CTAS can rerun
+    """
+    if re.match(r'\s*create\s+table', strip_comments(sql), flags=re.IGNORECASE):
+        return [f'DROP TABLE IF EXISTS {table}' for table in engine.name_created(sql)]
+    return list()
+
+def duckdb_executor(con) -> Callable[[dict], dict]:
+    """
+    :param con: duckdb connection, each stage runs on its own cursor
+    :return: function executing one stage
+    """
+    def execute(stage: dict) -> dict:
+        cursor = con.cursor()
+        try:
+            return engine.run_sql(cursor, stage['section'], stage['name'], stage['statements'])
+        finally:
+            cursor.close()
+    return execute
+
+def athena_executor(backend, measure: Callable[[dict], dict] = measure_stage,
+                    on_query: Callable[[dict, object], None] = None, count_rows=False) -> Callable[[dict], dict]:
+    """
+    File upload stages are skipped, they run with cumulus-library, and count as done for their dependents.
+    :param backend: connected cumulus-library AthenaDatabaseBackend
+    :param measure: function returning the initial measurements of a stage, see `measure_stage`
+    :param on_query: optional function(measured, cursor) called after every statement, like query statistics
+    :param count_rows: True counts the rows of every created table
+    :return: function executing one stage
+    """
+    def execute(stage: dict) -> dict:
+        measured = measure(stage)
+        if stage['file'] and stage['file'].suffix == '.toml':
+            measured['skipped'] = 'file uploads run with cumulus-library'
+            return measured
+        start = time.perf_counter()
+        try:
+            cursor = backend.cursor()
+            for sql in stage['statements']:
+                for drop in sql_drop(sql):
+                    cursor.execute(drop)
+                cursor.execute(sql)
+                if on_query:
+                    on_query(measured, cursor)
+                measured['tables'] += engine.name_created(sql)
+            for table in measured['tables'] if count_rows else []:
+                cursor.execute(f'SELECT count(*) FROM {table}')
+                measured['rows'] += cursor.fetchone()[0]
+        except Exception as e:
+            measured['error'] = str(e).splitlines()[0]
+        measured['seconds'] = round(time.perf_counter() - start, 4)
+        return measured
+    return execute
+
+###############################################################################
+#
+# Run
+#
+###############################################################################
+def print_summary(stages: List[dict], measured: List[dict], wall: float) -> None:
+    seconds = {stage['stage']: stage['seconds'] for stage in measured}
+    path_seconds, path = critical_path(make_dag(stages), seconds)
+    engine.print_report(measured)
+    print(f'wall {wall:.3f}s, critical path {path_seconds:.3f}s: {" -> ".join(path)}')
+
+def run(execute: Callable[[dict], dict], parallel=4, manifest: Path | str = None, changed: List[str] = None) -> List[dict]:
+    """
+    :param execute: function executing one stage, see `duckdb_executor` and `athena_executor`
+    :param parallel: max concurrent stages
+    :param manifest: path to manifest.toml, default is this study
+    :param changed: optional stage names, only these and their downstream stages are run
+    :return: list of stage measurements
+    """
+    stages = read_stages(manifest)
+    if changed is not None:
+        stages = downstream(stages, changed)
+    start = time.perf_counter()
+    measured = schedule(stages, execute, parallel)
+    print_summary(stages, measured, time.perf_counter() - start)
+    return measured
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the study manifest as a dependency graph')
+    parser.add_argument('--parallel', type=int, default=4, help='max concurrent stages')
+    parser.add_argument('--data', help='DuckDB: folder of core__* tables (Parquet or ndjson)')
+    parser.add_argument('--db', default=':memory:', help='DuckDB: database file')
+    parser.add_argument('--athena', action='store_true', help='run against Athena instead of DuckDB')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--workgroup', default='cumulus')
+    parser.add_argument('--profile')
+    parser.add_argument('--schema')
+    parser.add_argument('--changed', nargs='*', help='only run these stages (SQL filenames) and their downstream stages')
+    args = parser.parse_args()
+
+    if args.athena:
+        from cumulus_library.databases.athena import AthenaDatabaseBackend
+        athena = AthenaDatabaseBackend(args.region, args.workgroup, args.profile, args.schema)
+        athena.connect()
+        run(athena_executor(athena), args.parallel, changed=args.changed)
+    else:
+        connection = engine.connect(args.db)
+        if args.data:
+            engine.load_tables(connection, args.data)
+        run(duckdb_executor(connection), args.parallel, changed=args.changed)
@@ -0,0 +1,129 @@
+"""
+Study period SQL: `glioma__include_study_period` parameters and `glioma__cohort_study_period`.
+
+The `union` implementation scans `core__encounter` twice (`range` and the
+`EXISTS` filtered `history`), de-duplicates, numbers the periods and joins the
+encounters back to their ordinal on three columns.
+
+The `single_pass` implementation flags every encounter as in range or history
+in one scan, then keeps subjects with any in range encounter (`bool_or`) and
+assigns the ordinal (`dense_rank` over the same ordering) in one window pass.
+Ordinals are per subject, so ranking before the subject filter is equivalent.
+Periods with a NULL end day still consume an ordinal and are then dropped,
+exactly like the three column join of the `union` implementation.
+
+The implementation is chosen when the SQL is generated, not at query time:
+the `union` query is `athena/glioma__cohort_study_period.sql` as checked in,
+and `--single-pass` replaces that file with the `single_pass` query
+(`git checkout` the file to return to the `union` query).
+`tests/test_study_period.py` checks both return the same rows.
+
+    python -m cumulus_library_glioma.tools.study_period [--single-pass]
+"""
+import argparse
+from typing import List
+from pathlib import Path
+from cumulus_library_glioma.tools import filetool
+from cumulus_library_glioma.tools.filetool import PREFIX
+
+INCLUDE_VIEW = f'{PREFIX}__include_study_period'
+COHORT_TABLE = f'{PREFIX}__cohort_study_period'
+
+PERIOD_START = '2008-01-01'
+PERIOD_END = '2025-02-01'
+INCLUDE_HISTORY = True
+
+SQL_SINGLE_PASS = f"""CREATE TABLE {COHORT_TABLE} as
+WITH
+flagged as (
+    select  E.subject_ref,
+            E.period_start_day,
+            E.period_end_day,
+            E.encounter_ref,
+            (
+                (E.period_start_day between include.period_start and include.period_end)
+                and
+                (E.period_end_day   between include.period_start and include.period_end)
+                and
+                (E.period_start_day < CURRENT_DATE)
+            )   as in_range
+    from
+            core__encounter             as E,
+            {INCLUDE_VIEW}  as include
+    where
+            (E.period_start_day between include.period_start and include.period_end
+             and E.period_end_day between include.period_start and include.period_end
+             and E.period_start_day < CURRENT_DATE)
+            or
+            (include.include_history and E.period_start_day < include.period_start)
+),
+ordinal as (
+    select  subject_ref,
+            period_start_day,
+            period_end_day,
+            encounter_ref,
+            BOOL_OR(in_range) OVER (PARTITION BY subject_ref)  as subject_in_range,
+            DENSE_RANK() OVER (
+                PARTITION   BY  subject_ref
+                ORDER       BY  period_start_day    NULLS LAST,
+                                period_end_day      NULLS LAST
+            )   AS period_ordinal
+    from    flagged
+)
+select  distinct
+        subject_ref,
+        period_ordinal,
+        period_start_day,
+        period_end_day,
+        encounter_ref
+from    ordinal
+where   subject_in_range
+and     period_end_day is not null
+;"""
+
+def sql_include_study_period(period_start=PERIOD_START, period_end=PERIOD_END, include_history=INCLUDE_HISTORY) -> str:
+    """
+    :param period_start: first day of the study period, like '2008-01-01'
+    :param period_end: last day of the study period
+    :param include_history: True also keeps encounters before `period_start` of in range subjects
+    :return: SQL CVAS of the study period parameters
+    """
+    return '\n'.join([
+        f"create or replace view {INCLUDE_VIEW} as",
+        f"select * from (values",
+        f"(date('{period_start}'),date('{period_end}'),{include_history})",
+        f") AS t (period_start, period_end, include_history) ;"])
+
+def sql_cohort_study_period(single_pass=False) -> str:
+    """
+    :param single_pass: True for one scan of `core__encounter`, False for the `range` UNION `history` query
+    :return: SQL CTAS of `glioma__cohort_study_period`
+    """
+    if single_pass:
+        return SQL_SINGLE_PASS
+    sql = filetool.read_text(filetool.path_athena(f'{COHORT_TABLE}.sql'))
+    if sql.strip() == SQL_SINGLE_PASS.strip():
+        raise Exception(f'{COHORT_TABLE}.sql was generated with --single-pass, git checkout it for the union query')
+    return sql
+
+def make(period_start=PERIOD_START, period_end=PERIOD_END, include_history=INCLUDE_HISTORY, single_pass=False) -> List[Path]:
+    """
+    Write the study period parameters view, and with `single_pass` the single scan cohort.
+    The `union` cohort is the checked in `athena/glioma__cohort_study_period.sql` and is left as is.
+    :return: list of SQL files
+    """
+    made = [filetool.save_athena_view(INCLUDE_VIEW, sql_include_study_period(period_start, period_end, include_history))]
+    if single_pass:
+        made.append(filetool.save_athena_view(COHORT_TABLE, sql_cohort_study_period(single_pass)))
+    return made
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the study period SQL')
+    parser.add_argument('--period-start', default=PERIOD_START)
+    parser.add_argument('--period-end', default=PERIOD_END)
+    parser.add_argument('--no-history', action='store_true', help='exclude encounters before the study period')
+    parser.add_argument('--single-pass', action='store_true', help='replace the union cohort query with the single scan query')
+    args = parser.parse_args()
+
+    for target in make(args.period_start, args.period_end, not args.no_history, args.single_pass):
+        print(target)
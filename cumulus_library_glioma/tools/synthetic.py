@@ -0,0 +1,301 @@
+"""
+Seeded, streaming generator of synthetic `core__*` tables for benchmarking the cohort SQL.
+
+Patients are generated in chunks; each chunk is written as one Parquet partition
+per table (`OUT_DIR/core__encounter/part-00000.parquet`, ...) and then released,
+so memory is bounded by `chunk` regardless of patient count. Every chunk has its
+own seed, so output is reproducible. Glioma patients draw diagnosis codes from
+`resources/valueset_casedef.csv` with a Zipf skew.
+
+    python -m cumulus_library_glioma.tools.synthetic OUT_DIR --patients 20000 --encounters 50
+"""
+import random
+import argparse
+import datetime
+from pathlib import Path
+from typing import List
+from cumulus_library_glioma.tools import filetool
+
+EPOCH = datetime.date(2004, 1, 1)
+EPOCH_DAYS = 365 * 22
+
+CLASS_CODES = [('AMB', 'ambulatory'), ('EMER', 'emergency'), ('IMP', 'inpatient encounter'), ('OBSENC', 'observation encounter')]
+GENDERS = ['female', 'male', 'other', 'unknown']
+RACES = ['White', 'Black or African American', 'Asian', 'American Indian or Alaska Native', 'Other', None]
+ETHNICITIES = ['Hispanic or Latino', 'Not Hispanic or Latino', None]
+DOC_TYPES = [('11506-3', 'Progress note'), ('18842-5', 'Discharge summary'), ('11526-1', 'Pathology study'),
+             ('11488-4', 'Consult note'), ('18748-4', 'Diagnostic imaging study')]
+LABS = [('2160-0', 'Creatinine'), ('718-7', 'Hemoglobin'), ('6690-2', 'Leukocytes'), ('777-3', 'Platelets')]
+DRUGS = [('11202', 'vincristine'), ('2555', 'carboplatin'), ('1430438', 'trametinib'), ('1424911', 'dabrafenib'),
+         ('161', 'acetaminophen'), ('5640', 'ibuprofen'), ('3264', 'dexamethasone'), ('6809', 'metformin')]
+PROCS = [('61510', 'Craniectomy for excision of brain tumor'), ('61750', 'Stereotactic biopsy of brain lesion'),
+         ('70553', 'MRI brain with and without contrast')]
+OTHER_DX = ['J06.9', 'R51.9', 'G40.909', 'H66.90', 'R11.10', 'Z00.129', 'J45.909', 'F90.9', 'R56.9', 'K59.00']
+
+SYSTEM_ICD10 = 'http://hl7.org/fhir/sid/icd-10-cm'
+SYSTEM_LOINC = 'http://loinc.org'
+SYSTEM_RXNORM = 'http://www.nlm.nih.gov/research/umls/rxnorm'
+SYSTEM_CPT = 'http://www.ama-assn.org/go/cpt'
+
+###############################################################################
+#
+# Schema
+#
+###############################################################################
+def schema() -> dict:
+    """
+    :return: dict of table name -> pyarrow schema, the columns of `core__*` the study SQL reads
+    """
+    import pyarrow as pa
+    s, d, i, f, t = pa.string(), pa.date32(), pa.int32(), pa.float64(), pa.timestamp('us')
+    return {
+        'core__encounter': pa.schema([
+            ('status', s), ('age_at_visit', i), ('gender', s), ('race_display', s), ('ethnicity_display', s),
+            ('period_start_day', d), ('period_start_week', d), ('period_start_month', d), ('period_start_year', d),
+            ('period_end_day', d), ('class_code', s), ('class_display', s),
+            ('servicetype_code', s), ('servicetype_system', s), ('servicetype_display', s),
+            ('type_code', s), ('type_system', s), ('type_display', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'core__condition': pa.schema([
+            ('category_code', s), ('code', s), ('code_display', s), ('system', s), ('recordeddate', d),
+            ('condition_ref', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'core__documentreference': pa.schema([
+            ('docstatus', s), ('type_code', s), ('type_display', s), ('type_system', s), ('author_day', d),
+            ('date', d), ('documentreference_ref', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'core__medicationrequest': pa.schema([
+            ('status', s), ('category_code', s), ('category_system', s), ('category_display', s),
+            ('medication_code', s), ('medication_display', s), ('medication_system', s), ('authoredon', d),
+            ('medicationrequest_ref', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'core__observation': pa.schema([
+            ('category_code', s), ('observation_code', s), ('observation_system', s),
+            ('valuecodeableconcept_code', s), ('valuecodeableconcept_display', s), ('valuecodeableconcept_system', s),
+            ('effectivedatetime_day', d), ('interpretation_code', s), ('interpretation_system', s),
+            ('interpretation_display', s), ('valuequantity_value', f), ('valuequantity_comparator', s),
+            ('valuequantity_unit', s), ('valuequantity_system', s), ('valuequantity_code', s), ('valuestring', s),
+            ('status', s), ('observation_ref', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'core__diagnosticreport': pa.schema([
+            ('status', s), ('category_code', s), ('category_system', s), ('category_display', s),
+            ('code_code', s), ('code_system', s), ('code_display', s), ('effectivedatetime_day', d),
+            ('diagnosticreport_ref', s), ('result_ref', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'core__procedure': pa.schema([
+            ('status', s), ('code_code', s), ('code_display', s), ('code_system', s),
+            ('performeddatetime_day', d), ('performeddatetime_month', d), ('performeddatetime_year', d),
+            ('procedure_ref', s), ('subject_ref', s), ('encounter_ref', s)]),
+        'etl__completion_encounters': pa.schema([
+            ('encounter_id', s), ('group_name', s), ('export_time', t)]),
+    }
+
+###############################################################################
+#
+# Codes
+#
+###############################################################################
+def load_casedef(filename_csv='valueset_casedef.csv') -> List[tuple]:
+    """
+    :param filename_csv: case definition valueset (system, code, display) with header
+    :return: list of (system, code, display)
+    """
+    rows = list(filetool.read_csv(filetool.path_resources(filename_csv)))
+    return [tuple(row) for row in rows[1:]]
+
+def zipf_weights(count: int, skew: float) -> List[float]:
+    """
+    :param count: number of codes
+    :param skew: Zipf exponent, 0 is uniform
+    :return: weight per rank
+    """
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+###############################################################################
+#
+# Generate
+#
+###############################################################################
+def trunc_week(day: datetime.date) -> datetime.date:
+    return day - datetime.timedelta(days=day.weekday())
+
+def trunc_month(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+def trunc_year(day: datetime.date) -> datetime.date:
+    return day.replace(month=1, day=1)
+
+def make_chunk(chunk: int, first: int, count: int, casedef: List[tuple], weights: List[float],
+               encounters=50, prevalence=0.05, notes=1.5, seed=42) -> dict:
+    """
+    Generate one chunk of patients.
+    :param chunk: chunk number, mixed into the seed
+    :param first: first patient number of this chunk
+    :param count: patients in this chunk
+    :param casedef: case definition codes
+    :param weights: Zipf weights for `casedef`
+    :param encounters: mean encounters per patient
+    :param prevalence: fraction of patients with a glioma case definition code
+    :param notes: mean documents per encounter
+    :param seed: random seed
+    :return: dict of table name -> dict of column lists
+    """
+    rng = random.Random(seed * 1_000_003 + chunk)
+    tables = {name: {col: [] for col in table.names} for name, table in schema().items()}
+    enc, dx, doc, rx, obs, diag, proc, etl = [tables[name] for name in tables]
+    exported = datetime.datetime(2025, 1, 1) + datetime.timedelta(days=chunk % 28)
+
+    def add(table, **row):
+        for col, value in row.items():
+            table[col].append(value)
+
+    for n in range(first, first + count):
+        subject_ref = f'Patient/p{n}'
+        birth = EPOCH + datetime.timedelta(days=rng.randrange(-365 * 10, EPOCH_DAYS))
+        gender = rng.choices(GENDERS, weights=[48, 48, 2, 2])[0]
+        race, ethnicity = rng.choice(RACES), rng.choice(ETHNICITIES)
+        glioma = rng.random() < prevalence
+        visits = max(1, int(rng.expovariate(1 / encounters)))
+        days = sorted(rng.randrange(max(0, (birth - EPOCH).days), EPOCH_DAYS) for _ in range(visits))
+        onset = days[rng.randrange(len(days))] if glioma else None
+
+        for v, start_offset in enumerate(days):
+            encounter_id = f'p{n}e{v}'
+            encounter_ref = f'Encounter/{encounter_id}'
+            start = EPOCH + datetime.timedelta(days=start_offset)
+            class_code, class_display = rng.choices(CLASS_CODES, weights=[80, 10, 8, 2])[0]
+            end = start + datetime.timedelta(days=rng.randrange(1, 8) if class_code == 'IMP' else 0)
+            servicetype, visit_type = rng.randrange(12), rng.randrange(20)
+            add(enc, status='finished', age_at_visit=(start - birth).days // 365, gender=gender,
+                race_display=race, ethnicity_display=ethnicity,
+                period_start_day=start, period_start_week=trunc_week(start),
+                period_start_month=trunc_month(start), period_start_year=trunc_year(start),
+                period_end_day=None if rng.random() < 0.005 else end,
+                class_code=class_code, class_display=class_display,
+                servicetype_code=f'svc{servicetype}', servicetype_system='http://terminology.hl7.org/CodeSystem/service-type',
+                servicetype_display=f'Service {servicetype}',
+                type_code=f'type{visit_type}', type_system='http://snomed.info/sct',
+                type_display=f'Visit type {visit_type}',
+                subject_ref=subject_ref, encounter_ref=encounter_ref)
+            add(etl, encounter_id=encounter_id, group_name=f'group{chunk % 4}', export_time=exported)
+
+            category = rng.choice(['encounter-diagnosis', 'problem-list-item'])
+            for c in range(rng.randrange(1, 4)):
+                if glioma and start_offset >= onset and c == 0 and rng.random() < 0.6:
+                    system, code, display = rng.choices(casedef, weights=weights)[0]
+                else:
+                    system, code = SYSTEM_ICD10, rng.choice(OTHER_DX)
+                    display = f'Condition {code}'
+                add(dx, category_code=category, code=code, code_display=display, system=system, recordeddate=start,
+                    condition_ref=f'Condition/{encounter_id}c{c}', subject_ref=subject_ref, encounter_ref=encounter_ref)
+
+            for d in range(int(rng.expovariate(1 / notes)) if notes else 0):
+                type_code, type_display = rng.choice(DOC_TYPES)
+                author_day = None if rng.random() < 0.1 else start
+                add(doc, docstatus='final', type_code=type_code, type_display=type_display, type_system=SYSTEM_LOINC,
+                    author_day=author_day, date=start, documentreference_ref=f'DocumentReference/{encounter_id}d{d}',
+                    subject_ref=subject_ref, encounter_ref=encounter_ref)
+
+            for m in range(rng.choices([0, 1, 2], weights=[60, 30, 10])[0]):
+                code, display = rng.choice(DRUGS[:4] if glioma and rng.random() < 0.5 else DRUGS)
+                add(rx, status=rng.choice(['active', 'completed', 'stopped']), category_code='outpatient',
+                    category_system='http://terminology.hl7.org/CodeSystem/medicationrequest-admin-location',
+                    category_display='Outpatient', medication_code=code, medication_display=display,
+                    medication_system=SYSTEM_RXNORM, authoredon=start,
+                    medicationrequest_ref=f'MedicationRequest/{encounter_id}m{m}',
+                    subject_ref=subject_ref, encounter_ref=encounter_ref)
+
+            for o in range(rng.choices([0, 1, 3], weights=[60, 25, 15])[0]):
+                code, display = rng.choice(LABS)
+                add(obs, category_code='laboratory', observation_code=code, observation_system=SYSTEM_LOINC,
+                    valuecodeableconcept_code=None, valuecodeableconcept_display=None, valuecodeableconcept_system=None,
+                    effectivedatetime_day=start, interpretation_code=rng.choice(['N', 'H', 'L']),
+                    interpretation_system='http://terminology.hl7.org/CodeSystem/v3-ObservationInterpretation',
+                    interpretation_display=None, valuequantity_value=round(rng.uniform(0, 20), 2),
+                    valuequantity_comparator=None, valuequantity_unit='mg/dL', valuequantity_system='http://unitsofmeasure.org',
+                    valuequantity_code='mg/dL', valuestring=None, status='final',
+                    observation_ref=f'Observation/{encounter_id}o{o}', subject_ref=subject_ref, encounter_ref=encounter_ref)
+
+            if rng.random() < 0.1:
+                code, display = rng.choice(LABS)
+                add(diag, status='final', category_code='LAB', category_system='http://terminology.hl7.org/CodeSystem/v2-0074',
+                    category_display='Laboratory', code_code=code, code_system=SYSTEM_LOINC, code_display=display,
+                    effectivedatetime_day=start, diagnosticreport_ref=f'DiagnosticReport/{encounter_id}r0',
+                    result_ref=f'Observation/{encounter_id}o0', subject_ref=subject_ref, encounter_ref=encounter_ref)
+
+            if rng.random() < (0.2 if glioma else 0.02):
+                code, display = rng.choice(PROCS)
+                add(proc, status='completed', code_code=code, code_display=display, code_system=SYSTEM_CPT,
+                    performeddatetime_day=start, performeddatetime_month=trunc_month(start),
+                    performeddatetime_year=trunc_year(start), procedure_ref=f'Procedure/{encounter_id}x0',
+                    subject_ref=subject_ref, encounter_ref=encounter_ref)
+    return tables
+
+###############################################################################
+#
+# Write
+#
+###############################################################################
+def write_chunk(out_dir: Path, chunk: int, tables: dict) -> int:
+    """
+    :param out_dir: output folder, one sub folder per table
+    :param chunk: partition number
+    :param tables: dict of table name -> dict of column lists
+    :return: rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    rows = 0
+    for name, table_schema in schema().items():
+        table = pa.table(tables[name], schema=table_schema)
+        (out_dir / name).mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, out_dir / name / f'part-{chunk:05d}.parquet', compression='zstd')
+        rows += table.num_rows
+    return rows
+
+def write_loinc(out_dir: Path) -> Path:
+    """
+    `loinc.consumer_name` is joined by `glioma__cohort_study_population_lab`
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    target = out_dir / 'loinc.consumer_name.parquet'
+    pq.write_table(pa.table({'loinc_number': [code for code, _ in LABS],
+                             'consumer_name': [display for _, display in LABS]}), target)
+    return target
+
+def make(out_dir: Path | str, patients=20000, encounters=50, prevalence=0.05, notes=1.5, skew=1.1,
+         chunk=1000, seed=42) -> Path:
+    """
+    :param out_dir: output folder
+    :param patients: number of patients
+    :param encounters: mean encounters per patient
+    :param prevalence: fraction of patients with a glioma case definition code
+    :param notes: mean documents per encounter
+    :param skew: Zipf exponent of case definition codes
+    :param chunk: patients per partition, bounds memory use
+    :param seed: random seed
+    :return: Path to output folder
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    casedef = load_casedef()
+    random.Random(seed).shuffle(casedef)
+    weights = zipf_weights(len(casedef), skew)
+
+    rows = 0
+    for part, first in enumerate(range(0, patients, chunk)):
+        count = min(chunk, patients - first)
+        tables = make_chunk(part, first, count, casedef, weights, encounters, prevalence, notes, seed)
+        rows += write_chunk(out_dir, part, tables)
+        print(f'chunk {part}: patients {first + count}/{patients}, rows {rows}')
+    write_loinc(out_dir)
+    return out_dir
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic core__* tables')
+    parser.add_argument('out_dir', help='output folder')
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--encounters', type=float, default=50, help='mean encounters per patient')
+    parser.add_argument('--prevalence', type=float, default=0.05, help='fraction of glioma patients')
+    parser.add_argument('--notes', type=float, default=1.5, help='mean documents per encounter')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of casedef codes')
+    parser.add_argument('--chunk', type=int, default=1000, help='patients per partition')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    make(args.out_dir, args.patients, args.encounters, args.prevalence, args.notes, args.skew, args.chunk, args.seed)
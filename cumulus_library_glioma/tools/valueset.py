@@ -1,9 +1,19 @@
+import os
+import re
 import csv
-import unittest
-import pandas as pd
+import mmap
+import heapq
+import bisect
+import hashlib
+import tempfile
+import itertools
 from pathlib import Path
-from fhirclient.models.coding import Coding
-from cumulus_library_glioma.tools import filetool,fhir2sql
+from array import array
+from functools import partial
+from typing import Iterator, List
+from cumulus_library_glioma.tools import filetool,fhir2sql,buildcache
+from cumulus_library_glioma.tools.codeindex import CodeIndex
+from cumulus_library_glioma.tools.codetable import CodeTable
 
 UMLS_VOCAB = {
     "SNOMEDCT_US": "http://snomed.info/sct",
@@ -12,17 +22,86 @@ UMLS_VOCAB = {
     "RXNORM": "http://www.nlm.nih.gov/research/umls/rxnorm"
 }
 
-def make_valueset_morphology():
+def make_valueset_morphology() -> Path:
     file_in = filetool.path_resources('umls_morphology.bsv')
     file_out = filetool.path_resources('valueset_morphology.csv')
-    make_valueset(file_in, file_out, UMLS_VOCAB)
+    return buildcache.build(file_out.name, lambda: make_valueset(file_in, file_out, UMLS_VOCAB),
+                            [file_in], umls_vocab=UMLS_VOCAB)
 
-def make_valueset_topography():
+def make_valueset_topography() -> Path:
     file_in = filetool.path_resources('umls_topography.bsv')
     file_out = filetool.path_resources('valueset_topography.csv')
-    make_valueset(file_in, file_out, UMLS_VOCAB)
+    return buildcache.build(file_out.name, lambda: make_valueset(file_in, file_out, UMLS_VOCAB),
+                            [file_in], umls_vocab=UMLS_VOCAB)
 
-def make_valueset(file_in:Path, file_out:Path, umls_vocab:dict):
+# Rows per sorted run of the external merge sort
+SORT_CHUNK = 200000
+
+def make_valueset(file_in:Path, file_out:Path, umls_vocab:dict, chunk_size=SORT_CHUNK) -> Path:
+    """
+    Streaming UMLS BSV -> valueset CSV in bounded memory, same output as `make_valueset_pandas`.
+    :param file_in: UMLS BSV with columns SAB, CODE, PREF
+    :param file_out: CSV of system, code, display (no header) sorted by system, code
+    :param umls_vocab: dict of UMLS SAB -> FHIR system to keep
+    :param chunk_size: rows per sorted run
+    :return: file_out
+    """
+    with open(file_out, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        for row in external_sort(dedupe_rows(read_bsv(file_in, umls_vocab)), chunk_size):
+            writer.writerow(row)
+    return Path(file_out)
+
+def read_bsv(file_in:Path, umls_vocab:dict) -> Iterator[tuple]:
+    """
+    :return: generator of (system, code, display) where SAB is mapped to system, other SAB are skipped
+    """
+    with open(file_in, newline='') as bsv_file:
+        for row in csv.DictReader(bsv_file, delimiter='|'):
+            if row['SAB'] in umls_vocab:
+                yield umls_vocab[row['SAB']], row['CODE'] or '', row['PREF'] or ''
+
+def dedupe_rows(rows:Iterator[tuple]) -> Iterator[tuple]:
+    """
+    Compact hash set: 8 byte digests of each row instead of the row strings, first occurrence wins.
+    """
+    seen = set()
+    for row in rows:
+        digest = hashlib.blake2b('\x1f'.join(row).encode(), digest_size=8).digest()
+        if digest not in seen:
+            seen.add(digest)
+            yield row
+
+def sort_key(row:tuple) -> tuple:
+    """
+    Sort by system then code, empty (NaN in pandas) last.
+    """
+    system, code = row[0], row[1]
+    return system == '', system, code == '', code
+
+def external_sort(rows:Iterator[tuple], chunk_size=SORT_CHUNK) -> Iterator[tuple]:
+    """
+    Stable external merge sort: sorted runs of `chunk_size` rows spill to temporary CSV files,
+    then `heapq.merge` (stable across runs in input order) streams the merged result.
+    """
+    rows = iter(rows)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs = list()
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            chunk.sort(key=sort_key)
+            run = Path(tmp_dir) / f'run-{len(runs):05d}.csv'
+            with open(run, 'w', newline='') as run_file:
+                csv.writer(run_file).writerows(chunk)
+            runs.append(run)
+        files = [open(run, newline='') for run in runs]
+        try:
+            yield from heapq.merge(*[map(tuple, csv.reader(file)) for file in files], key=sort_key)
+        finally:
+            for file in files:
+                file.close()
+
+def make_valueset_pandas(file_in:Path, file_out:Path, umls_vocab:dict):
+    import pandas as pd
     df = pd.read_csv(file_in, sep="|", dtype=str)
     df = df[df["SAB"].isin(umls_vocab.keys())]
     df["SAB"] = df["SAB"].replace(UMLS_VOCAB)
@@ -31,31 +110,209 @@ def make_valueset(file_in:Path, file_out:Path, umls_vocab:dict):
     df_out = df_out.sort_values(["SAB", "CODE"], ascending=[True, True])
     df_out.to_csv(file_out, header=False, index=False)
 
-def csv_to_sql(filename_csv:str) -> Path:
+def csv_to_table(filename_csv:str) -> CodeTable:
     """
-    :param filename_csv: downloaded CSV results, filtered/curated by Andy@BCH
-    :return: Path to SQL ValueSet
+    :param filename_csv: CSV of system, code, display in the resources folder
+    :return: CodeTable of every CSV row, crosswalks repeat a code for each display
     """
-    entries = list()
     csv_file = filetool.path_resources(filename_csv)
-    for columns in filetool.read_csv(csv_file):
-        c = Coding()
-        c.system = columns[0]
-        c.code = columns[1]
-        c.display = columns[2]
-        entries.append(c)
+    return CodeTable(tuple(columns[:3]) for columns in filetool.read_csv(csv_file))
+
+def csv_to_index(filename_csv:str) -> CodeIndex:
+    """
+    :param filename_csv: CSV of system, code, display in the resources folder
+    :return: CodeIndex of unique (system, code) of `csv_to_table`, for membership lookups
+    """
+    return CodeIndex(csv_to_table(filename_csv))
 
+def csv_to_sql(filename_csv:str) -> Path | None:
+    """
+    :param filename_csv: downloaded CSV results, filtered/curated by Andy@BCH
+    :return: Path to SQL ValueSet or Parquet upload, None when `valuesets.toml` already uploads the CSV
+    """
     viewname = filename_csv.replace('.csv', '')
-    return fhir2sql.define(entries, viewname)
+    return buildcache.build(f'csv_to_sql:{viewname}', lambda: fhir2sql.define(csv_to_table(filename_csv), viewname),
+                            [filetool.path_resources(filename_csv)], max_inline_values=fhir2sql.MAX_INLINE_VALUES)
+
+###############################################################################
+#
+# UMLS BSV index
+#
+###############################################################################
+UMLS_INDEX_KEYS = ['CUI', 'CODE', 'STR']
+
+def normalize_str(text:bytes) -> bytes:
+    """
+    :return: lower case with collapsed whitespace, used for STR lookups
+    """
+    return re.sub(rb'\s+', b' ', text.lower()).strip()
+
+def path_umls_index(file_bsv:Path) -> Path:
+    return Path(f'{file_bsv}.idx')
+
+def build_umls_index(file_bsv:Path=None) -> Path:
+    """
+    One time build of a compact on-disk index next to the BSV, see `UmlsIndex`.
+    * `rows.u64` byte offset of every row in file order
+    * `cui.u64`, `code.u64`, `str.u64` row offsets sorted by CUI, CODE and normalized STR
+    * `norm.txt` normalized STR of every row (newline separated) and `norm.u64` its line offsets, for substring search
+    :param file_bsv: UMLS BSV, default `umls_morphology.bsv`
+    :return: Path to index folder
+    """
+    file_bsv = Path(file_bsv) if file_bsv else filetool.path_resources('umls_morphology.bsv')
+    index_dir = path_umls_index(file_bsv)
+    index_dir.mkdir(exist_ok=True)
+    with open(file_bsv, 'rb') as bsv_file:
+        header = bsv_file.readline().decode().lstrip('#').strip().split('|')
+        cols = [header.index(key) for key in UMLS_INDEX_KEYS]
+        rows, keys = array('Q'), {key: list() for key in UMLS_INDEX_KEYS}
+        norm, norm_offsets, norm_pos = list(), array('Q'), 0
+        offset = bsv_file.tell()
+        for line in bsv_file:
+            fields = line.rstrip(b'\r\n').split(b'|')
+            if len(fields) > max(cols):
+                rows.append(offset)
+                text = normalize_str(fields[cols[2]])
+                keys['CUI'].append((fields[cols[0]], offset))
+                keys['CODE'].append((fields[cols[1]], offset))
+                keys['STR'].append((text, offset))
+                norm.append(text)
+                norm_offsets.append(norm_pos)
+                norm_pos += len(text) + 1
+            offset += len(line)
+    with open(index_dir / 'rows.u64', 'wb') as rows_file:
+        rows.tofile(rows_file)
+    with open(index_dir / 'norm.u64', 'wb') as norm_offsets_file:
+        norm_offsets.tofile(norm_offsets_file)
+    with open(index_dir / 'norm.txt', 'wb') as norm_file:
+        norm_file.write(b'\n'.join(norm) + b'\n')
+    for key, entries in keys.items():
+        entries.sort()
+        with open(index_dir / f'{key.lower()}.u64', 'wb') as key_file:
+            array('Q', [entry[1] for entry in entries]).tofile(key_file)
+    filetool.write_json({'header': header, 'size': os.path.getsize(file_bsv), 'mtime': os.path.getmtime(file_bsv)},
+                        index_dir / 'meta.json')
+    return index_dir
+
+class UmlsIndex:
+    """
+    Memory-mapped lookups over a UMLS BSV without loading it:
+
+        umls = UmlsIndex()
+        umls.by_cui('C1370507')
+        umls.contains('glioneuronal')
+    """
+    def __init__(self, file_bsv:Path=None):
+        """
+        :param file_bsv: UMLS BSV, default `umls_morphology.bsv`. The index is (re)built if missing or stale.
+        """
+        file_bsv = Path(file_bsv) if file_bsv else filetool.path_resources('umls_morphology.bsv')
+        index_dir = path_umls_index(file_bsv)
+        meta = filetool.read_json(index_dir / 'meta.json') if (index_dir / 'meta.json').exists() else None
+        if not meta or (meta.get('size'), meta.get('mtime')) != (os.path.getsize(file_bsv), os.path.getmtime(file_bsv)):
+            build_umls_index(file_bsv)
+            meta = filetool.read_json(index_dir / 'meta.json')
+        self.header = meta['header']
+        self._files = list()
+        self.bsv = self._map(file_bsv)
+        self.norm = self._map(index_dir / 'norm.txt')
+        self.rows = self._map(index_dir / 'rows.u64', 'Q')
+        self.norm_offsets = self._map(index_dir / 'norm.u64', 'Q')
+        self.sorted = {key: self._map(index_dir / f'{key.lower()}.u64', 'Q') for key in UMLS_INDEX_KEYS}
+
+    def _map(self, file_path:Path, fmt:str=None):
+        file = open(file_path, 'rb')
+        self._files.append(file)
+        if os.path.getsize(file_path) == 0:
+            return memoryview(b'').cast(fmt) if fmt else b''
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append(mapped)
+        return memoryview(mapped).cast(fmt) if fmt else mapped
+
+    def close(self):
+        for view in [self.rows, self.norm_offsets, *self.sorted.values()]:
+            view.release()
+        for file in reversed(self._files):
+            file.close()
+
+    def fields(self, offset:int) -> List[bytes]:
+        end = self.bsv.find(b'\n', offset)
+        return self.bsv[offset:end if end >= 0 else len(self.bsv)].rstrip(b'\r').split(b'|')
+
+    def row(self, offset:int) -> dict:
+        return dict(zip(self.header, [field.decode() for field in self.fields(offset)]))
+
+    def _key(self, key:str, offset:int) -> bytes:
+        value = self.fields(offset)[self.header.index(key)]
+        return normalize_str(value) if key == 'STR' else value
+
+    def lookup(self, key:str, value:str) -> List[dict]:
+        """
+        Binary search of the sorted offsets, comparing keys read from the mapped BSV.
+        :param key: CUI, CODE or STR (normalized match)
+        :param value: exact value
+        :return: list of BSV rows as dict
+        """
+        offsets = self.sorted[key]
+        target = normalize_str(value.encode()) if key == 'STR' else value.encode()
+        first = bisect.bisect_left(offsets, target, key=lambda offset: self._key(key, offset))
+        found = list()
+        for pos in range(first, len(offsets)):
+            if self._key(key, offsets[pos]) != target:
+                break
+            found.append(self.row(offsets[pos]))
+        return found
+
+    def by_cui(self, cui:str) -> List[dict]:
+        return self.lookup('CUI', cui)
+
+    def by_code(self, code:str) -> List[dict]:
+        return self.lookup('CODE', code)
+
+    def by_str(self, text:str) -> List[dict]:
+        return self.lookup('STR', text)
+
+    def contains(self, term:str) -> List[dict]:
+        """
+        :param term: case insensitive substring of STR, like 'glioneuronal'
+        :return: list of BSV rows as dict, in file order
+        """
+        needle = normalize_str(term.encode())
+        found, start, last = list(), 0, -1
+        while (hit := self.norm.find(needle, start)) >= 0:
+            line = bisect.bisect_right(self.norm_offsets, hit) - 1
+            if line != last:
+                found.append(self.row(self.rows[line]))
+                last = line
+            start = hit + 1
+        return found
 
 def make() -> list[Path]:
     make_valueset_topography()
     make_valueset_morphology()
-    return [
+    made = [
         csv_to_sql('valueset_casedef.csv'),
         csv_to_sql('valueset_casedef_candidates.csv'),
         csv_to_sql('valueset_morphology.csv')
     ]
+    return [path for path in made if path]
+
+def tasks() -> list[dict]:
+    """
+    :return: build tasks, CSV to SQL waits for the UMLS valueset CSV it reads, see `build`
+    """
+    from cumulus_library_glioma.tools import build
+    return [
+        build.make_task('valueset', 'valueset_topography.csv', make_valueset_topography),
+        build.make_task('valueset', 'valueset_morphology.csv', make_valueset_morphology),
+        build.make_task('valueset', 'csv_to_sql:valueset_casedef.csv', partial(csv_to_sql, 'valueset_casedef.csv'),
+                        reads=['valueset_casedef.csv']),
+        build.make_task('valueset', 'csv_to_sql:valueset_casedef_candidates.csv', partial(csv_to_sql, 'valueset_casedef_candidates.csv'),
+                        reads=['valueset_casedef_candidates.csv']),
+        build.make_task('valueset', 'csv_to_sql:valueset_morphology.csv', partial(csv_to_sql, 'valueset_morphology.csv'),
+                        reads=['valueset_morphology.csv'])
+    ]
 
 if __name__ == '__main__':
     make()
+    print(f'changed: {buildcache.changed()}')
@@ -0,0 +1,125 @@
+"""
+`extract` against the local mock chat completions server, see `llm.mock_server`.
+"""
+import json
+import asyncio
+import threading
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+from cumulus_library_glioma.llm import extract, mock_server
+from cumulus_library_glioma.llm.cache import ResultCache
+from cumulus_library_glioma.llm.pydantic_schema.annotation import GliomaCaseAnnotation
+
+TEXTS = [
+    'Pilocytic astrocytoma of the cerebellum, WHO grade 1. No malignant features.',
+    'Follow up visit. MRI brain stable, optic pathway glioma unchanged.',
+    'Ganglioglioma of the temporal lobe, benign behavior, gross total resection.',
+    'Well child visit, no concerns.',
+]
+
+SECTIONS = ['HISTORY:', 'PATHOLOGY:', 'Molecular:', 'IMPRESSION AND PLAN:']
+
+@pytest.fixture
+def server():
+    """
+    :return: function (latency, fail_rate) -> base_url of a mock server on a free port
+    """
+    servers = list()
+
+    def start(latency=0.0, fail_rate=0.0) -> str:
+        mock = mock_server.serve(0, latency, fail_rate)
+        threading.Thread(target=mock.serve_forever, daemon=True).start()
+        servers.append(mock)
+        return f'http://127.0.0.1:{mock.server_address[1]}/v1'
+
+    yield start
+    for mock in servers:
+        mock.shutdown()
+        mock.server_close()
+
+def make_notes(count=20) -> list:
+    return [{'note_ref': f'DocumentReference/{pos}',
+             'encounter_ref': f'Encounter/{pos}',
+             'subject_ref': f'Patient/{pos % 5}',
+             'text': f'{TEXTS[pos % len(TEXTS)]} Note {pos}.'} for pos in range(count)]
+
+def long_note() -> dict:
+    text = '\n'.join(f'{header}\n' + ' '.join([TEXTS[pos]] * 40) for pos, header in enumerate(SECTIONS))
+    return {'note_ref': 'DocumentReference/long', 'encounter_ref': 'Encounter/long',
+            'subject_ref': 'Patient/long', 'text': text}
+
+def run(notes, out, base_url, **options) -> dict:
+    return asyncio.run(extract.extract(notes, out, base_url, concurrency=4, **options))
+
+def read_rows(out) -> list:
+    with open(out, encoding='UTF-8') as lines:
+        return [json.loads(line) for line in lines]
+
+def test_retries(server, tmp_path):
+    notes = make_notes(40)
+    report = run(notes, tmp_path / 'out.ndjson', server(fail_rate=0.3), retries=10)
+    assert report['failed'] == 0
+    assert report['retries'] > 0
+    assert report['requests'] == len(notes)
+    assert len(read_rows(tmp_path / 'out.ndjson')) == len(notes)
+
+def test_output_shape(server, tmp_path):
+    notes = make_notes()
+    run(notes, tmp_path / 'out.ndjson', server())
+    rows = read_rows(tmp_path / 'out.ndjson')
+    assert sorted(row['note_ref'] for row in rows) == sorted(note['note_ref'] for note in notes)
+    for row in rows:
+        assert set(row) == {'note_ref', 'encounter_ref', 'subject_ref', 'result'}
+        assert set(row['result']) == set(GliomaCaseAnnotation.model_fields)
+
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    table = pyarrow_parquet.read_table(extract.ndjson_to_parquet(tmp_path / 'out.ndjson', tmp_path / 'out.parquet'))
+    assert table.schema == extract.arrow_schema()
+    assert table.num_rows == len(notes)
+
+def test_cache(server, tmp_path):
+    notes = make_notes()
+    result_cache = ResultCache(tmp_path / 'cache.sqlite')
+    base_url = server()
+    first = run(notes, tmp_path / 'first.ndjson', base_url, cache=result_cache)
+    second = run(notes, tmp_path / 'second.ndjson', base_url, cache=result_cache)
+    assert first['requests'] == len(notes)
+    assert second['requests'] == 0
+    assert result_cache.hits == len(notes)
+    by_ref = {row['note_ref']: row for row in read_rows(tmp_path / 'first.ndjson')}
+    assert all(by_ref[row['note_ref']] == row for row in read_rows(tmp_path / 'second.ndjson'))
+
+def test_pack(server, tmp_path):
+    notes = make_notes()
+    report = run(notes, tmp_path / 'out.ndjson', server(), context_budget=8000, max_notes=4)
+    assert report['failed'] == 0
+    assert sum(batch['notes'] for batch in report['batches']) == len(notes)
+    assert all(batch['notes'] <= 4 for batch in report['batches'])
+    assert report['requests'] == len(report['batches'])
+    assert len(read_rows(tmp_path / 'out.ndjson')) == len(notes)
+
+def test_chunk(server, tmp_path):
+    notes = make_notes(4) + [long_note()]
+    report = run(notes, tmp_path / 'out.ndjson', server(), chunk_tokens=400)
+    assert report['chunked_notes'] == 1
+    assert report['chunks'] > 1
+    assert report['requests'] == len(notes) - 1 + report['chunks']
+    rows = {row['note_ref']: row for row in read_rows(tmp_path / 'out.ndjson')}
+    assert len(rows) == len(notes)
+    assert rows['DocumentReference/long']['result']['morphology_mention']['has_mention']
+
+def test_latency_from_first_attempt():
+    responses = iter([httpx.Response(500), httpx.Response(200, json={
+        'choices': [{'message': {'content': json.dumps(mock_server.annotate(TEXTS[0]))}}], 'usage': {}})])
+    transport = httpx.MockTransport(lambda request: next(responses))
+    stats = extract.Stats()
+
+    async def complete():
+        async with httpx.AsyncClient(base_url='http://mock/v1', transport=transport) as client:
+            return await extract.complete(client, extract.make_request(TEXTS[0]), extract.RateLimiter(), stats)
+
+    asyncio.run(complete())
+    assert stats.retries == 1
+    assert stats.latency[0] >= 0.25
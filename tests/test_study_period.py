@@ -0,0 +1,43 @@
+"""
+The `single_pass` and `union` implementations of `glioma__cohort_study_period` return the same rows.
+"""
+import random
+import datetime
+import pytest
+from cumulus_library_glioma.tools import study_period
+from cumulus_library_glioma.tools.study_period import COHORT_TABLE
+
+def encounters(patients=200, seed=7) -> list:
+    """
+    :return: rows (subject_ref, period_start_day, period_end_day, encounter_ref) with NULL end days,
+             duplicate encounters, and subjects with history only
+    """
+    rng = random.Random(seed)
+    rows = list()
+    for patient in range(patients):
+        for pos in range(rng.randrange(1, 8)):
+            start = datetime.date(2000, 1, 1) + datetime.timedelta(days=rng.randrange(0, 365 * 27))
+            end = None if rng.random() < 0.05 else start + datetime.timedelta(days=rng.randrange(0, 30))
+            row = (f'Patient/{patient}', start, end, f'Encounter/{patient}.{pos}')
+            rows.extend([row] * (2 if rng.random() < 0.1 else 1))
+    rows.append(('Patient/history-only', datetime.date(2001, 2, 3), datetime.date(2001, 2, 4), 'Encounter/h.0'))
+    return rows
+
+def cohort(con, sql: str) -> list:
+    con.execute(f'DROP TABLE IF EXISTS {COHORT_TABLE}')
+    con.execute(sql)
+    return con.execute(f'SELECT * FROM {COHORT_TABLE} ORDER BY ALL').fetchall()
+
+@pytest.mark.parametrize('include_history', [True, False])
+def test_single_pass_equals_union(include_history):
+    from cumulus_library_glioma.tools.engine import connect
+    con = connect()
+    con.execute('CREATE TABLE core__encounter (subject_ref VARCHAR, period_start_day DATE, '
+                'period_end_day DATE, encounter_ref VARCHAR)')
+    con.executemany('INSERT INTO core__encounter VALUES (?, ?, ?, ?)', encounters())
+    con.execute(study_period.sql_include_study_period(include_history=include_history))
+
+    union = cohort(con, study_period.sql_cohort_study_period(single_pass=False))
+    single_pass = cohort(con, study_period.sql_cohort_study_period(single_pass=True))
+    assert union
+    assert single_pass == union